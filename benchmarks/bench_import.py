@@ -0,0 +1,154 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Benchmark of the time needed to import the good_morning modules.
+
+Every module is imported in a fresh Python interpreter (python -X importtime)
+several times and the fastest import is reported, together with the heavy
+dependencies (pandas, numpy, bs4, asyncio) the import pulled in.
+
+Usage: python benchmarks/bench_import.py [--repeat 5]
+       [--json results.json] [--baseline results.json --tolerance 0.5]
+
+With --baseline the benchmark exits with the status 1 if the import of any
+module became slower by more than the tolerance (and by more than --slack
+milliseconds) compared to the baseline, or if it pulled in a heavy
+dependency which it did not import before. Without --baseline it exits with
+the status 1 if importing the package itself pulls in a heavy dependency.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+MODULES = [u'good_morning', u'good_morning.transport', u'good_morning.cache',
+           u'good_morning.ratelimit', u'good_morning.runner',
+           u'good_morning.aio', u'good_morning.good_morning',
+           u'good_morning.batch']
+
+HEAVY = [u'pandas', u'numpy', u'bs4', u'asyncio']
+
+
+def measure(module, repeat):
+    u"""Returns the import time of the given module in a fresh interpreter.
+
+    :param module: Name of the module.
+    :param repeat: Number of fresh interpreters.
+    :return Pair (fastest import time in milliseconds, list of the heavy
+    dependencies imported with the module).
+    """
+    code = (u'import sys, %s; print(",".join(name for name in %r '
+            u'if name in sys.modules))' % (module, HEAVY))
+    env = dict(os.environ)
+    env[u'PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [env.get(u'PYTHONPATH')] if path])
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, u'-X', u'importtime', u'-c', code], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+            universal_newlines=True)
+        # The last line of the importtime report is the module itself:
+        # "import time: self [us] | cumulative | imported package".
+        total = None
+        for line in process.stderr.splitlines():
+            fields = line.split(u'|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                total = int(fields[1]) / 1000.0
+        best = total if best is None else min(best, total)
+    heavy = [name for name in process.stdout.strip().split(u',') if name]
+    return best, heavy
+
+
+def regressions(results, baseline, tolerance, slack):
+    u"""Returns the modules whose import became slower or heavier.
+
+    :param results: List of results of this run.
+    :param baseline: List of results of the baseline run.
+    :param tolerance: Allowed relative increase of the import time.
+    :param slack: Allowed absolute increase of the import time (in
+    milliseconds), so that the noise of fast imports is ignored.
+    :return List of pairs (module, description of the regression).
+    """
+    previous = dict((result[u'module'], result) for result in baseline)
+    found = []
+    for result in results:
+        old = previous.get(result[u'module'])
+        if old is None:
+            continue
+        increase = result[u'milliseconds'] - old[u'milliseconds']
+        if (increase > slack and
+                increase > tolerance * old[u'milliseconds']):
+            found.append((result[u'module'], u'%.0f%% slower' % (
+                100.0 * increase / old[u'milliseconds'])))
+        added = set(result[u'heavy']) - set(old[u'heavy'])
+        if added:
+            found.append((result[u'module'], u'imports %s' % u', '.join(
+                sorted(added))))
+    return found
+
+
+def main(argv = None):
+    u"""Runs the benchmark.
+
+    :param argv: Command line arguments (sys.argv[1:] by default).
+    :return Exit status (1 if a regression was found).
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split(u'\n')[0])
+    parser.add_argument(u'--repeat', type=int, default=5,
+                        help=u'fresh interpreters per module')
+    parser.add_argument(u'--module', action=u'append',
+                        help=u'module to be imported (all by default)')
+    parser.add_argument(u'--json', help=u'write the results to a json file')
+    parser.add_argument(u'--baseline', help=u'json file of a previous run')
+    parser.add_argument(u'--tolerance', type=float, default=0.5,
+                        help=u'allowed relative increase of the import time')
+    parser.add_argument(u'--slack', type=float, default=10.0,
+                        help=u'allowed absolute increase (milliseconds)')
+    args = parser.parse_args(argv)
+    results = []
+    print(u'%-28s %10s  %s' % (u'module', u'ms', u'heavy dependencies'))
+    for module in args.module or MODULES:
+        milliseconds, heavy = measure(module, args.repeat)
+        results.append({u'module': module, u'milliseconds': milliseconds,
+                        u'heavy': heavy})
+        print(u'%-28s %10.1f  %s' % (module, milliseconds,
+                                     u', '.join(heavy) or u'-'))
+    if args.json:
+        with open(args.json, u'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, u'r') as f:
+            found = regressions(results, json.load(f), args.tolerance,
+                                args.slack)
+    else:
+        found = [(result[u'module'], u'imports %s' % u', '.join(
+            result[u'heavy'])) for result in results
+                 if result[u'module'] == u'good_morning' and result[u'heavy']]
+    for module, description in found:
+        print(u'Regression: %s %s' % (module, description))
+    return 1 if found else 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Offline benchmark of parsing and SQL generation.
+
+Replays the recorded responses in tests/fixtures and synthetic responses of
+several sizes (good_morning.synthetic) without any network access and times
+every stage separately:
+
+* kr_parse: KeyRatiosDownloader._parse_tables and _parse_frames,
+* fin_parse_bs4 and fin_parse_fast: FinancialsDownloader._parse,
+* sql: rows of the MySQL REPLACE INTO statements of a MySQLBatch.
+
+For every stage and size it reports the throughput (tickers per second) and
+the peak memory allocated while processing a single ticker (tracemalloc).
+
+Usage: python benchmarks/bench_parse.py [--tickers 200] [--sizes 20,100,400]
+       [--json results.json] [--baseline results.json --tolerance 0.2]
+
+With --baseline the benchmark exits with the status 1 if the throughput of
+any stage dropped by more than the tolerance compared to the baseline.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from good_morning import synthetic
+from good_morning.good_morning import (
+    KeyRatiosDownloader, FinancialsDownloader, MySQLBatch)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), os.pardir, u'tests',
+                        u'fixtures')
+
+
+def load_payloads(sizes):
+    u"""Returns the list of payloads (name, key ratios body, financials html).
+
+    :param sizes: Numbers of line items of the synthetic financials.
+    :return List of triples.
+    """
+    payloads = []
+    kr_path = os.path.join(FIXTURES, u'key_ratios_aapl.csv')
+    fin_path = os.path.join(FIXTURES, u'financials_aapl_is.json')
+    if os.path.exists(kr_path) and os.path.exists(fin_path):
+        with open(kr_path, u'rb') as f:
+            kr_body = f.read()
+        with open(fin_path, u'rb') as f:
+            fin_body = f.read()
+        payloads.append((u'recorded', kr_body,
+                         json.loads(fin_body.decode(u'utf-8'))[u'result']))
+    for size in sizes:
+        payloads.append((
+            u'synthetic_%d' % size, synthetic.key_ratios_csv(seed=size),
+            json.loads(synthetic.financials_json(
+                num_items=size, seed=size).decode(u'utf-8'))[u'result']))
+    return payloads
+
+
+def stages(kr_body, html):
+    u"""Returns the list of pairs (name of the stage, function processing a
+    single ticker) for the given payload.
+    """
+    kr = KeyRatiosDownloader()
+    bs4 = FinancialsDownloader(parser=u'bs4')
+    fast = FinancialsDownloader(parser=u'fast')
+    structure = KeyRatiosDownloader._response_structure
+
+    def kr_parse():
+        tables = kr._parse_tables(kr_body.splitlines())
+        return kr._parse_frames(tables, structure)
+
+    def fin_parse_bs4():
+        return bs4._parse(html)
+
+    def fin_parse_fast():
+        return fast._parse(html)
+
+    frames = kr_parse()
+    frames[0].index.name += u' USD'
+    statement = fast._parse(html)
+    financials = {u'income_statement': statement.frame,
+                  u'balance_sheet': statement.frame,
+                  u'cash_flow': statement.frame,
+                  u'fiscal_year_end': statement.fiscal_year_end,
+                  u'currency': statement.currency}
+
+    def sql():
+        batch = MySQLBatch(None)
+        kr._add_frames_to_batch(u'SYN', frames, batch)
+        bs4._add_frames_to_batch(u'SYN', financials, batch)
+        return batch
+
+    return [(u'kr_parse', kr_parse), (u'fin_parse_bs4', fin_parse_bs4),
+            (u'fin_parse_fast', fin_parse_fast), (u'sql', sql)]
+
+
+def measure(function, tickers):
+    u"""Returns a pair (tickers per second, peak memory in bytes).
+
+    :param function: Function processing a single ticker.
+    :param tickers: Number of tickers (calls) to be timed.
+    """
+    function()
+    start = time.perf_counter()
+    for _ in range(tickers):
+        function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tickers / elapsed, peak
+
+
+def regressions(results, baseline, tolerance):
+    u"""Returns the results whose throughput dropped compared to the baseline.
+
+    :param results: List of results of this run.
+    :param baseline: List of results of the baseline run.
+    :param tolerance: Allowed relative drop of the throughput.
+    :return List of triples (stage, payload, relative drop).
+    """
+    previous = dict(((result[u'stage'], result[u'payload']),
+                     result[u'tickers_per_second']) for result in baseline)
+    dropped = []
+    for result in results:
+        key = (result[u'stage'], result[u'payload'])
+        if key in previous:
+            drop = 1.0 - result[u'tickers_per_second'] / previous[key]
+            if drop > tolerance:
+                dropped.append(key + (drop,))
+    return dropped
+
+
+def main(argv = None):
+    u"""Runs the benchmark.
+
+    :param argv: Command line arguments (sys.argv[1:] by default).
+    :return Exit status (1 if a regression was found).
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split(u'\n')[0])
+    parser.add_argument(u'--tickers', type=int, default=200,
+                        help=u'number of tickers per stage and size')
+    parser.add_argument(u'--sizes', default=u'20,100,400',
+                        help=u'line items of the synthetic financials')
+    parser.add_argument(u'--stage', action=u'append',
+                        help=u'stage to be run (all by default)')
+    parser.add_argument(u'--json', help=u'write the results to a json file')
+    parser.add_argument(u'--baseline', help=u'json file of a previous run')
+    parser.add_argument(u'--tolerance', type=float, default=0.2,
+                        help=u'allowed relative drop of the throughput')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(u',') if size]
+    results = []
+    print(u'%-16s %-16s %14s %12s' % (u'stage', u'payload', u'tickers/s',
+                                      u'peak KiB'))
+    for name, kr_body, html in load_payloads(sizes):
+        for stage, function in stages(kr_body, html):
+            if args.stage and stage not in args.stage:
+                continue
+            rate, peak = measure(function, args.tickers)
+            results.append({u'stage': stage, u'payload': name,
+                            u'tickers_per_second': rate,
+                            u'peak_bytes': peak})
+            print(u'%-16s %-16s %14.1f %12.1f' % (stage, name, rate,
+                                                  peak / 1024.0))
+    if args.json:
+        with open(args.json, u'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, u'r') as f:
+            dropped = regressions(results, json.load(f), args.tolerance)
+        for stage, name, drop in dropped:
+            print(u'Regression: %s %s is %.0f%% slower' % (
+                stage, name, 100.0 * drop))
+        if dropped:
+            return 1
+    return 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
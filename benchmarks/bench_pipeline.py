@@ -0,0 +1,106 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""End-to-end throughput benchmark of the download pipeline.
+
+Starts a local FakeMorningstarServer (good_morning.fake_server) and downloads
+synthetic companies through download_many, optionally uploading them to a
+local MySQL database. Reports tickers per second and the numbers of requests,
+errors and throttled requests seen by the server.
+
+Usage: python benchmarks/bench_pipeline.py [--tickers 500] [--workers 8]
+       [--latency 0.05] [--error-rate 0.01] [--rate-limit 100] [--adaptive]
+       [--mysql-db good_morning_bench]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from good_morning.batch import download_many
+from good_morning.fake_server import FakeMorningstarServer
+from good_morning.ratelimit import AdaptiveRateLimiter
+
+
+def main(argv = None):
+    u"""Runs the benchmark.
+
+    :param argv: Command line arguments (sys.argv[1:] by default).
+    :return Exit status (1 if any ticker failed).
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split(u'\n')[0])
+    parser.add_argument(u'--tickers', type=int, default=500)
+    parser.add_argument(u'--workers', type=int, default=8)
+    parser.add_argument(u'--latency', type=float, default=0.05)
+    parser.add_argument(u'--error-rate', type=float, default=0.0)
+    parser.add_argument(u'--rate-limit', type=float)
+    parser.add_argument(u'--num-items', type=int, default=50)
+    parser.add_argument(u'--parser', choices=[u'bs4', u'fast'],
+                        default=u'fast')
+    parser.add_argument(u'--processes', type=int,
+                        help=u'parse the responses in a pool of processes '
+                             u'(0 uses all CPUs)')
+    parser.add_argument(u'--adaptive', action=u'store_true')
+    parser.add_argument(u'--batch-size', type=int, default=50)
+    parser.add_argument(u'--bulk', action=u'store_true')
+    parser.add_argument(u'--mysql-host', default=u'localhost')
+    parser.add_argument(u'--mysql-user', default=os.environ.get(u'USER'))
+    parser.add_argument(u'--mysql-db', help=u'MySQL database (the password '
+                        u'is read from the MYSQL_PWD environment variable)')
+    args = parser.parse_args(argv)
+
+    conn = None
+    if args.mysql_db:
+        import pymysql
+        conn = pymysql.connect(
+            host=args.mysql_host, user=args.mysql_user,
+            passwd=os.environ.get(u'MYSQL_PWD', u''), db=args.mysql_db,
+            local_infile=args.bulk)
+    scheduler = AdaptiveRateLimiter(
+        rate=10.0, max_rate=1000.0, max_concurrency=args.workers) if (
+            args.adaptive) else None
+    tickers = [u'SYN%05d' % i for i in range(args.tickers)]
+    failed = 0
+    with FakeMorningstarServer(
+            latency=args.latency, error_rate=args.error_rate,
+            rate_limit=args.rate_limit, num_items=args.num_items) as server:
+        start = time.perf_counter()
+        for result in download_many(
+                tickers, conn, max_workers=args.workers, rate=None,
+                parser=args.parser, batch_size=args.batch_size,
+                bulk=args.bulk, scheduler=scheduler, base_url=server.url,
+                processes=args.processes):
+            if result.error is not None:
+                failed += 1
+        elapsed = time.perf_counter() - start
+    print(u'%d tickers (%d failed) in %.1f s: %.1f tickers/s' % (
+        args.tickers, failed, elapsed, args.tickers / elapsed))
+    print(u'%d requests, %d errors, %d throttled' % (
+        server.requests, server.errors, server.throttled))
+    if scheduler is not None:
+        print(u'Settled on %.1f requests/s, concurrency %d' % (
+            scheduler.rate, scheduler.concurrency))
+    return 1 if failed else 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
@@ -24,7 +24,48 @@
 
 from __future__ import absolute_import
 
-from good_morning.good_morning import KeyRatiosDownloader,FinancialsDownloader
+import importlib
+
+# Public name -> module defining it. The modules (and pandas, numpy and bs4
+# with them) are imported on the first access of one of their names, so that
+# importing the package (e.g. only for the transport or the cache) is fast.
+_EXPORTS = {
+    u'KeyRatiosDownloader': u'good_morning.good_morning',
+    u'FinancialsDownloader': u'good_morning.good_morning',
+    u'download_many': u'good_morning.batch',
+    u'DownloadResult': u'good_morning.batch',
+    u'ResponseCache': u'good_morning.cache',
+    u'RefreshState': u'good_morning.incremental',
+    u'Metrics': u'good_morning.metrics',
+    u'Panel': u'good_morning.panel',
+    u'ParsePool': u'good_morning.parallel',
+    u'RateLimiter': u'good_morning.ratelimit',
+    u'AdaptiveRateLimiter': u'good_morning.ratelimit',
+    u'ParquetStorage': u'good_morning.storage',
+    u'SQLiteStorage': u'good_morning.storage',
+    u'DatabaseLoader': u'good_morning.loader',
+    u'StatementTree': u'good_morning.tree',
+    u'HTTPSession': u'good_morning.transport',
+    u'AsyncHTTPSession': u'good_morning.aio',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(u'module %r has no attribute %r' % (
+            u'good_morning', name))
+    value = getattr(importlib.import_module(module), name)
+    # Later accesses do not go through __getattr__.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
 
 __name__ = 'good_morning'
 __author__ = 'Peter Cerno'
@@ -0,0 +1,318 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""asyncio HTTP transport used to download data from
+financials.morningstar.com (see the adownload methods of the downloaders).
+
+Kept apart from good_morning.transport, so that the synchronous transport
+does not pay for importing asyncio.
+"""
+
+import asyncio
+import concurrent.futures
+import http.client
+import io
+import time
+import urllib.error
+import urllib.parse
+import weakref
+
+from good_morning.metrics import NULL_METRICS
+from good_morning.transport import _MAX_REDIRECTS, _REDIRECT_CODES, _decode
+
+# Errors of a single request retried by the AsyncHTTPSession.
+_ASYNC_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                 asyncio.LimitOverrunError, http.client.HTTPException)
+
+
+class AsyncHTTPSession(object):
+    u"""Pooled keep-alive HTTP session for asyncio.
+
+    The asyncio counterpart of HTTPSession (used by the adownload methods of
+    the downloaders): connections are kept open and reused, responses are
+    requested compressed (gzip or deflate) and failed requests are retried
+    with an exponential backoff. Both Content-Length delimited and chunked
+    responses are supported. The session is bound to the event loop in which
+    it is first used.
+
+    If the scheduler (e.g. good_morning.AdaptiveRateLimiter) is specified then
+    every request waits for the scheduler and reports its outcome back to it.
+    The scheduler blocks, so it is waited for in separate threads and the
+    event loop keeps running.
+    """
+
+    def __init__(self, timeout = 30.0, retries = 3, backoff = 0.5,
+                 max_connections = 10, max_concurrency = 100,
+                 scheduler = None, metrics = None):
+        u"""Constructs the AsyncHTTPSession instance.
+
+        :param timeout: Timeout of a single request (in seconds).
+        :param retries: Maximum number of retries of a failed request.
+        :param backoff: Delay before the first retry (in seconds); the delay
+        doubles with every further retry.
+        :param max_connections: Maximum number of idle connections kept open
+        per host.
+        :param max_concurrency: Maximum number of requests in flight.
+        :param scheduler: Scheduler of the requests, i.e. an object with the
+        methods acquire() and release(success, latency).
+        :param metrics: Metrics registry counting the requests (by status),
+        the retries and the transferred (compressed) bytes.
+        """
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_connections = max_connections
+        self._max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._scheduler = scheduler
+        # Threads waiting for the scheduler (created on first use, apart from
+        # the default executor, which parses the responses).
+        self._scheduler_executor = None
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        # (scheme, host, port) -> list of idle (reader, writer) pairs.
+        self._pool = {}
+
+    async def get(self, url):
+        u"""Downloads and returns the (decompressed) body of the given URL.
+
+        :param url: URL to be downloaded.
+        :return Body of the response (bytes).
+        """
+        error = None
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                self._metrics.increment(u'good_morning_http_retries_total')
+                await asyncio.sleep(self._backoff * 2 ** (attempt - 1))
+            async with self._semaphore:
+                acquired = False
+                success = False
+                try:
+                    if self._scheduler is not None:
+                        await self._schedule()
+                        acquired = True
+                    start = time.monotonic()
+                    try:
+                        status, reason, headers, body, final_url = (
+                            await asyncio.wait_for(self._get(url),
+                                                   self._timeout))
+                    except _ASYNC_ERRORS as e:
+                        self._metrics.increment(
+                            u'good_morning_http_requests_total',
+                            status=u'error')
+                        error = e
+                        continue
+                    self._metrics.increment(
+                        u'good_morning_http_requests_total', status=status)
+                    self._metrics.increment(u'good_morning_http_bytes_total',
+                                            len(body))
+                    if status == 429 or status >= 500:
+                        error = urllib.error.HTTPError(
+                            final_url, status, reason, headers, None)
+                        continue
+                    if status < 400:
+                        body = _decode(body, headers.get(u'Content-Encoding'))
+                    # The server refuses some requests with an empty body.
+                    success = status >= 400 or len(body) > 0
+                finally:
+                    if acquired:
+                        self._scheduler.release(success,
+                                                time.monotonic() - start)
+            if status >= 400:
+                raise urllib.error.HTTPError(
+                    final_url, status, reason, headers, None)
+            return body
+        raise error
+
+    async def close(self):
+        u"""Closes all the idle connections.
+        """
+        pool, self._pool = self._pool, {}
+        for connections in pool.values():
+            for _, writer in connections:
+                writer.close()
+        if self._scheduler_executor is not None:
+            self._scheduler_executor.shutdown(wait=False)
+            self._scheduler_executor = None
+
+    async def _schedule(self):
+        u"""Waits for the scheduler without blocking the event loop.
+        """
+        if self._scheduler_executor is None:
+            self._scheduler_executor = concurrent.futures.ThreadPoolExecutor(
+                self._max_concurrency,
+                thread_name_prefix=u'good_morning_scheduler')
+        future = asyncio.get_running_loop().run_in_executor(
+            self._scheduler_executor, self._scheduler.acquire)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The request acquired after the cancellation is released.
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or
+                self._scheduler.release(True, None))
+            raise
+
+    async def _get(self, url):
+        u"""Sends a single GET request, following redirects.
+
+        :param url: URL to be downloaded.
+        :return Tuple (status, reason, headers, body, final_url).
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            status, reason, headers, body = await self._request(url)
+            location = headers.get(u'Location')
+            if status not in _REDIRECT_CODES or not location:
+                break
+            url = urllib.parse.urljoin(url, location)
+        return status, reason, headers, body, url
+
+    async def _request(self, url):
+        u"""Sends a single GET request over a pooled connection.
+
+        A request failing on a reused connection (which might have been
+        closed by the server in the meantime) is repeated once over a new
+        connection.
+
+        :param url: URL to be downloaded.
+        :return Tuple (status, reason, headers, body).
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == u'https' else 80))
+        path = parts.path or u'/'
+        if parts.query:
+            path += u'?' + parts.query
+        request = (u'GET %s HTTP/1.1\r\nHost: %s\r\n'
+                   u'Accept-Encoding: gzip, deflate\r\n'
+                   u'Connection: keep-alive\r\n\r\n' % (
+                       path, parts.netloc)).encode(u'latin-1')
+        while True:
+            (reader, writer), reused = await self._acquire(key)
+            try:
+                writer.write(request)
+                status, reason, headers, body, will_close = (
+                    await _read_response(reader))
+            except _ASYNC_ERRORS:
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # Cancelled (e.g. timed out) in the middle of the response.
+                writer.close()
+                raise
+            if will_close:
+                writer.close()
+            else:
+                self._release(key, (reader, writer))
+            return status, reason, headers, body
+
+    async def _acquire(self, key):
+        u"""Returns a pair ((reader, writer), reused) for the given host.
+        """
+        connections = self._pool.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            # Skip the connections closed by the server while idle.
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer), True
+            writer.close()
+        scheme, host, port = key
+        return await asyncio.open_connection(
+            host, port, ssl=scheme == u'https'), False
+
+    def _release(self, key, connection):
+        u"""Returns the given connection back to the pool.
+        """
+        connections = self._pool.setdefault(key, [])
+        if len(connections) < self._max_connections:
+            connections.append(connection)
+        else:
+            connection[1].close()
+
+
+async def _read_response(reader):
+    u"""Helper method for reading an HTTP/1.1 response from a stream.
+
+    :param reader: asyncio.StreamReader.
+    :return Tuple (status, reason, headers, body, will_close), where
+    will_close tells whether the connection cannot be reused.
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, _, header_lines = head.partition(b'\r\n')
+    try:
+        version, status, reason = (
+            status_line.decode(u'latin-1').split(u' ', 2) + [u''])[:3]
+        status = int(status)
+    except ValueError:
+        raise http.client.BadStatusLine(status_line)
+    headers = http.client.parse_headers(io.BytesIO(header_lines))
+    connection = (headers.get(u'Connection') or u'').lower()
+    will_close = (connection == u'close' or
+                  (version == u'HTTP/1.0' and connection != u'keep-alive'))
+    length = headers.get(u'Content-Length')
+    if status in (204, 304) or 100 <= status < 200:
+        body = b''
+    elif u'chunked' in (headers.get(u'Transfer-Encoding') or u'').lower():
+        body = await _read_chunked(reader)
+    elif length is not None:
+        body = await reader.readexactly(int(length))
+    else:
+        # The body ends with the connection.
+        body = await reader.read()
+        will_close = True
+    return status, reason.strip(), headers, body, will_close
+
+
+async def _read_chunked(reader):
+    u"""Helper method for reading a chunked body from a stream.
+
+    :param reader: asyncio.StreamReader.
+    :return Body of the response (bytes).
+    """
+    chunks = []
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        try:
+            size = int(line.split(b';', 1)[0], 16)
+        except ValueError:
+            raise http.client.IncompleteRead(b''.join(chunks))
+        if size == 0:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    # Skip the trailer.
+    while await reader.readuntil(b'\r\n') != b'\r\n':
+        pass
+    return b''.join(chunks)
+
+
+# Event loop -> AsyncHTTPSession shared by all downloaders by default.
+_default_async_sessions = weakref.WeakKeyDictionary()
+
+
+def default_async_session():
+    u"""Returns the AsyncHTTPSession shared by all downloaders by default in
+    the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    session = _default_async_sessions.get(loop)
+    if session is None:
+        session = _default_async_sessions[loop] = AsyncHTTPSession()
+    return session
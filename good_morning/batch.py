@@ -0,0 +1,243 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Concurrent download of key ratios and financials for many tickers.
+"""
+
+import collections
+import concurrent.futures
+
+from good_morning.good_morning import (
+    KeyRatiosDownloader, FinancialsDownloader, MySQLBatch, _BASE_URL)
+from good_morning.parallel import ParsePool
+from good_morning.ratelimit import RateLimiter
+from good_morning.transport import HTTPSession
+
+DownloadResult = collections.namedtuple(
+    u'DownloadResult', [u'ticker', u'key_ratios', u'financials', u'error'])
+DownloadResult.__doc__ = u"""Result of downloading a single Morningstar ticker.
+
+key_ratios is the list returned by KeyRatiosDownloader.download, financials is
+the dictionary returned by FinancialsDownloader.download (either of them is
+None if it was not requested or the download failed) and error is the
+exception raised while downloading the ticker (None on success).
+"""
+
+# Parameters of the requests (region, culture, currency) of download_many.
+_KEY_RATIOS_REQUEST = (u'GBR', u'en_US', u'USD')
+_FINANCIALS_REQUEST = (u'usa', u'en-US', u'USD')
+
+
+def download_many(tickers, conn = None, max_workers = 8, rate = 1.0,
+                  key_ratios = True, financials = True,
+                  table_prefix = u'morningstar_', cache = None,
+                  transport = None, parser = u'bs4', batch_size = 50,
+                  bulk = False, storage = None, state = None,
+                  scheduler = None, base_url = _BASE_URL, metrics = None,
+                  processes = None):
+    u"""Downloads key ratios and financials for many Morningstar tickers.
+
+    Tickers are downloaded concurrently by a bounded pool of worker threads,
+    while the start of every ticker is throttled by a global rate limit. The
+    results are yielded in the order in which the downloads finish. If the
+    MySQL connection is specified then the downloaded data is uploaded to the
+    MySQL database from the calling thread (so the connection is never shared
+    between threads) in batches of batch_size tickers, each committed at once.
+    If the storage backend is specified then the downloaded data is written to
+    it from the calling thread as well and the storage backend is flushed
+    together with every batch. Results are yielded only after their batch is
+    committed. If the RefreshState is specified then only the new or changed
+    data is uploaded and the state is committed together with every batch (or
+    with every result if there is nothing to upload) and saved once per batch
+    of batch_size tickers and at the end.
+
+    :param tickers: Iterable of Morningstar tickers.
+    :param conn: MySQL connection.
+    :param max_workers: Maximum number of tickers downloaded at the same time.
+    :param rate: Maximum number of tickers started per second (None disables
+    the rate limit).
+    :param key_ratios: Whether to download the key ratios.
+    :param financials: Whether to download the financials.
+    :param table_prefix: Prefix of the MySQL tables.
+    :param cache: ResponseCache shared by the downloaders.
+    :param transport: Transport shared by the downloaders (by default a new
+    HTTPSession keeping up to max_workers connections open and using the
+    given scheduler).
+    :param parser: Parser of the financial statements ('bs4' or 'fast').
+    :param batch_size: Number of tickers uploaded to the MySQL database in a
+    single batch.
+    :param bulk: Whether to upload the batches with LOAD DATA LOCAL INFILE
+    (see MySQLBatch).
+    :param storage: Storage backend (e.g. good_morning.ParquetStorage).
+    :param state: RefreshState enabling the incremental refresh (the
+    key_ratios or the financials of a result are None if they did not change
+    since the last run).
+    :param scheduler: Scheduler of the requests of the default transport (e.g.
+    AdaptiveRateLimiter; combine it with rate=None to let the scheduler alone
+    control the rate).
+    :param base_url: Base URL of the requests (e.g. of a
+    good_morning.fake_server.FakeMorningstarServer).
+    :param metrics: Metrics registry shared by the downloaders, the default
+    transport and the MySQL batches (see good_morning.metrics).
+    :param processes: Number of processes parsing the responses (see
+    good_morning.parallel.ParsePool; 0 uses all CPUs). By default the
+    responses are parsed in the worker threads.
+    :return Generator of DownloadResult tuples.
+    """
+    if transport is None:
+        transport = HTTPSession(max_connections=max_workers,
+                                scheduler=scheduler, metrics=metrics)
+    kr = KeyRatiosDownloader(table_prefix, cache, transport, state=state,
+                             base_url=base_url, metrics=metrics)
+    fd = FinancialsDownloader(table_prefix, cache, transport, parser,
+                              state=state, base_url=base_url, metrics=metrics)
+    limiter = RateLimiter(rate)
+    pool = (ParsePool(processes or None, metrics)
+            if processes is not None else None)
+
+    def download_ticker(ticker):
+        limiter.acquire()
+        kr_frames = None
+        fin_result = None
+        try:
+            if key_ratios:
+                kr_frames = kr._download(ticker, *_KEY_RATIOS_REQUEST,
+                                         pool=pool)
+            if financials:
+                fin_result = fd._download(ticker, *_FINANCIALS_REQUEST,
+                                          pool=pool)
+        except Exception as e:
+            return DownloadResult(ticker, kr_frames, fin_result, e)
+        return DownloadResult(ticker, kr_frames, fin_result, None)
+
+    batch = MySQLBatch(conn, bulk, metrics) if conn else None
+    staging = batch is not None or storage is not None
+    # Results whose data is waiting in the batch to be committed.
+    staged = []
+    # Number of results committed to the RefreshState since its last save.
+    unsaved = 0
+    tickers = iter(tickers)
+    pending = set()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            # Keep the queue of submitted tickers bounded, so that a huge
+            # universe does not create all of its futures upfront.
+            for ticker in tickers:
+                pending.add(executor.submit(download_ticker, ticker))
+                if len(pending) >= 2 * max_workers:
+                    break
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if state is not None:
+                    if result.error is not None:
+                        state.discard([result.ticker])
+                    elif not staging:
+                        state.commit([result.ticker], save=False)
+                        unsaved += 1
+                        if unsaved >= batch_size:
+                            state.save()
+                            unsaved = 0
+                if not staging or result.error is not None:
+                    yield result
+                    continue
+                try:
+                    if storage is not None:
+                        _store(storage, result)
+                    if batch is not None:
+                        _add_to_batch(kr, fd, batch, result)
+                except Exception as e:
+                    if state is not None:
+                        state.discard([result.ticker])
+                    yield result._replace(error=e)
+                    continue
+                staged.append(result)
+                if len(staged) >= batch_size:
+                    for result in _commit(batch, storage, state, staged):
+                        yield result
+                    staged = []
+        for result in _commit(batch, storage, state, staged):
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+        if pool is not None:
+            pool.close()
+        if state is not None:
+            state.save()
+
+
+def _store(storage, result):
+    u"""Writes the data of the given result to the storage backend.
+
+    :param storage: Storage backend.
+    :param result: DownloadResult tuple.
+    """
+    if result.key_ratios is not None:
+        storage.write_key_ratios(result.ticker, result.key_ratios)
+    if result.financials is not None:
+        storage.write_financials(result.ticker, result.financials)
+
+
+def _add_to_batch(kr, fd, batch, result):
+    u"""Adds the data of the given result to the MySQLBatch.
+
+    :param kr: KeyRatiosDownloader.
+    :param fd: FinancialsDownloader.
+    :param batch: MySQLBatch.
+    :param result: DownloadResult tuple.
+    """
+    if result.key_ratios is not None:
+        kr._add_frames_to_batch(result.ticker, result.key_ratios, batch,
+                                _KEY_RATIOS_REQUEST)
+    if result.financials is not None:
+        fd._add_frames_to_batch(result.ticker, result.financials, batch,
+                                _FINANCIALS_REQUEST)
+
+
+def _commit(batch, storage, state, results):
+    u"""Commits the given MySQLBatch (flushes the storage backend) and returns
+    the corresponding results.
+
+    :param batch: MySQLBatch to be committed (or None).
+    :param storage: Storage backend to be flushed (or None).
+    :param state: RefreshState to be committed (or None).
+    :param results: List of DownloadResult tuples whose data is in the batch.
+    :return List of DownloadResult tuples (with the error set if the commit
+    failed).
+    """
+    if not results:
+        return []
+    try:
+        if storage is not None:
+            storage.flush()
+        if batch is not None:
+            batch.commit()
+    except Exception as e:
+        if state is not None:
+            state.discard([result.ticker for result in results])
+        return [result._replace(error=e) for result in results]
+    if state is not None:
+        state.commit([result.ticker for result in results])
+    return results
@@ -0,0 +1,203 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Persistent on-disk cache of responses from financials.morningstar.com.
+"""
+
+import collections
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Every cache entry starts with its expiration time (seconds since epoch).
+_HEADER = struct.Struct(u'>d')
+_SUFFIX = u'.cache'
+
+
+class ResponseCache(object):
+    u"""Stores raw response bodies compressed on disk.
+
+    Every entry expires after its time to live (TTL). The total size of the
+    cache is bounded; when it grows over max_size the least recently used
+    entries are evicted. The cache can be shared by many threads and by many
+    processes: every entry is a file of its own, lookups go to the file
+    system, and the in-memory index of the sizes (used for the eviction) is
+    rebuilt from the directory every rescan seconds.
+    """
+
+    def __init__(self, directory, ttl = 24 * 3600,
+                 max_size = 512 * 1024 * 1024, rescan = 60.0):
+        u"""Constructs the ResponseCache instance.
+
+        :param directory: Directory in which the entries are stored.
+        :param ttl: Default time to live of an entry (in seconds).
+        :param max_size: Maximum total size of the entries (in bytes).
+        :param rescan: Number of seconds after which the index is rebuilt
+        from the directory (picking up the entries of other processes).
+        """
+        self._directory = directory
+        self._ttl = ttl
+        self._max_size = max_size
+        self._rescan = rescan
+        self._lock = threading.Lock()
+        # File name -> size, ordered from the least recently used entry.
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._scanned = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._scan()
+
+    @staticmethod
+    def key(ticker, report_type, region, culture, currency, base_url = u''):
+        u"""Returns the cache key of the given request.
+
+        :param ticker: Morningstar ticker.
+        :param report_type: Type of the report ('kr', 'is', 'bs', 'cf').
+        :param region: Region of the request.
+        :param culture: Culture of the request.
+        :param currency: Currency of the request.
+        :param base_url: Base URL of the server (so that a cache shared by
+        several servers, e.g. a FakeMorningstarServer, keeps them apart).
+        :return Cache key.
+        """
+        return u'|'.join([ticker, report_type, region, culture, currency,
+                          base_url])
+
+    def get(self, key):
+        u"""Returns the cached response body for the given key.
+
+        :param key: Cache key (obtained from ResponseCache.key).
+        :return Response body or None if there is no valid entry. Truncated
+        or corrupt entries are deleted and count as missing.
+        """
+        name = self._file_name(key)
+        path = os.path.join(self._directory, name)
+        with self._lock:
+            # The entry may have been written (or removed) by another process.
+            try:
+                with open(path, u'rb') as f:
+                    content = f.read()
+            except IOError:
+                self._forget(name)
+                return None
+            if name not in self._entries:
+                self._entries[name] = len(content)
+                self._size += len(content)
+            try:
+                (expires,) = _HEADER.unpack_from(content)
+            except struct.error:
+                self._remove(name)
+                return None
+            if expires < time.time():
+                self._remove(name)
+                return None
+            self._entries.move_to_end(name)
+            os.utime(path, None)
+        try:
+            return zlib.decompress(content[_HEADER.size:])
+        except zlib.error:
+            with self._lock:
+                self._remove(name)
+            return None
+
+    def put(self, key, body, ttl = None):
+        u"""Stores the response body under the given key.
+
+        :param key: Cache key (obtained from ResponseCache.key).
+        :param body: Response body (bytes).
+        :param ttl: Time to live of the entry (in seconds). If not specified
+        then the default TTL of the cache is used.
+        """
+        expires = time.time() + (self._ttl if ttl is None else ttl)
+        content = _HEADER.pack(expires) + zlib.compress(body)
+        name = self._file_name(key)
+        path = os.path.join(self._directory, name)
+        temp_path = u'%s.%d.%d.tmp' % (
+            path, os.getpid(), threading.get_ident())
+        with open(temp_path, u'wb') as f:
+            f.write(content)
+        with self._lock:
+            os.replace(temp_path, path)
+            if time.monotonic() - self._scanned >= self._rescan:
+                self._scan()
+            self._forget(name)
+            self._entries[name] = len(content)
+            self._size += len(content)
+            while self._size > self._max_size and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        u"""Removes all the entries from the cache.
+        """
+        with self._lock:
+            for name in list(self._entries):
+                self._remove(name)
+
+    @property
+    def size(self):
+        u"""Total size of the cached entries (in bytes).
+        """
+        return self._size
+
+    @staticmethod
+    def _file_name(key):
+        u"""Returns the name of the file storing the given key.
+        """
+        return hashlib.sha1(key.encode(u'utf-8')).hexdigest() + _SUFFIX
+
+    def _scan(self):
+        u"""Rebuilds the index from the files in the directory, ordered by
+        their modification times (the lock must be held, except in the
+        constructor).
+        """
+        files = []
+        for name in os.listdir(self._directory):
+            if name.endswith(_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self._directory, name))
+                except OSError:
+                    # Removed by another process.
+                    continue
+                files.append((stat.st_mtime, name, stat.st_size))
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        self._scanned = time.monotonic()
+
+    def _forget(self, name):
+        u"""Drops the given file from the index (the lock must be held).
+        """
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._size -= size
+
+    def _remove(self, name):
+        u"""Deletes the given file from the cache (the lock must be held).
+        """
+        self._forget(name)
+        try:
+            os.remove(os.path.join(self._directory, name))
+        except OSError:
+            pass
@@ -0,0 +1,251 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Local stand-in for financials.morningstar.com used for load testing.
+
+The server answers the key ratios (exportKR2CSV.html) and the financial
+statements (ReportProcess4HtmlAjax.html) endpoints with recorded responses
+(if available) or with synthetic companies (good_morning.synthetic). Latency,
+error rate and rate limit are configurable. Point the downloaders at it with
+their base_url parameter.
+
+Usage: python -m good_morning.fake_server --port 8080 --latency 0.05
+"""
+
+import argparse
+import gzip
+import http.server
+import os
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+
+from good_morning import synthetic
+
+# Suffixes of the recorded responses (e.g. AAPL.kr.csv, AAPL.is.json).
+_FIXTURE_SUFFIXES = {u'kr': u'.kr.csv', u'is': u'.is.json',
+                     u'bs': u'.bs.json', u'cf': u'.cf.json'}
+
+
+class FakeMorningstarServer(object):
+    u"""Threaded HTTP server mimicking financials.morningstar.com.
+
+    Every response is delayed by the latency, a fraction (error_rate) of the
+    requests fails with HTTP 503 and the requests over the rate limit are
+    refused with HTTP 429. Tickers outside of the given universe get an empty
+    body, as on the real site. The numbers of requests, errors and throttled
+    requests are available as attributes.
+    """
+
+    def __init__(self, host = u'127.0.0.1', port = 0, latency = 0.0,
+                 error_rate = 0.0, rate_limit = None, tickers = None,
+                 fixtures = None, num_items = 50, seed = 0):
+        u"""Constructs the FakeMorningstarServer instance.
+
+        :param host: Host to listen on.
+        :param port: Port to listen on (0 selects a free port).
+        :param latency: Delay of every response (in seconds).
+        :param error_rate: Fraction of the requests failing with HTTP 503.
+        :param rate_limit: Maximum number of requests per second (None for
+        no limit); requests over the limit fail with HTTP 429.
+        :param tickers: Iterable of the known tickers (all tickers are known
+        by default).
+        :param fixtures: Directory with the recorded responses (e.g.
+        AAPL.kr.csv, AAPL.is.json, AAPL.bs.json, AAPL.cf.json).
+        :param num_items: Number of line items of the synthetic financial
+        statements.
+        :param seed: Seed of the synthetic responses and of the errors.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.tickers = set(tickers) if tickers is not None else None
+        self.fixtures = fixtures
+        self.num_items = num_items
+        self.seed = seed
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._last = time.monotonic()
+        self._thread = None
+        self._server = _HTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        u"""Base URL of the server (to be passed as base_url).
+        """
+        host, port = self._server.server_address[:2]
+        return u'http://%s:%d' % (host, port)
+
+    def start(self):
+        u"""Starts serving in a background thread.
+
+        :return The server itself.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        u"""Serves in the calling thread until interrupted.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        u"""Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def response(self, path):
+        u"""Returns the pair (status, body) of the response to the given path.
+
+        :param path: Path (including the query) of the request.
+        :return Pair (HTTP status, body of the response).
+        """
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(
+                    float(self.rate_limit),
+                    self._tokens + (now - self._last) * self.rate_limit)
+                self._last = now
+                if self._tokens < 1.0:
+                    self.throttled += 1
+                    return 429, b''
+                self._tokens -= 1.0
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return 503, b''
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urllib.parse.urlsplit(path)
+        query = urllib.parse.parse_qs(parts.query)
+        ticker = query.get(u't', [u''])[0]
+        if parts.path.endswith(u'/exportKR2CSV.html'):
+            report_type = u'kr'
+        elif parts.path.endswith(u'/ReportProcess4HtmlAjax.html'):
+            report_type = query.get(u'reportType', [u'is'])[0]
+        else:
+            return 404, b''
+        if not ticker or (self.tickers is not None and
+                          ticker not in self.tickers):
+            return 200, b''
+        return 200, self._body(ticker, report_type)
+
+    def _body(self, ticker, report_type):
+        u"""Returns the recorded or the synthetic response. Only the files
+        directly in the fixtures directory are served (tickers like
+        '../secret' get a synthetic response).
+        """
+        if self.fixtures and report_type in _FIXTURE_SUFFIXES:
+            root = os.path.realpath(self.fixtures)
+            path = os.path.realpath(os.path.join(
+                root, ticker + _FIXTURE_SUFFIXES[report_type]))
+            if os.path.dirname(path) == root and os.path.isfile(path):
+                with open(path, u'rb') as f:
+                    return f.read()
+        seed = zlib.crc32((u'%s|%s|%s' % (ticker, report_type, self.seed))
+                          .encode(u'utf-8'))
+        if report_type == u'kr':
+            return synthetic.key_ratios_csv(ticker, seed=seed)
+        return synthetic.financials_json(self.num_items, seed=seed)
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    u"""Threading HTTP server accepting hundreds of concurrent connections
+    (the default listen backlog of 5 drops connections under load).
+    """
+    request_queue_size = 1024
+
+
+def _make_handler(server):
+    u"""Returns the request handler class of the given server.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = u'HTTP/1.1'
+
+        def do_GET(self):
+            status, body = server.response(self.path)
+            encoding = None
+            if body and u'gzip' in self.headers.get(u'Accept-Encoding', u''):
+                body = gzip.compress(body, compresslevel=1)
+                encoding = u'gzip'
+            self.send_response(status)
+            if encoding:
+                self.send_header(u'Content-Encoding', encoding)
+            self.send_header(u'Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main(argv = None):
+    u"""Runs the fake server from the command line.
+
+    :param argv: Command line arguments (sys.argv[1:] by default).
+    """
+    parser = argparse.ArgumentParser(
+        description=u'Local stand-in for financials.morningstar.com.')
+    parser.add_argument(u'--host', default=u'127.0.0.1')
+    parser.add_argument(u'--port', type=int, default=8080)
+    parser.add_argument(u'--latency', type=float, default=0.0,
+                        help=u'delay of every response in seconds')
+    parser.add_argument(u'--error-rate', type=float, default=0.0,
+                        help=u'fraction of the requests failing with 503')
+    parser.add_argument(u'--rate-limit', type=float,
+                        help=u'requests per second (429 over the limit)')
+    parser.add_argument(u'--fixtures', help=u'directory with recorded '
+                        u'responses (TICKER.kr.csv, TICKER.is.json, ...)')
+    parser.add_argument(u'--num-items', type=int, default=50,
+                        help=u'line items of the synthetic statements')
+    args = parser.parse_args(argv)
+    server = FakeMorningstarServer(
+        args.host, args.port, args.latency, args.error_rate,
+        args.rate_limit, fixtures=args.fixtures, num_items=args.num_items)
+    print(u'Serving on %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == u'__main__':
+    main()
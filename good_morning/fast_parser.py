@@ -0,0 +1,232 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Fast parser of the financial statements from financials.morningstar.com.
+
+The parser extracts the labels, the raw values and the units of a financial
+statement in a single linear scan over the HTML tokens, without building a
+document tree. It produces the same output as the BeautifulSoup based parser
+of FinancialsDownloader.
+"""
+
+import html
+import re
+
+_TOKEN_PATTERN = re.compile(
+    r'<!--.*?-->|<![^>]*>|<\?[^>]*>|'
+    r'<(/?)([A-Za-z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>|'
+    r'([^<]+)', re.S)
+_ATTR_PATTERN = re.compile(
+    r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+)))?')
+_VOID_TAGS = frozenset([u'area', u'base', u'br', u'col', u'embed', u'hr',
+                        u'img', u'input', u'link', u'meta', u'param',
+                        u'source', u'track', u'wbr'])
+
+# Roles of the elements whose direct children are interpreted by the parser.
+_LABELS = 1
+_DATA = 2
+_VALUES = 3
+_YEAR = 4
+
+# Regions of the document (inherited by all descendants of an element).
+_IN_LEFT = 1
+_IN_LABELS = 2
+_IN_MAIN = 4
+_IN_TABLE = 8
+_IN_YEAR = 16
+
+
+class _Element(object):
+    u"""Open element on the stack of the parser.
+    """
+    __slots__ = [u'tag', u'role', u'flags', u'parent_index', u'label',
+                 u'text', u'target']
+
+    def __init__(self, tag, flags, label):
+        self.tag = tag
+        self.role = None
+        self.flags = flags
+        # Index of the parent label (for the elements containing labels).
+        self.parent_index = None
+        # Innermost label containing the element.
+        self.label = label
+        # Collected text and the pair (list, index) where it is stored.
+        self.text = None
+        self.target = None
+
+
+def parse_statement(document):
+    u"""Extracts the content of the given HTML financial statement.
+
+    :param document: HTML code of the financial statement (the 'result' item
+    of the JSON response from financials.morningstar.com).
+    :return Tuple (year_start, num_periods, fiscal_year_end, currency, labels,
+    data), where year_start is the text of the first year (e.g. 2011-09),
+    labels is the list of triples (label_id, parent_index, title) and data is
+    the list of pairs (data_id, list of values).
+    """
+    # Labels are lists [label_id, parent_index, title, title_found].
+    labels = []
+    data = []
+    num_periods = 0
+    # Text of the first year and the units (fiscal_year_end, currency).
+    year_start = [None]
+    unit = None
+    left_found = labels_found = main_found = table_found = False
+    year_found = year_start_found = False
+    stack = [_Element(None, 0, None)]
+    text_elements = []
+    for match in _TOKEN_PATTERN.finditer(document):
+        tag = match.group(2)
+        if tag is None:
+            text = match.group(4)
+            if text is not None and text_elements:
+                if u'&' in text:
+                    text = html.unescape(text)
+                for element in text_elements:
+                    element.text.append(text)
+            continue
+        tag = tag.lower()
+        if match.group(1):
+            # Closing tag: pop all the elements up to the matching one.
+            for i in range(len(stack) - 1, 0, -1):
+                if stack[i].tag == tag:
+                    for element in stack[i:]:
+                        if element.text is not None:
+                            container, index = element.target
+                            container[index] = u''.join(element.text)
+                            text_elements.remove(element)
+                    del stack[i:]
+                    break
+            continue
+        attr_text = match.group(3)
+        attrs = {}
+        if attr_text:
+            for attr_match in _ATTR_PATTERN.finditer(attr_text):
+                name, value1, value2, value3 = attr_match.groups()
+                value = (value1 if value1 is not None else
+                         value2 if value2 is not None else
+                         value3 if value3 is not None else u'')
+                if u'&' in value:
+                    value = html.unescape(value)
+                attrs.setdefault(name.lower(), value)
+        parent = stack[-1]
+        element = _Element(tag, parent.flags, parent.label)
+        element_id = attrs.get(u'id', u'')
+        classes = attrs.get(u'class', u'').split()
+
+        # Direct children of the elements with a role.
+        if parent.role == _LABELS:
+            if u'r_content' in classes:
+                element.role = _LABELS
+                element.parent_index = len(labels) - 1
+            elif _is_visible(element_id, u'label', attrs):
+                label = [element_id[6:],
+                         (parent.parent_index
+                          if parent.parent_index is not None
+                          else len(labels)), None, False]
+                labels.append(label)
+                element.label = label
+        elif parent.role == _DATA:
+            if u'r_content' in classes:
+                element.role = _DATA
+            elif _is_visible(element_id, u'data', attrs):
+                element.role = _VALUES
+                data.append((element_id[5:], []))
+        elif parent.role == _VALUES:
+            try:
+                value = float(attrs[u'rawvalue'])
+            except (KeyError, ValueError):
+                value = None
+            data[-1][1].append(value)
+        elif parent.role == _YEAR:
+            num_periods += 1
+
+        if tag == u'div':
+            label = parent.label
+            if label is not None and not label[3]:
+                # First div inside the label contains its title.
+                label[3] = True
+                if u'title' in attrs:
+                    label[2] = attrs[u'title']
+                else:
+                    _collect_text(element, (label, 2), text_elements)
+            if not left_found and u'left' in classes:
+                left_found = True
+                element.flags |= _IN_LEFT
+            elif not labels_found and parent.flags & _IN_LEFT:
+                labels_found = True
+                element.role = _LABELS
+                element.flags |= _IN_LABELS
+            elif not main_found and u'main' in classes:
+                main_found = True
+                element.flags |= _IN_MAIN
+            elif (not table_found and parent.flags & _IN_MAIN and
+                  u'rf_table' in classes):
+                table_found = True
+                element.role = _DATA
+                element.flags |= _IN_TABLE
+            if (unit is None and parent.flags & _IN_LABELS and
+                    element_id == u'unitsAndFiscalYear'):
+                unit = (int(attrs[u'fyenumber']), attrs[u'currency'])
+            if (not year_found and parent.flags & _IN_TABLE and
+                    element_id == u'Year'):
+                year_found = True
+                element.role = _YEAR
+                element.flags |= _IN_YEAR
+            elif not year_start_found and parent.flags & _IN_YEAR:
+                year_start_found = True
+                _collect_text(element, (year_start, 0), text_elements)
+
+        if tag not in _VOID_TAGS and not attr_text.rstrip().endswith(u'/'):
+            stack.append(element)
+        elif element.text is not None:
+            container, index = element.target
+            container[index] = u''
+            text_elements.remove(element)
+    if not (labels_found and table_found and year_found and unit):
+        raise ValueError(u'Unexpected structure of the financial statement.')
+    return (year_start[0], num_periods, unit[0], unit[1],
+            [(label_id, parent_index, title)
+             for label_id, parent_index, title, _ in labels], data)
+
+
+def _is_visible(element_id, prefix, attrs):
+    u"""Returns True iff the given element is a visible label or data row.
+
+    :param element_id: Id of the element.
+    :param prefix: Expected prefix of the id ('label' or 'data').
+    :param attrs: Dictionary of the attributes of the element.
+    """
+    return (element_id.startswith(prefix) and
+            not element_id.endswith(u'padding') and
+            u'display:none' not in attrs.get(u'style', u''))
+
+
+def _collect_text(element, target, text_elements):
+    u"""Starts collecting the text of the given element.
+
+    :param element: Element whose text is collected.
+    :param target: Pair (list, index) where the text is stored once the
+    element is closed.
+    :param text_elements: List of the elements collecting their text.
+    """
+    element.text = []
+    element.target = target
+    text_elements.append(element)
@@ -21,11 +21,10 @@
 financials.morningstar.com for all tickers in S&P 500 (October 2015).
 """
 
-import time
-
 import pymysql
 
-from good_morning import good_morning as gm
+from good_morning.ratelimit import AdaptiveRateLimiter
+from good_morning.runner import Journal, run
 
 DB_HOST = 'db_host'
 DB_USER = 'db_user'
@@ -34,9 +33,6 @@ DB_NAME = 'db_name'
 
 conn = pymysql.connect(host=DB_HOST, user=DB_USER, passwd=DB_PASS, db=DB_NAME)
 
-kr = gm.KeyRatiosDownloader()
-fd = gm.FinancialsDownloader()
-
 # Taken from: https://en.wikipedia.org/wiki/List_of_S%26P_500_companies
 # Notes:
 # * Instead of BF-B use BF.B.
@@ -92,12 +88,14 @@ sp500_2015_10 = [
     'WU', 'WY', 'WYN', 'WYNN', 'XEC', 'XEL', 'XL', 'XLNX', 'XOM', 'XRAY', 'XRX',
     'XYL', 'YHOO', 'YUM', 'ZBH', 'ZION', 'ZTS']
 
-for ticker in sp500_2015_10:
-    print(ticker, end='')
-    try:
-        kr.download(ticker, conn)
-        fd.download(ticker, conn)
-        time.sleep(1)
-        print(' ... success')
-    except Exception as e:
-        print(' ... failed', e)
+# Completed tickers are recorded in the journal, so that an interrupted run
+# continues where it stopped. Failed tickers are retried with a backoff.
+journal = Journal('good_download.journal')
+try:
+    # The request rate adapts to the responses of the server.
+    errors = run(sp500_2015_10, journal, conn=conn, max_workers=4, rate=None,
+                 scheduler=AdaptiveRateLimiter(rate=1.0))
+finally:
+    journal.close()
+for ticker, error in sorted(errors.items()):
+    print(ticker, '... failed', error)
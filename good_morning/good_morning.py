@@ -20,25 +20,97 @@
 """Module for downloading financial data from financials.morningstar.com.
 """
 
+import bisect
+import collections
 import csv
+import functools
+import io
 import json
 import numpy as np
 import pandas as pd
+import os
 import re
-import urllib.request
-from bs4 import BeautifulSoup
-from datetime import date
+import tempfile
+import threading
+import weakref
+from datetime import date, datetime
+
+from good_morning.fast_parser import parse_statement
+from good_morning.incremental import digest
+from good_morning.metrics import NULL_METRICS, STAGE_SECONDS
+from good_morning.transport import default_session
+from good_morning.tree import StatementTree
+
+# Default base URL of the downloaders.
+_BASE_URL = u'http://financials.morningstar.com'
+
+# Pattern of the cells containing periods (e.g. 2015-09).
+_PERIOD_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+# Pairs (report type, name of the financial statement).
+_REPORTS = [(u'is', u'income_statement'),
+            (u'bs', u'balance_sheet'),
+            (u'cf', u'cash_flow')]
+
+_Statement = collections.namedtuple(
+    u'_Statement',
+    [u'frame', u'period_range', u'fiscal_year_end', u'currency'])
+
 
 class KeyRatiosDownloader(object):
     u"""Downloads key ratios from http://financials.morningstar.com/
     """
 
-    def __init__(self, table_prefix = u'morningstar_'):
+    # Expected tables of the csv response.
+    _response_structure = [
+        # Original Name, New pandas.DataFrame Name
+        (u'Financials', u'Key Financials'),
+        (u'Key Ratios -> Profitability', u'Key Margins % of Sales'),
+        (u'Key Ratios -> Profitability', u'Key Profitability'),
+        (u'Key Ratios -> Growth', None),
+        (u'Revenue %', u'Key Revenue %'),
+        (u'Operating Income %', u'Key Operating Income %'),
+        (u'Net Income %', u'Key Net Income %'),
+        (u'EPS %', u'Key EPS %'),
+        (u'Key Ratios -> Cash Flow', u'Key Cash Flow Ratios'),
+        (u'Key Ratios -> Financial Health',
+         u'Key Balance Sheet Items (in %)'),
+        (u'Key Ratios -> Financial Health',
+         u'Key Liquidity/Financial Health'),
+        (u'Key Ratios -> Efficiency Ratios', u'Key Efficiency Ratios')]
+
+    def __init__(self, table_prefix = u'morningstar_', cache = None,
+                 transport = None, storage = None, state = None,
+                 base_url = _BASE_URL, metrics = None,
+                 async_transport = None):
         u"""Constructs the KeyRatiosDownloader instance.
 
         :param table_prefix: Prefix of the MySQL tables.
+        :param cache: ResponseCache used to store the raw responses.
+        :param transport: Transport used to download the responses, i.e. an
+        object with the method get(url) returning the body of the response
+        (by default the HTTPSession shared by all downloaders).
+        :param storage: Storage backend (e.g. good_morning.ParquetStorage)
+        the downloaded key ratios are written to.
+        :param state: RefreshState enabling the incremental refresh.
+        :param base_url: Base URL of the requests (e.g. of a
+        good_morning.fake_server.FakeMorningstarServer).
+        :param metrics: Metrics registry recording the latency of the stages
+        and the transferred bytes (see good_morning.metrics).
+        :param async_transport: Transport used by adownload, i.e. an object
+        with the coroutine method get(url) returning the body of the response
+        (by default the AsyncHTTPSession shared by all downloaders in the
+        running event loop).
         """
         self._table_prefix = table_prefix
+        self._storage = storage
+        self._state = state
+        self._base_url = base_url.rstrip(u'/')
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        self._cache = cache
+        self._transport = (transport if transport is not None
+                           else default_session())
+        self._async_transport = async_transport
 
     def download(self, ticker, conn = None, region = 'GBR', culture = 'en_US', currency = 'USD'):
         u"""Downloads and returns key ratios for the given Morningstar ticker.
@@ -46,89 +118,252 @@ class KeyRatiosDownloader(object):
         Downloads and returns an array of pandas.DataFrames containing the key
         ratios for the given Morningstar ticker. If the MySQL connection is
         specified then the downloaded key ratios are uploaded to the MySQL
-        database.
+        database. If the storage backend is specified then the downloaded key
+        ratios are also written to the storage backend. If the RefreshState is
+        specified then only the new or changed periods are uploaded to the
+        MySQL database.
+
+        :param ticker: Morningstar ticker.
+        :param conn: MySQL connection.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return: List of pandas.DataFrames containing the key ratios (None if
+        the RefreshState is specified and the key ratios did not change since
+        the last run).
+        """
+        frames = self._download(ticker, region, culture, currency)
+        if frames is None:
+            return None
+        if conn:
+            self._upload_frames_to_db(ticker, frames, conn,
+                                      (region, culture, currency))
+        if self._storage is not None:
+            self._storage.write_key_ratios(ticker, frames)
+            self._storage.flush()
+        if self._state is not None:
+            self._state.commit([ticker], (region, culture, currency))
+        return frames
+
+    def _download(self, ticker, region = 'GBR', culture = 'en_US',
+                  currency = 'USD', pool = None):
+        u"""Downloads and returns key ratios for the given Morningstar ticker
+        (without uploading them). If the RefreshState is specified then the
+        hashes of the response and of its periods are staged.
+
+        :param ticker: Morningstar ticker.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :param pool: ParsePool parsing the response in another process (by
+        default the response is parsed in the calling thread).
+        :return: List of pandas.DataFrames containing the key ratios (None if
+        the key ratios did not change since the last run).
+        """
+        body = self._fetch_body(ticker, region, culture, currency)
+        if body is None:
+            return None
+        if pool is not None:
+            frames = pool.key_ratios(body)
+        else:
+            frames = self._parse_body(body, self._metrics)
+        self._stage(ticker, body, frames, (region, culture, currency))
+        return frames
+
+    def _fetch_body(self, ticker, region = 'GBR', culture = 'en_US',
+                    currency = 'USD'):
+        u"""Downloads and returns the raw csv response with the key ratios for
+        the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return Raw body of the response (None if the RefreshState is
+        specified and the response did not change since the last run).
+        """
+
+        ############################
+        # Error Handling for Ratios
+        ############################
+
+        # Empty String
+        if len(ticker) == 0:
+            raise ValueError("You did not enter a ticker symbol.  Please"
+                             " try again.")
+
+        url = self._url(ticker, region, culture, currency)
+        body = _fetch(url, self._transport, self._cache,
+                      (ticker, u'kr', region, culture, currency,
+                       self._base_url),
+                      self._metrics, u'key_ratios')
+        if (self._state is not None and
+                self._state.unchanged(ticker, u'kr', body,
+                                      (region, culture, currency))):
+            return None
+        return body
+
+    async def adownload(self, ticker, conn = None, region = 'GBR',
+                        culture = 'en_US', currency = 'USD', pool = None):
+        u"""Downloads and returns key ratios for the given Morningstar ticker
+        (the asyncio counterpart of download).
+
+        The response is parsed in the default executor of the event loop (or
+        in the given ParsePool) and the MySQL upload and the storage backend
+        run in the default executor as well, so the event loop is never
+        blocked.
 
         :param ticker: Morningstar ticker.
         :param conn: MySQL connection.
         :param region: Sets the region.
         :param culture: Sets culture.
         :param currency: Sets currency.
+        :param pool: ParsePool parsing the response in another process.
+        :return: List of pandas.DataFrames containing the key ratios (None if
+        the RefreshState is specified and the key ratios did not change since
+        the last run).
+        """
+        # asyncio is imported only by the async entry points (see
+        # good_morning.aio).
+        import asyncio
+        frames = await self._adownload(ticker, region, culture, currency,
+                                       pool)
+        if frames is None:
+            return None
+        loop = asyncio.get_running_loop()
+        if conn:
+            await loop.run_in_executor(None, self._upload_frames_to_db,
+                                       ticker, frames, conn,
+                                       (region, culture, currency))
+        if self._storage is not None:
+            await loop.run_in_executor(None, self._storage.write_key_ratios,
+                                       ticker, frames)
+            await loop.run_in_executor(None, self._storage.flush)
+        if self._state is not None:
+            self._state.commit([ticker], (region, culture, currency))
+        return frames
+
+    async def _adownload(self, ticker, region = 'GBR', culture = 'en_US',
+                         currency = 'USD', pool = None):
+        u"""Downloads and returns key ratios for the given Morningstar ticker
+        (the asyncio counterpart of _download).
+        """
+        import asyncio
+        if len(ticker) == 0:
+            raise ValueError("You did not enter a ticker symbol.  Please"
+                             " try again.")
+        body = await _afetch(
+            self._url(ticker, region, culture, currency),
+            self._async_transport, self._cache,
+            (ticker, u'kr', region, culture, currency, self._base_url),
+            self._metrics, u'key_ratios')
+        if (self._state is not None and
+                self._state.unchanged(ticker, u'kr', body,
+                                      (region, culture, currency))):
+            return None
+        if pool is not None:
+            frames = await pool.akey_ratios(body)
+        else:
+            frames = await asyncio.get_running_loop().run_in_executor(
+                None, self._parse_body, body, self._metrics)
+        self._stage(ticker, body, frames, (region, culture, currency))
+        return frames
+
+    def _url(self, ticker, region, culture, currency):
+        u"""Returns the URL of the csv response with the key ratios.
+
+        :param ticker: Morningstar ticker.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return URL of the response.
+        """
+        return (self._base_url + r'/ajax/exportKR2CSV.html?' +
+                r'&callback=?&t={t}&region={reg}&culture={cult}&cur={cur}'.format(
+                    t=ticker, reg=region, cult=culture, cur=currency))
+
+    @staticmethod
+    def _parse_body(body, metrics = NULL_METRICS):
+        u"""Parses the given raw csv response with the key ratios.
+
+        Does not depend on the state of the downloader, so it can be run in
+        another process (see good_morning.parallel).
+
+        :param body: Raw body of the response (bytes).
+        :param metrics: Metrics registry recording the latency of the stages.
         :return: List of pandas.DataFrames containing the key ratios.
         """
-        url = (r'http://financials.morningstar.com/ajax/exportKR2CSV.html?' +
-               r'&callback=?&t={t}&region={reg}&culture={cult}&cur={cur}'.format(
-                   t=ticker, reg=region, cult=culture, cur=currency))
-        with urllib.request.urlopen(url) as response:
-            tables = self._parse_tables(response)
-            response_structure = [
-                # Original Name, New pandas.DataFrame Name
-                (u'Financials', u'Key Financials'),
-                (u'Key Ratios -> Profitability', u'Key Margins % of Sales'),
-                (u'Key Ratios -> Profitability', u'Key Profitability'),
-                (u'Key Ratios -> Growth', None),
-                (u'Revenue %', u'Key Revenue %'),
-                (u'Operating Income %', u'Key Operating Income %'),
-                (u'Net Income %', u'Key Net Income %'),
-                (u'EPS %', u'Key EPS %'),
-                (u'Key Ratios -> Cash Flow', u'Key Cash Flow Ratios'),
-                (u'Key Ratios -> Financial Health',
-                 u'Key Balance Sheet Items (in %)'),
-                (u'Key Ratios -> Financial Health',
-                 u'Key Liquidity/Financial Health'),
-                (u'Key Ratios -> Efficiency Ratios', u'Key Efficiency Ratios')]
-            frames = self._parse_frames(tables, response_structure)
-
-            ############################
-            # Error Handling for Ratios
-            ############################
-
-            # Empty String
-            if len(ticker) == 0:
-                raise ValueError("You did not enter a ticker symbol.  Please"
-                                 " try again.")
-            # Wrong ticker symbol
-            elif frames == "MorningStar could not find the ticker":
-                raise ValueError("MorningStar cannot find the ticker symbol "
-                                 "you entered or it is INVALID. Please try "
-                                 "again.")
-
-            currency = re.match(u'^.* ([A-Z]+) Mil$',
-                                frames[0].index[0]).group(1)
-            frames[0].index.name += u' ' + currency
-            if conn:
-                self._upload_frames_to_db(ticker, frames, conn)
-            return frames
+        with metrics.timer(STAGE_SECONDS, stage=u'decode',
+                           source=u'key_ratios'):
+            lines = body.decode(u'utf-8').splitlines()
+        with metrics.timer(STAGE_SECONDS, stage=u'parse',
+                           source=u'key_ratios'):
+            tables = KeyRatiosDownloader._parse_tables(lines)
+        with metrics.timer(STAGE_SECONDS, stage=u'frame',
+                           source=u'key_ratios'):
+            frames = KeyRatiosDownloader._parse_frames(
+                tables, KeyRatiosDownloader._response_structure)
+
+        # Wrong ticker symbol
+        if frames == "MorningStar could not find the ticker":
+            raise ValueError("MorningStar cannot find the ticker symbol "
+                             "you entered or it is INVALID. Please try "
+                             "again.")
+
+        currency = re.match(u'^.* ([A-Z]+) Mil$',
+                            frames[0].index[0]).group(1)
+        frames[0].index.name += u' ' + currency
+        return frames
+
+    def _stage(self, ticker, body, frames, request = ()):
+        u"""Stages the hashes of the given response and of the periods of its
+        key ratios in the RefreshState (if specified).
+
+        :param ticker: Morningstar ticker.
+        :param body: Raw body of the response.
+        :param frames: List of pandas.DataFrames parsed from the response.
+        :param request: Parameters of the request (region, culture,
+        currency).
+        """
+        if self._state is not None:
+            self._state.stage(ticker, u'kr', body, dict(
+                part for frame in frames for part in self._get_parts(frame)),
+                request)
 
     @staticmethod
     def _parse_tables(response):
         u"""Parses the given csv response from financials.morningstar.com.
 
-        :param response: Response from financials.morningstar.com.
+        The response is read in a single pass. Lines containing financial data
+        are recognized by counting their commas and every table is split into
+        csv rows by a single csv.reader.
+
+        :param response: Lines of the response from
+        financials.morningstar.com (either str or utf-8 encoded bytes).
         :return: List of pairs, where the first item is the name of the table
-        (extracted from the response) and the second item is the corresponding
-        pandas.DataFrame table containing the data.
+        (extracted from the response) and the second item is the list of csv
+        rows (lists of strings) of the corresponding table.
         """
-        # Regex pattern used to recognize csv lines containing financial data.
+        # Minimum number of commas in csv lines containing financial data.
         num_commas = 5
-        pat_commas = r'(.*,){%d,}' % num_commas
-        # Resulting array of pairs (table_name, table_frame).
+        # Resulting array of pairs (table_name, table_rows).
         tables = []
         table_name = None
-        table_rows = None
+        table_lines = []
         for line in response:
-            line = line.decode(u'utf-8').strip()
-            match = re.match(pat_commas, line)
-            if match:
-                for row in csv.reader([line]):
-                    table_rows.append(row)
+            if isinstance(line, bytes):
+                line = line.decode(u'utf-8')
+            line = line.strip()
+            if line.count(u',') >= num_commas:
+                table_lines.append(line)
             else:
-                if table_name and table_rows:
-                    tables.append([table_name, pd.DataFrame(table_rows)])
+                if table_name and table_lines:
+                    tables.append([table_name, list(csv.reader(table_lines))])
                 if line != u'':
                     table_name = line
-                table_rows = []
-        if table_name and table_rows:
-            tables.append([table_name, pd.DataFrame(table_rows)])
+                table_lines = []
+        if table_name and table_lines:
+            tables.append([table_name, list(csv.reader(table_lines))])
         return tables
 
     @staticmethod
@@ -149,9 +384,8 @@ class KeyRatiosDownloader(object):
         if len(tables) == 0:
             return ("MorningStar could not find the ticker")
 
-        period_start = tables[0][1].ix[0][1]
-        period_month = pd.datetime.strptime(period_start, u'%Y-%m').month
-        #period_freq = pd.datetools.YearEnd(month=period_month)
+        period_start = tables[0][1][0][1]
+        period_month = datetime.strptime(period_start, u'%Y-%m').month
         period_freq = pd.tseries.offsets.YearEnd(month=period_month)
         frames = []
         for index, (check_name, frame_name) in enumerate(response_structure):
@@ -163,46 +397,78 @@ class KeyRatiosDownloader(object):
         return frames
 
     @staticmethod
-    def _process_frame(frame, frame_name, period_start,
+    def _process_frame(rows, frame_name, period_start,
                        period_freq):
-        u"""Returns a processed pandas.DataFrame based on the original frame.
+        u"""Returns a processed pandas.DataFrame based on the original csv
+        rows of a table.
 
-        :param frame: Original pandas.DataFrame to be processed.
+        The values are converted directly into a preallocated float array,
+        which then backs the resulting pandas.DataFrame.
+
+        :param rows: Original csv rows (lists of strings) to be processed.
         :param frame_name: New name assigned to the processed pandas.DataFrame.
         :param period_start: Start of the period.
         :param period_freq: Frequency of the period.
-        :return Processed pandas.DataFrame based on the original frame.
-        """
-        output_frame = frame.set_index(frame[0])
-        del output_frame[0]
-        output_frame.index.name = frame_name
-        output_frame.columns = pd.period_range(period_start,
-                                               periods=len(output_frame.ix[0]),
-                                               freq=period_freq)
-        output_frame.columns.name = u'Period'
-        if re.match(r'^\d{4}-\d{2}$', output_frame.ix[0][0]):
-            output_frame.drop(output_frame.index[0], inplace=True)
-        output_frame.replace(u',', u'', regex=True, inplace=True)
-        output_frame.replace(u'^\s*$', u'NaN', regex=True, inplace=True)
-        return output_frame.astype(float)
+        :return Processed pandas.DataFrame based on the original rows.
+        """
+        num_periods = max(len(row) for row in rows) - 1
+        if len(rows[0]) > 1 and _PERIOD_PATTERN.match(rows[0][1]):
+            # Header row with the periods.
+            rows = rows[1:]
+        values = np.full((len(rows), num_periods), np.nan)
+        nan = np.nan
+        for i, row in enumerate(rows):
+            values[i, :len(row) - 1] = [
+                float(cell.replace(u',', u'')) if cell.strip() else nan
+                for cell in row[1:]]
+        index = pd.Index([row[0] for row in rows], name=frame_name)
+        columns = pd.period_range(period_start, periods=num_periods,
+                                  freq=period_freq)
+        columns.name = u'Period'
+        return pd.DataFrame(values, index=index, columns=columns)
 
     def _upload_frames_to_db(self, ticker, frames,
-                             conn):
+                             conn, request = ()):
         u"""Uploads the given array of pandas.DataFrames to the MySQL database.
 
         :param ticker: Morningstar ticker.
         :param frames: Array of pandas.DataFrames to be uploaded.
         :param conn: MySQL connection.
+        :param request: Parameters of the request (region, culture,
+        currency).
+        """
+        batch = MySQLBatch(conn, metrics=self._metrics)
+        self._add_frames_to_batch(ticker, frames, batch, request)
+        batch.commit()
+
+    def _add_frames_to_batch(self, ticker, frames, batch, request = ()):
+        u"""Adds the given array of pandas.DataFrames to the MySQLBatch.
+
+        :param ticker: Morningstar ticker.
+        :param frames: Array of pandas.DataFrames to be uploaded.
+        :param batch: MySQLBatch collecting the rows to be uploaded.
+        :param request: Parameters of the request (region, culture,
+        currency).
         """
+        changed = (self._state.changed(ticker, u'kr', request)
+                   if self._state is not None else None)
         for frame in frames:
-            table_name = self._get_db_table_name(frame)
-            if not _db_table_exists(table_name, conn):
-                _db_execute(self._get_db_create_table(frame), conn)
-            _db_execute(self._get_db_replace_values(ticker, frame), conn)
+            columns, rows = self._get_db_replace_values(ticker, frame)
+            if changed is not None:
+                # Only the new or changed periods.
+                rows = [row for row, (part, _) in
+                        zip(rows, self._get_parts(frame)) if part in changed]
+                if not rows:
+                    continue
+            batch.add(self._get_db_table_name(frame),
+                      self._get_db_create_table(frame), columns, rows,
+                      self._get_db_columns(frame))
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def _get_db_name(name):
         u"""Returns a new (cleaned) name that can be used in a MySQL database.
+        The names are cached (there are only a few hundred distinct labels).
 
         :param name: Original name.
         :return Name that can be used in a MySQL database.
@@ -230,13 +496,12 @@ class KeyRatiosDownloader(object):
         :param frame: pandas.DataFrame.
         :return MySQL CREATE TABLE statement.
         """
-        columns = (u',\n'.
-                   join([u'  `%s` DECIMAL(20,5) DEFAULT NULL COMMENT "%s"' %
-                         (self._get_db_name(name), name) for name in
-                         frame.index.values]))
+        columns = u',\n'.join(
+            [u'  `%s` %s' % column for column in
+             self._get_db_columns(frame).items()])
         table_name = self._get_db_table_name(frame)
         return (
-            u'CREATE TABLE `%s` (\n' % table_name +
+            u'CREATE TABLE IF NOT EXISTS `%s` (\n' % table_name +
             u'  `ticker` VARCHAR(50) NOT NULL COMMENT "Exchange:Ticker",\n' +
             u'  `period` DATE NOT NULL COMMENT "Period",\n' +
             u'%s,\n' % columns +
@@ -245,51 +510,169 @@ class KeyRatiosDownloader(object):
             u'ENGINE=MyISAM DEFAULT CHARSET=utf8\n' +
             u'COMMENT = "%s"' % frame.index.name)
 
-    def _get_db_replace_values(self, ticker, frame):
-        u"""Returns the MySQL REPLACE INTO statement for the given
-        Morningstar ticker and the corresponding pandas.DataFrame.
+    @staticmethod
+    def _get_db_columns(frame):
+        u"""Returns the MySQL definitions of the value columns for the given
+        pandas.DataFrame.
+
+        :param frame: pandas.DataFrame.
+        :return Ordered dictionary mapping the MySQL column names to their
+        definitions.
+        """
+        return collections.OrderedDict(
+            [(KeyRatiosDownloader._get_db_name(name),
+              u'DECIMAL(20,5) DEFAULT NULL COMMENT "%s"' % name)
+             for name in frame.index.values])
+
+    @staticmethod
+    def _get_db_replace_values(ticker, frame):
+        u"""Returns the columns and the rows of the MySQL REPLACE INTO
+        statement for the given Morningstar ticker and the corresponding
+        pandas.DataFrame.
 
         :param ticker: Morningstar ticker.
         :param frame: pandas.DataFrame.
-        :return MySQL REPLACE INTO statement.
+        :return Pair (columns, rows), where columns is the list of MySQL
+        column names and rows is the list of rows (lists of values, where
+        None represents NULL).
         """
-        columns = ([u'`ticker`', u'`period`'] +
-                   [u'`%s`' % self._get_db_name(name) for name in
-                    frame.index.values])
-        return (
-            u'REPLACE INTO `%s`\n' % self._get_db_table_name(frame) +
-            u'  (%s)\nVALUES\n' % u',\n   '.join(columns) +
-            u',\n'.join([u'("' + ticker + u'", "' + column.strftime(u'%Y-%m-%d') +
-                        u'", ' +
-                        u', '.join([u'NULL' if np.isnan(x) else u'%.5f' % x
-                                   for x in frame[column].values]) +
-                        u')' for column in frame.columns]))
+        columns = ([u'ticker', u'period'] +
+                   [KeyRatiosDownloader._get_db_name(name)
+                    for name in frame.index.tolist()])
+        periods = [column.strftime(u'%Y-%m-%d') for column in frame.columns]
+        return columns, [[ticker, period] + values for period, values in
+                         zip(periods, _db_values(frame.values.T))]
+
+    @staticmethod
+    def _get_parts(frame):
+        u"""Returns the parts (periods) of the given pandas.DataFrame tracked
+        by the RefreshState.
+
+        :param frame: pandas.DataFrame.
+        :return List of pairs (name of the part, hash of the part), one for
+        every period.
+        """
+        labels = u'\n'.join(frame.index.values)
+        return [(u'%s|%s' % (frame.index.name, period.strftime(u'%Y-%m')),
+                 digest(labels, frame.values[:, i].tobytes()))
+                for i, period in enumerate(frame.columns)]
 
 
 class FinancialsDownloader(object):
     u"""Downloads financials from http://financials.morningstar.com/
     """
 
-    def __init__(self, table_prefix = u'morningstar_'):
+    def __init__(self, table_prefix = u'morningstar_', cache = None,
+                 transport = None, parser = u'bs4', storage = None,
+                 state = None, base_url = _BASE_URL, metrics = None,
+                 async_transport = None):
         u"""Constructs the FinancialsDownloader instance.
 
         :param table_prefix: Prefix of the MySQL tables.
+        :param cache: ResponseCache used to store the raw responses.
+        :param transport: Transport used to download the responses, i.e. an
+        object with the method get(url) returning the body of the response
+        (by default the HTTPSession shared by all downloaders).
+        :param parser: Parser of the financial statements, either 'bs4'
+        (BeautifulSoup) or 'fast' (single pass tokenizer producing identical
+        frames, see good_morning.fast_parser).
+        :param storage: Storage backend (e.g. good_morning.ParquetStorage)
+        the downloaded financials are written to.
+        :param state: RefreshState enabling the incremental refresh.
+        :param base_url: Base URL of the requests (e.g. of a
+        good_morning.fake_server.FakeMorningstarServer).
+        :param metrics: Metrics registry recording the latency of the stages
+        and the transferred bytes (see good_morning.metrics).
+        :param async_transport: Transport used by adownload, i.e. an object
+        with the coroutine method get(url) returning the body of the response
+        (by default the AsyncHTTPSession shared by all downloaders in the
+        running event loop).
         """
+        if parser not in (u'bs4', u'fast'):
+            raise ValueError(u'Unknown parser: %s' % parser)
+        self._parser = parser
         self._table_prefix = table_prefix
+        self._storage = storage
+        self._state = state
+        self._base_url = base_url.rstrip(u'/')
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        self._cache = cache
+        self._transport = (transport if transport is not None
+                           else default_session())
+        self._async_transport = async_transport
 
-    def download(self, ticker, conn = None):
+    def download(self, ticker, conn = None, region = u'usa',
+                 culture = u'en-US', currency = u'USD'):
         u"""Downloads and returns a dictionary containing pandas.DataFrames
         representing the financials (i.e. income statement, balance sheet,
         cash flow) for the given Morningstar ticker. If the MySQL connection
         is specified then the downloaded financials are uploaded to the MySQL
-        database.
+        database. If the storage backend is specified then the downloaded
+        financials are also written to the storage backend. If the
+        RefreshState is specified then only the new or changed rows are
+        uploaded to the MySQL database.
 
         :param ticker: Morningstar ticker.
         :param conn: MySQL connection.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
         :return Dictionary containing pandas.DataFrames representing the
-        financials for the given Morningstar ticker.
+        financials for the given Morningstar ticker and their StatementTrees
+        under 'trees' (None if the RefreshState is specified and the
+        financials did not change since the last run).
+        """
+        result = self._download(ticker, region, culture, currency)
+        if result is None:
+            return None
+        if conn:
+            self._upload_frames_to_db(ticker, result, conn,
+                                      (region, culture, currency))
+        if self._storage is not None:
+            self._storage.write_financials(ticker, result)
+            self._storage.flush()
+        if self._state is not None:
+            self._state.commit([ticker], (region, culture, currency))
+        return result
+
+    def _download(self, ticker, region = u'usa', culture = u'en-US',
+                  currency = u'USD', pool = None):
+        u"""Downloads and returns the financials for the given Morningstar
+        ticker (without uploading them). If the RefreshState is specified then
+        the hashes of the responses and of their rows are staged.
+
+        :param ticker: Morningstar ticker.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :param pool: ParsePool parsing the responses in another process (by
+        default the responses are parsed in the calling thread).
+        :return Dictionary containing pandas.DataFrames representing the
+        financials (None if the financials did not change since the last run).
+        """
+        bodies = self._fetch_bodies(ticker, region, culture, currency)
+        if bodies is None:
+            return None
+        if pool is not None:
+            result = pool.financials(bodies, self._parser)
+        else:
+            result = self._parse_bodies(bodies, self._parser, self._metrics)
+        self._stage(ticker, bodies, result, (region, culture, currency))
+        return result
+
+    def _fetch_bodies(self, ticker, region = u'usa', culture = u'en-US',
+                      currency = u'USD'):
+        u"""Downloads and returns the raw responses with the financial
+        statements for the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return List of raw bodies of the responses, one for every report in
+        _REPORTS (None if the RefreshState is specified and none of the
+        responses changed since the last run).
         """
-        result = {}
 
         ##########################
         # Error Handling
@@ -300,90 +683,268 @@ class FinancialsDownloader(object):
             raise ValueError("You did not enter a ticker symbol.  Please"
                              " try again.")
 
-        for report_type, table_name in [
-                (u'is', u'income_statement'),
-                (u'bs', u'balance_sheet'),
-                (u'cf', u'cash_flow')]:
-            frame = self._download(ticker, report_type)
-            result[table_name] = frame
-            if conn:
-                self._upload_frame(
-                    frame, ticker, self._table_prefix + table_name, conn)
+        bodies = [self._fetch_report(ticker, report_type, region, culture,
+                                     currency)
+                  for report_type, _ in _REPORTS]
+        if self._state is not None and all(
+                self._state.unchanged(ticker, report_type, body,
+                                      (region, culture, currency))
+                for (report_type, _), body in zip(_REPORTS, bodies)):
+            return None
+        return bodies
+
+    @staticmethod
+    def _parse_bodies(bodies, parser = u'bs4', metrics = NULL_METRICS,
+                      trees = True):
+        u"""Parses the given raw responses with the financial statements.
+
+        Does not depend on the state of the downloader, so it can be run in
+        another process (see good_morning.parallel).
+
+        :param bodies: List of raw bodies of the responses, one for every
+        report in _REPORTS.
+        :param parser: Parser of the financial statements ('bs4' or 'fast').
+        :param metrics: Metrics registry recording the latency of the stages.
+        :param trees: Whether the StatementTrees are built (the worker
+        processes leave them to the parent process).
+        :return Dictionary containing pandas.DataFrames representing the
+        financials (and their StatementTrees under 'trees').
+        """
+        result = {}
+        for (_, table_name), body in zip(_REPORTS, bodies):
+            with metrics.timer(STAGE_SECONDS, stage=u'decode',
+                               source=u'financials'):
+                json_data = json.loads(body.decode(u'utf-8'))
+            statement = FinancialsDownloader._parse_html(
+                json_data[u'result'], parser, metrics)
+            result[table_name] = statement.frame
+        result[u'period_range'] = statement.period_range
+        result[u'fiscal_year_end'] = statement.fiscal_year_end
+        result[u'currency'] = statement.currency
+        if trees:
+            result[u'trees'] = StatementTree.from_result(result)
+        return result
+
+    def _stage(self, ticker, bodies, result, request = ()):
+        u"""Stages the hashes of the given responses and of the rows of their
+        financial statements in the RefreshState (if specified).
+
+        :param ticker: Morningstar ticker.
+        :param bodies: List of raw bodies of the responses.
+        :param result: Dictionary parsed from the responses.
+        :param request: Parameters of the request (region, culture,
+        currency).
+        """
+        if self._state is None:
+            return
+        for (report_type, table_name), body in zip(_REPORTS, bodies):
+            parts = dict(self._get_parts(table_name, result[table_name]))
+            if report_type == u'cf':
+                parts[u'unit'] = digest(result[u'fiscal_year_end'],
+                                        result[u'currency'])
+            self._state.stage(ticker, report_type, body, parts, request)
+
+    def _fetch_report(self, ticker, report_type, region = u'usa',
+                      culture = u'en-US', currency = u'USD'):
+        u"""Downloads and returns the raw response corresponding to the given
+        Morningstar ticker and the given type of the report.
+
+        :param ticker: Morningstar ticker.
+        :param report_type: Type of the report ('is', 'bs', 'cf').
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return Raw body of the response.
+        """
+        url = self._report_url(ticker, report_type, region, culture,
+                               currency)
+        body = _fetch(url, self._transport, self._cache, (
+            ticker, report_type, region, culture, currency, self._base_url),
+                      self._metrics, u'financials')
+
+        ##############################
+        # Error Handling
+        ##############################
+
+        # Wrong ticker
+        if len(body)==0:
+            raise ValueError("MorningStar cannot find the ticker symbol "
+                             "you entered or it is INVALID. Please try "
+                             "again.")
+
+        return body
+
+    async def adownload(self, ticker, conn = None, region = u'usa',
+                        culture = u'en-US', currency = u'USD', pool = None):
+        u"""Downloads and returns the financials for the given Morningstar
+        ticker (the asyncio counterpart of download).
+
+        The three financial statements are fetched concurrently. They are
+        parsed in the default executor of the event loop (or in the given
+        ParsePool) and the MySQL upload and the storage backend run in the
+        default executor as well, so the event loop is never blocked.
+
+        :param ticker: Morningstar ticker.
+        :param conn: MySQL connection.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :param pool: ParsePool parsing the responses in another process.
+        :return Dictionary containing pandas.DataFrames representing the
+        financials for the given Morningstar ticker and their StatementTrees
+        under 'trees' (None if the RefreshState is specified and the
+        financials did not change since the last run).
+        """
+        import asyncio
+        result = await self._adownload(ticker, region, culture, currency,
+                                       pool)
+        if result is None:
+            return None
+        loop = asyncio.get_running_loop()
         if conn:
-            self._upload_unit(ticker, self._table_prefix + u'unit', conn)
-        result[u'period_range'] = self._period_range
-        result[u'fiscal_year_end'] = self._fiscal_year_end
-        result[u'currency'] = self._currency
+            await loop.run_in_executor(None, self._upload_frames_to_db,
+                                       ticker, result, conn,
+                                       (region, culture, currency))
+        if self._storage is not None:
+            await loop.run_in_executor(None, self._storage.write_financials,
+                                       ticker, result)
+            await loop.run_in_executor(None, self._storage.flush)
+        if self._state is not None:
+            self._state.commit([ticker], (region, culture, currency))
+        return result
+
+    async def _adownload(self, ticker, region = u'usa', culture = u'en-US',
+                         currency = u'USD', pool = None):
+        u"""Downloads and returns the financials for the given Morningstar
+        ticker (the asyncio counterpart of _download).
+        """
+        import asyncio
+        if len(ticker) == 0:
+            raise ValueError("You did not enter a ticker symbol.  Please"
+                             " try again.")
+        bodies = await asyncio.gather(*[
+            self._afetch_report(ticker, report_type, region, culture,
+                                currency)
+            for report_type, _ in _REPORTS])
+        if self._state is not None and all(
+                self._state.unchanged(ticker, report_type, body,
+                                      (region, culture, currency))
+                for (report_type, _), body in zip(_REPORTS, bodies)):
+            return None
+        if pool is not None:
+            result = await pool.afinancials(bodies, self._parser)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self._parse_bodies, bodies, self._parser,
+                self._metrics)
+        self._stage(ticker, bodies, result, (region, culture, currency))
         return result
 
-    def _download(self, ticker, report_type):
-        u"""Downloads and returns a pandas.DataFrame corresponding to the
-        given Morningstar ticker and the given type of the report.
+    async def _afetch_report(self, ticker, report_type, region, culture,
+                             currency):
+        u"""Downloads and returns the raw response corresponding to the given
+        Morningstar ticker and the given type of the report (the asyncio
+        counterpart of _fetch_report).
+        """
+        body = await _afetch(
+            self._report_url(ticker, report_type, region, culture, currency),
+            self._async_transport, self._cache,
+            (ticker, report_type, region, culture, currency, self._base_url),
+            self._metrics, u'financials')
+        if len(body) == 0:
+            raise ValueError("MorningStar cannot find the ticker symbol "
+                             "you entered or it is INVALID. Please try "
+                             "again.")
+        return body
+
+    def _report_url(self, ticker, report_type, region, culture, currency):
+        u"""Returns the URL of the response with the given type of the report.
 
         :param ticker: Morningstar ticker.
         :param report_type: Type of the report ('is', 'bs', 'cf').
-        :return  pandas.DataFrame corresponding to the given Morningstar ticker
-        and the given type of the report.
-        """
-        url = (r'http://financials.morningstar.com/ajax/' +
-               r'ReportProcess4HtmlAjax.html?&t=' + ticker +
-               r'&region=usa&culture=en-US&cur=USD' +
-               r'&reportType=' + report_type + r'&period=12' +
-               r'&dataType=A&order=asc&columnYear=5&rounding=3&view=raw')
-        with urllib.request.urlopen(url) as response:
-            json_text = response.read().decode(u'utf-8')
-
-            ##############################
-            # Error Handling
-            ##############################
-
-            # Wrong ticker
-            if len(json_text)==0:
-                raise ValueError("MorningStar cannot find the ticker symbol "
-                                 "you entered or it is INVALID. Please try "
-                                 "again.")
-
-            json_data = json.loads(json_text)
-            result_soup = BeautifulSoup(json_data[u'result'],u'html.parser')
-            return self._parse(result_soup)
-
-    def _parse(self, soup):
-        u"""Extracts and returns a pandas.DataFrame corresponding to the
-        given parsed HTML response from financials.morningstar.com.
+        :param region: Sets the region.
+        :param culture: Sets culture.
+        :param currency: Sets currency.
+        :return URL of the response.
+        """
+        return (self._base_url + r'/ajax/' +
+                r'ReportProcess4HtmlAjax.html?&t=' + ticker +
+                r'&region=' + region + r'&culture=' + culture +
+                r'&cur=' + currency +
+                r'&reportType=' + report_type + r'&period=12' +
+                r'&dataType=A&order=asc&columnYear=5&rounding=3&view=raw')
+
+    def _parse(self, html):
+        u"""Extracts and returns a _Statement corresponding to the given HTML
+        response from financials.morningstar.com.
+
+        All the intermediate state is kept in local variables, so the same
+        FinancialsDownloader instance can be used from many threads at once.
+
+        :param html: HTML response from financials.morningstar.com.
+        :return _Statement corresponding to the given HTML response from
+        financials.morningstar.com.
+        """
+        return self._parse_html(html, self._parser, self._metrics)
+
+    @staticmethod
+    def _parse_html(html, parser = u'bs4', metrics = NULL_METRICS):
+        u"""Extracts and returns a _Statement corresponding to the given HTML
+        response from financials.morningstar.com (see _parse).
+
+        :param html: HTML response from financials.morningstar.com.
+        :param parser: Parser of the financial statements ('bs4' or 'fast').
+        :param metrics: Metrics registry recording the latency of the stages.
+        :return _Statement corresponding to the given HTML response.
+        """
+        with metrics.timer(STAGE_SECONDS, stage=u'parse',
+                           source=u'financials'):
+            if parser == u'fast':
+                content = parse_statement(html)
+            else:
+                # Imported on the first use (bs4 takes long to import).
+                from bs4 import BeautifulSoup
+                content = FinancialsDownloader._scan(
+                    BeautifulSoup(html, u'html.parser'))
+        with metrics.timer(STAGE_SECONDS, stage=u'frame',
+                           source=u'financials'):
+            return FinancialsDownloader._build_statement(*content)
+
+    @staticmethod
+    def _scan(soup):
+        u"""Extracts the content of the given parsed HTML response.
 
         :param soup: Parsed HTML response by BeautifulSoup.
-        :return pandas.DataFrame corresponding to the given parsed HTML response
-        from financials.morningstar.com.
+        :return Tuple (year_start, num_periods, fiscal_year_end, currency,
+        labels, data) as returned by fast_parser.parse_statement.
         """
         # Left node contains the labels.
         left = soup.find(u'div', u'left').div
         # Main node contains the (raw) data.
         main = soup.find(u'div', u'main').find(u'div', u'rf_table')
         year = main.find(u'div', {u'id': u'Year'})
-        self._year_ids = [node.attrs[u'id'] for node in year]
-        period_month = pd.datetime.strptime(year.div.text, u'%Y-%m').month
-        self._period_range = pd.period_range(
-            year.div.text, periods=len(self._year_ids),
-            # freq=pd.datetools.YearEnd(month=period_month))
-            freq = pd.tseries.offsets.YearEnd(month=period_month))
+        year_ids = [node.attrs[u'id'] for node in year]
         unit = left.find(u'div', {u'id': u'unitsAndFiscalYear'})
-        self._fiscal_year_end = int(unit.attrs[u'fyenumber'])
-        self._currency = unit.attrs[u'currency']
-        self._data = []
-        self._label_index = 0
-        self._read_labels(left)
-        self._data_index = 0
-        self._read_data(main)
-        return pd.DataFrame(self._data,
-                            columns=[u'parent_index', u'title'] + list(
-                                self._period_range))
-
-    def _read_labels(self, root_node, parent_label_index = None):
+        labels = []
+        FinancialsDownloader._read_labels(left, labels)
+        data = []
+        FinancialsDownloader._read_data(main, data)
+        return (year.div.text, len(year_ids), int(unit.attrs[u'fyenumber']),
+                unit.attrs[u'currency'], labels, data)
+
+    @staticmethod
+    def _read_labels(root_node, labels, parent_label_index = None):
         u"""Recursively reads labels from the parsed HTML response.
+
+        :param root_node: Node containing the labels.
+        :param labels: List to which the triples (label_id, parent_index,
+        title) are appended.
+        :param parent_label_index: Index of the parent label.
         """
         for node in root_node:
             if node.has_attr(u'class') and u'r_content' in node.attrs[u'class']:
-                self._read_labels(node, self._label_index - 1)
+                FinancialsDownloader._read_labels(node, labels,
+                                                  len(labels) - 1)
             if (node.has_attr(u'id') and
                     node.attrs[u'id'].startswith(u'label') and
                     not node.attrs[u'id'].endswith(u'padding') and
@@ -393,80 +954,149 @@ class FinancialsDownloader(object):
                 label_title = (node.div.attrs[u'title']
                                if node.div.has_attr(u'title')
                                else node.div.text)
-                self._data.append({
-                    u'id': label_id,
-                    u'index': self._label_index,
-                    u'parent_index': (parent_label_index
-                                     if parent_label_index is not None
-                                     else self._label_index),
-                    u'title': label_title})
-                self._label_index += 1
-
-    def _read_data(self, root_node):
+                labels.append((label_id,
+                               (parent_label_index
+                                if parent_label_index is not None
+                                else len(labels)),
+                               label_title))
+
+    @staticmethod
+    def _read_data(root_node, data):
         u"""Recursively reads data from the parsed HTML response.
+
+        :param root_node: Node containing the data.
+        :param data: List to which the pairs (data_id, list of values) are
+        appended.
         """
         for node in root_node:
             if node.has_attr(u'class') and u'r_content' in node.attrs[u'class']:
-                self._read_data(node)
+                FinancialsDownloader._read_data(node, data)
             if (node.has_attr(u'id') and
                     node.attrs[u'id'].startswith(u'data') and
                     not node.attrs[u'id'].endswith(u'padding') and
                     (not node.has_attr(u'style') or
                         u'display:none' not in node.attrs[u'style'])):
-                data_id = node.attrs[u'id'][5:]
-                while (self._data_index < len(self._data) and
-                       self._data[self._data_index][u'id'] != data_id):
-                    # In some cases we do not have data for all labels.
-                    self._data_index += 1
-                assert(self._data_index < len(self._data) and
-                       self._data[self._data_index][u'id'] == data_id)
-                for (i, child) in enumerate(node.children):
+                values = []
+                for child in node.children:
                     try:
-                        value = float(child.attrs[u'rawvalue'])
+                        values.append(float(child.attrs[u'rawvalue']))
                     except ValueError:
-                        value = None
-                    self._data[self._data_index][
-                        self._period_range[i]] = value
-                self._data_index += 1
+                        values.append(None)
+                data.append((node.attrs[u'id'][5:], values))
+
+    @staticmethod
+    def _build_statement(year_start, num_periods, fiscal_year_end, currency,
+                         labels, data):
+        u"""Returns a _Statement built from the extracted content of a
+        financial statement.
+
+        :param year_start: First year of the statement (e.g. 2015-09).
+        :param num_periods: Number of periods of the statement.
+        :param fiscal_year_end: Fiscal year end month.
+        :param currency: Currency of the statement.
+        :param labels: List of triples (label_id, parent_index, title).
+        :param data: List of pairs (data_id, list of values).
+        :return _Statement built from the given content.
+        """
+        period_month = datetime.strptime(year_start, u'%Y-%m').month
+        period_range = pd.period_range(
+            year_start, periods=num_periods,
+            freq=pd.tseries.offsets.YearEnd(month=period_month))
+        # Maps the label ids to the (ascending) rows of the statement.
+        row_index = {}
+        for (i, (label_id, _, _)) in enumerate(labels):
+            row_index.setdefault(label_id, []).append(i)
+        # In some cases we do not have data for all labels. Every data row
+        # belongs to the next label with its id, so that duplicate ids are
+        # matched in order.
+        values = np.full((len(labels), num_periods), np.nan)
+        next_row = 0
+        for data_id, data_values in data:
+            rows = row_index.get(data_id, [])
+            position = bisect.bisect_left(rows, next_row)
+            assert(position < len(rows))
+            row = rows[position]
+            next_row = row + 1
+            values[row, :len(data_values)] = [
+                np.nan if value is None else value for value in data_values]
+        frame = pd.DataFrame(values, columns=period_range)
+        frame.insert(0, u'title', [title for _, _, title in labels])
+        frame.insert(0, u'parent_index', np.array(
+            [parent_index for _, parent_index, _ in labels], dtype=np.int64))
+        return _Statement(frame, period_range, fiscal_year_end, currency)
 
-    def _upload_frame(self, frame, ticker, table_name,
-                      conn):
-        u"""Uploads the given pandas.DataFrame to the MySQL database.
+    def _upload_frames_to_db(self, ticker, result, conn, request = ()):
+        u"""Uploads the given financials to the MySQL database.
 
-        :param frame: pandas.DataFrames to be uploaded.
         :param ticker: Morningstar ticker.
-        :param table_name: Name of the MySQL table.
+        :param result: Dictionary returned by download.
         :param conn: MySQL connection.
+        :param request: Parameters of the request (region, culture,
+        currency).
         """
-        if not _db_table_exists(table_name, conn):
-            _db_execute(self._get_db_create_table(table_name), conn)
-        _db_execute(self._get_db_replace_values(
-            ticker, frame, table_name), conn)
+        batch = MySQLBatch(conn, metrics=self._metrics)
+        self._add_frames_to_batch(ticker, result, batch, request)
+        batch.commit()
 
-    def _upload_unit(self, ticker, table_name,
-                     conn):
-        u"""Uploads the fiscal_year_end and the currency to the MySQL database.
+    def _add_frames_to_batch(self, ticker, result, batch, request = ()):
+        u"""Adds the given financials to the MySQLBatch.
 
         :param ticker: Morningstar ticker.
+        :param result: Dictionary returned by download.
+        :param batch: MySQLBatch collecting the rows to be uploaded.
+        :param request: Parameters of the request (region, culture,
+        currency).
+        """
+        changed = None
+        if self._state is not None:
+            changed = set()
+            for report_type, _ in _REPORTS:
+                parts = self._state.changed(ticker, report_type, request)
+                if parts is None:
+                    changed = None
+                    break
+                changed.update(parts)
+        for _, name in _REPORTS:
+            table_name = self._table_prefix + name
+            columns, rows = self._get_db_replace_values(
+                ticker, result[name], table_name)
+            if changed is not None:
+                # Only the new or changed rows.
+                rows = [row for row, (part, _) in zip(
+                    rows, self._get_parts(name, result[name]))
+                        if part in changed]
+                if not rows:
+                    continue
+            batch.add(table_name, self._get_db_create_table(table_name),
+                      columns, rows, self._get_db_columns(
+                          [period.year for period in
+                           result[name].columns[2:]]))
+        if changed is not None and u'unit' not in changed:
+            return
+        table_name = self._table_prefix + u'unit'
+        batch.add(table_name, self._get_db_create_unit_table(table_name),
+                  [u'ticker', u'fiscal_year_end', u'currency'],
+                  [[ticker, int(result[u'fiscal_year_end']),
+                    result[u'currency']]])
+
+    @staticmethod
+    def _get_db_create_unit_table(table_name):
+        u"""Returns the MySQL CREATE TABLE statement for the table containing
+        the fiscal_year_end and the currency.
+
         :param table_name: Name of the MySQL table.
-        :param conn: MySQL connection.
+        :return MySQL CREATE TABLE statement.
         """
-        if not _db_table_exists(table_name, conn):
-            _db_execute(
-                u'CREATE TABLE `%s` (\n' % table_name +
-                u'  `ticker` varchar(50) NOT NULL\n' +
-                u'    COMMENT "Exchange:Ticker",\n' +
-                u'  `fiscal_year_end` int(10) unsigned NOT NULL\n' +
-                u'    COMMENT  "Fiscal Year End Month",\n' +
-                u'  `currency` varchar(50) NOT NULL\n' +
-                u'    COMMENT "Currency",\n' +
-                u'  PRIMARY KEY USING BTREE (`ticker`))\n' +
-                u'ENGINE=MyISAM DEFAULT CHARSET=utf8', conn)
-        _db_execute(
-            u'REPLACE INTO `%s`\n' % table_name +
-            u'  (`ticker`, `fiscal_year_end`, `currency`)\nVALUES\n' +
-            u'("%s", %d, "%s")' % (
-                ticker, self._fiscal_year_end, self._currency), conn)
+        return (
+            u'CREATE TABLE IF NOT EXISTS `%s` (\n' % table_name +
+            u'  `ticker` varchar(50) NOT NULL\n' +
+            u'    COMMENT "Exchange:Ticker",\n' +
+            u'  `fiscal_year_end` int(10) unsigned NOT NULL\n' +
+            u'    COMMENT  "Fiscal Year End Month",\n' +
+            u'  `currency` varchar(50) NOT NULL\n' +
+            u'    COMMENT "Currency",\n' +
+            u'  PRIMARY KEY USING BTREE (`ticker`))\n' +
+            u'ENGINE=MyISAM DEFAULT CHARSET=utf8')
 
     @staticmethod
     def _get_db_create_table(table_name):
@@ -476,13 +1106,12 @@ class FinancialsDownloader(object):
         :return MySQL CREATE TABLE statement.
         """
         year = date.today().year
-        year_range = xrange(year - 6, year + 2)
+        year_range = range(year - 6, year + 2)
         columns = u',\n'.join(
-            [u'  `year_%d` DECIMAL(20,5) DEFAULT NULL ' % year +
-             u'COMMENT "Year %d"' % year
-             for year in year_range])
+            [u'  `%s` %s' % column for column in
+             FinancialsDownloader._get_db_columns(year_range).items()])
         return (
-            u'CREATE TABLE `%s` (\n' % table_name +
+            u'CREATE TABLE IF NOT EXISTS `%s` (\n' % table_name +
             u'  `ticker` VARCHAR(50) NOT NULL COMMENT "Exchange:Ticker",\n' +
             u'  `id` int(10) unsigned NOT NULL COMMENT "Id",\n' +
             u'  `parent_id` int(10) unsigned NOT NULL COMMENT "Parent Id",\n' +
@@ -492,56 +1121,363 @@ class FinancialsDownloader(object):
             u'  KEY `ix_ticker` USING BTREE (`ticker`))\n' +
             u'ENGINE=MyISAM DEFAULT CHARSET=utf8')
 
+    @staticmethod
+    def _get_db_columns(years):
+        u"""Returns the MySQL definitions of the value columns for the given
+        years.
+
+        :param years: Years of the financials.
+        :return Ordered dictionary mapping the MySQL column names to their
+        definitions.
+        """
+        return collections.OrderedDict(
+            [(u'year_%d' % year,
+              u'DECIMAL(20,5) DEFAULT NULL COMMENT "Year %d"' % year)
+             for year in years])
+
     @staticmethod
     def _get_db_replace_values(ticker, frame,
                                table_name):
-        u"""Returns the MySQL REPLACE INTO statement for the given
-        Morningstar ticker and the corresponding pandas.DataFrame.
+        u"""Returns the columns and the rows of the MySQL REPLACE INTO
+        statement for the given Morningstar ticker and the corresponding
+        pandas.DataFrame.
 
         :param ticker: Morningstar ticker.
         :param frame: pandas.DataFrame.
         :param table_name: Name of the MySQL table.
-        :return MySQL REPLACE INTO statement.
+        :return Pair (columns, rows), where columns is the list of MySQL
+        column names and rows is the list of rows (lists of values, where
+        None represents NULL).
         """
-        columns = [u'`ticker`', u'`id`, `parent_id`, `item`'] + \
-                  [u'`year_%d`' % period.year for period in
-                   frame.columns[2:]]
-        return (
-            u'REPLACE INTO `%s`\n' % table_name +
-            u'  (%s)\nVALUES\n' % u', '.join(columns) +
-            u',\n'.join([u'("' + ticker + u'", %d, %d, "%s", ' %
-                        (index, frame.ix[index, u'parent_index'],
-                         frame.ix[index, u'title']) +
-                        u', '.join(
-                            [u'NULL' if np.isnan(frame.ix[index, period])
-                             else u'%.5f' % frame.ix[index, period]
-                             for period in frame.columns[2:]]) + u')'
-                        for index in frame.index]))
-
-
-def _db_table_exists(table_name, conn):
-    u"""Helper method for checking whether the given MySQL table exists.
-
-    :param table_name: Name of the MySQL table to be checked.
-    :param conn: MySQL connection.
-    :return True iff the given MySQL table exists.
+        columns = ([u'ticker', u'id', u'parent_id', u'item'] +
+                   [u'year_%d' % period.year for period in frame.columns[2:]])
+        values = _db_values(frame.iloc[:, 2:].values.astype(float))
+        return columns, [
+            [ticker, index, parent_index, title] + row
+            for index, parent_index, title, row in zip(
+                frame.index.tolist(), frame[u'parent_index'].tolist(),
+                frame[u'title'].tolist(), values)]
+
+    @staticmethod
+    def _get_parts(name, frame):
+        u"""Returns the parts (rows) of the given financial statement tracked
+        by the RefreshState.
+
+        :param name: Name of the financial statement.
+        :param frame: pandas.DataFrame.
+        :return List of pairs (name of the part, hash of the part), one for
+        every row.
+        """
+        years = u','.join([u'%d' % period.year
+                           for period in frame.columns[2:]])
+        values = frame.iloc[:, 2:].values.astype(float)
+        return [(u'%s|%d' % (name, index),
+                 digest(parent_index, title, years, values[i].tobytes()))
+                for i, (index, parent_index, title) in enumerate(zip(
+                    frame.index.tolist(), frame[u'parent_index'].tolist(),
+                    frame[u'title'].tolist()))]
+
+
+class MySQLBatch(object):
+    u"""Collects rows to be uploaded to the MySQL database.
+
+    The rows (possibly of many tickers) are uploaded table by table using
+    parameterized executemany statements and committed at once. Missing tables
+    are created and missing columns (e.g. new Morningstar line items) are
+    added, both based on the schema cached per MySQL connection. The batch is
+    meant to be used from a single thread.
+
+    In the bulk mode every table is staged into a temporary TSV file and
+    loaded with a single LOAD DATA LOCAL INFILE statement, which is much
+    faster for large backfills. The connection has to be opened with
+    local_infile enabled (e.g. pymysql.connect(..., local_infile=True)); if
+    the server or the client refuses the statement then the batch falls back
+    to the executemany statements.
     """
-    cursor = conn.cursor()
-    cursor.execute(u"""
-        SELECT COUNT(*)
-        FROM information_schema.tables
-        WHERE table_name = '{0}'""".format(table_name))
-    table_exists = cursor.fetchone()[0] == 1
-    cursor.close()
-    return table_exists
 
+    def __init__(self, conn, bulk = False, metrics = None):
+        u"""Constructs the MySQLBatch instance.
+
+        :param conn: MySQL connection.
+        :param bulk: Whether to use LOAD DATA LOCAL INFILE.
+        :param metrics: Metrics registry recording the latency of the commits,
+        the uploaded rows and the schema queries (see good_morning.metrics).
+        """
+        self._conn = conn
+        self._bulk = bulk
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        # Table name -> MySQL CREATE TABLE statement.
+        self._tables = collections.OrderedDict()
+        # Table name -> dictionary of MySQL column definitions.
+        self._definitions = {}
+        # (Table name, tuple of columns) -> list of rows.
+        self._rows = collections.OrderedDict()
+
+    def add(self, table_name, create_table, columns, rows,
+            definitions = None):
+        u"""Adds the given rows to the batch.
+
+        :param table_name: Name of the MySQL table.
+        :param create_table: MySQL CREATE TABLE statement used if the table
+        does not exist yet.
+        :param columns: List of MySQL column names.
+        :param rows: List of rows (lists of values, None represents NULL).
+        :param definitions: Dictionary mapping MySQL column names to their
+        definitions, used to add the columns missing in an existing table.
+        """
+        self._tables.setdefault(table_name, create_table)
+        if definitions:
+            self._definitions.setdefault(table_name, {}).update(definitions)
+        self._rows.setdefault((table_name, tuple(columns)), []).extend(rows)
+
+    def __len__(self):
+        u"""Returns the number of rows in the batch.
+        """
+        return sum(len(rows) for rows in self._rows.values())
+
+    def commit(self):
+        u"""Uploads all the rows in the batch to the MySQL database and commits
+        the transaction. The batch is empty afterwards.
+        """
+        with self._metrics.timer(STAGE_SECONDS, stage=u'db_write',
+                                 source=u'mysql'):
+            self._commit()
+
+    def _commit(self):
+        u"""Uploads all the rows in the batch (see commit).
+        """
+        metrics = self._metrics
+        tables, self._tables = self._tables, collections.OrderedDict()
+        definitions, self._definitions = self._definitions, {}
+        batches, self._rows = self._rows, collections.OrderedDict()
+        schema = _get_schema_cache(self._conn, metrics)
+        cursor = self._conn.cursor()
+        try:
+            for table_name, create_table in tables.items():
+                if schema.columns(table_name) is None:
+                    cursor.execute(create_table)
+                    schema.load(cursor, table_name)
+                    metrics.increment(u'good_morning_db_schema_queries_total')
+            for (table_name, columns), rows in batches.items():
+                existing = schema.columns(table_name)
+                missing = [column for column in columns
+                           if column not in existing]
+                if missing:
+                    table_definitions = definitions.get(table_name, {})
+                    cursor.execute(
+                        u'ALTER TABLE `%s`\n' % table_name +
+                        u',\n'.join([u'  ADD COLUMN `%s` %s' % (
+                            column, table_definitions.get(
+                                column, u'DECIMAL(20,5) DEFAULT NULL'))
+                            for column in missing]))
+                    existing.update(missing)
+                metrics.increment(u'good_morning_db_rows_total', len(rows))
+                if not (self._bulk and
+                        self._load_data(cursor, table_name, columns, rows)):
+                    cursor.executemany(
+                        u'REPLACE INTO `%s`\n' % table_name +
+                        u'  (%s)\nVALUES\n' % u', '.join(
+                            [u'`%s`' % column for column in columns]) +
+                        u'  (%s)' % u', '.join([u'%s'] * len(columns)), rows)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _load_data(self, cursor, table_name, columns, rows):
+        u"""Uploads the given rows using LOAD DATA LOCAL INFILE.
+
+        :param cursor: MySQL cursor.
+        :param table_name: Name of the MySQL table.
+        :param columns: List of MySQL column names.
+        :param rows: List of rows (lists of values, None represents NULL).
+        :return True iff the rows were uploaded, False if LOAD DATA LOCAL
+        INFILE is disabled (the bulk mode is then switched off).
+        """
+        handle, path = tempfile.mkstemp(prefix=table_name + u'_',
+                                        suffix=u'.tsv')
+        try:
+            with io.open(handle, u'w', encoding=u'utf-8',
+                         newline=u'\n') as f:
+                for row in rows:
+                    f.write(u'\t'.join([_tsv_value(value) for value in row]))
+                    f.write(u'\n')
+            cursor.execute(
+                u'LOAD DATA LOCAL INFILE %s\n' +
+                u'REPLACE INTO TABLE `%s`\n' % table_name +
+                u'CHARACTER SET utf8\n' +
+                u"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'\n" +
+                u"LINES TERMINATED BY '\\n'\n" +
+                u'(%s)' % u', '.join(
+                    [u'`%s`' % column for column in columns]), (path,))
+        except Exception as e:
+            if not e.args or e.args[0] not in _LOCAL_INFILE_DISABLED:
+                raise
+            self._bulk = False
+            return False
+        finally:
+            os.remove(path)
+        return True
+
+
+class _SchemaCache(object):
+    u"""Tables and columns of the MySQL database behind a connection.
+    """
 
-def _db_execute(query, conn):
-    u"""Helper method for executing the given MySQL non-query.
+    def __init__(self, conn):
+        u"""Constructs the _SchemaCache instance by loading all the tables and
+        columns of the current MySQL database with a single query.
+
+        :param conn: MySQL connection.
+        """
+        # Table name -> set of column names.
+        self._tables = {}
+        cursor = conn.cursor()
+        try:
+            self.load(cursor)
+        finally:
+            cursor.close()
+
+    def load(self, cursor, table_name = None):
+        u"""(Re)loads the columns of the given table (or of all the tables).
+
+        :param cursor: MySQL cursor.
+        :param table_name: Name of the MySQL table (None for all tables).
+        """
+        query = (u'SELECT table_name, column_name\n' +
+                 u'FROM information_schema.columns\n' +
+                 u'WHERE table_schema = DATABASE()')
+        if table_name is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query + u' AND table_name = %s', (table_name,))
+            self._tables[table_name] = set()
+        for name, column_name in cursor.fetchall():
+            self._tables.setdefault(name, set()).add(column_name.lower())
+
+    def columns(self, table_name):
+        u"""Returns the set of columns of the given table.
+
+        :param table_name: Name of the MySQL table.
+        :return Set of column names or None if the table does not exist.
+        """
+        return self._tables.get(table_name)
+
+
+# Error codes of MySQL and its clients refusing LOAD DATA LOCAL INFILE.
+_LOCAL_INFILE_DISABLED = (1148, 2068, 3948)
+
+# MySQL connection -> _SchemaCache.
+_schema_caches = weakref.WeakKeyDictionary()
+_schema_caches_lock = threading.Lock()
+
+
+def _get_schema_cache(conn, metrics = NULL_METRICS):
+    u"""Helper method returning the _SchemaCache of the given connection.
 
-    :param query: MySQL query to be executed.
     :param conn: MySQL connection.
+    :param metrics: Metrics registry counting the schema queries.
+    :return _SchemaCache of the given connection (loaded on first use).
+    """
+    with _schema_caches_lock:
+        schema = _schema_caches.get(conn)
+        if schema is None:
+            schema = _SchemaCache(conn)
+            _schema_caches[conn] = schema
+            metrics.increment(u'good_morning_db_schema_queries_total')
+        return schema
+
+
+def _fetch(url, transport, cache = None, cache_key = None,
+           metrics = NULL_METRICS, source = None):
+    u"""Helper method for downloading the body of the given URL.
+
+    :param url: URL to be downloaded.
+    :param transport: Transport used to download the URL.
+    :param cache: ResponseCache consulted before the download (if specified).
+    :param cache_key: Tuple (ticker, report_type, region, culture, currency,
+    base_url) identifying the request in the cache.
+    :param metrics: Metrics registry recording the fetch.
+    :param source: Label of the metrics ('key_ratios' or 'financials').
+    :return Body of the response (bytes).
+    """
+    if cache is not None:
+        key = cache.key(*cache_key)
+        body = cache.get(key)
+        if body is not None:
+            metrics.increment(u'good_morning_cache_hits_total', source=source)
+            return body
+        metrics.increment(u'good_morning_cache_misses_total', source=source)
+    with metrics.timer(STAGE_SECONDS, stage=u'fetch', source=source):
+        body = transport.get(url)
+    metrics.increment(u'good_morning_response_bytes_total', len(body),
+                      source=source)
+    # Empty responses (e.g. invalid tickers) are never cached.
+    if cache is not None and body:
+        cache.put(key, body)
+    return body
+
+
+async def _afetch(url, transport, cache = None, cache_key = None,
+                 metrics = NULL_METRICS, source = None):
+    u"""Helper method for downloading the body of the given URL with an
+    asyncio transport (see _fetch).
+
+    :param url: URL to be downloaded.
+    :param transport: Transport with the coroutine method get(url) (the
+    default AsyncHTTPSession if None).
+    :param cache: ResponseCache consulted before the download (if specified).
+    :param cache_key: Tuple (ticker, report_type, region, culture, currency,
+    base_url) identifying the request in the cache.
+    :param metrics: Metrics registry recording the fetch.
+    :param source: Label of the metrics ('key_ratios' or 'financials').
+    :return Body of the response (bytes).
+    """
+    import asyncio
+    if transport is None:
+        from good_morning.aio import default_async_session
+        transport = default_async_session()
+    if cache is not None:
+        key = cache.key(*cache_key)
+        # The cache reads and writes files, so it runs in a thread.
+        body = await asyncio.to_thread(cache.get, key)
+        if body is not None:
+            metrics.increment(u'good_morning_cache_hits_total', source=source)
+            return body
+        metrics.increment(u'good_morning_cache_misses_total', source=source)
+    with metrics.timer(STAGE_SECONDS, stage=u'fetch', source=source):
+        body = await transport.get(url)
+    metrics.increment(u'good_morning_response_bytes_total', len(body),
+                      source=source)
+    # Empty responses (e.g. invalid tickers) are never cached.
+    if cache is not None and body:
+        await asyncio.to_thread(cache.put, key, body)
+    return body
+
+
+def _tsv_value(value):
+    u"""Helper method for formatting a value for LOAD DATA INFILE.
+
+    :param value: Value (None represents NULL).
+    :return Escaped value.
+    """
+    if value is None:
+        return u'\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return (u'%s' % value).replace(u'\\', u'\\\\').replace(
+        u'\t', u'\\t').replace(u'\n', u'\\n')
+
+
+def _db_values(values):
+    u"""Helper method for converting a 2-D float array into MySQL rows.
+
+    :param values: 2-D numpy array of floats.
+    :return List of rows (lists of Python floats, where NaN is replaced by
+    None representing NULL).
     """
-    cursor = conn.cursor()
-    cursor.execute(query)
-    cursor.close()
+    rows = values.astype(object)
+    rows[np.isnan(values)] = None
+    return rows.tolist()
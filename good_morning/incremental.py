@@ -0,0 +1,200 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""State of the incremental refresh of the downloaded data.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+
+class RefreshState(object):
+    u"""Remembers what was downloaded (and stored) in the previous runs.
+
+    For every ticker, report type and request parameters (region, culture,
+    currency) the state keeps the hash of the raw response and the hashes of
+    its parts (the periods of the key ratios, the
+    rows of the financial statements). Downloaders using the state skip the
+    responses that did not change (their download returns None) and upload
+    only the new or changed parts of the others.
+
+    New hashes are first staged and only committed once the corresponding
+    data was successfully stored, so that a failed upload is retried in the
+    next run. Every commit saves the state to the JSON file, unless it is
+    called with save=False (e.g. by download_many, which saves the state once
+    per batch and at the end). The state can be shared by many threads.
+    """
+
+    def __init__(self, path):
+        u"""Constructs the RefreshState instance.
+
+        :param path: Path of the JSON file with the state (created if it does
+        not exist).
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        # 'ticker|report_type|region|culture|currency' ->
+        # {'body': hash, 'parts': {part: hash}}
+        self._committed = {}
+        # 'ticker|report_type|region|culture|currency' ->
+        # {'ticker': ticker, 'request': request, 'body': hash,
+        #  'parts': {part: hash}}
+        self._staged = {}
+        # Whether the committed hashes were not saved yet.
+        self._dirty = False
+        if os.path.exists(path):
+            with open(path, u'r') as f:
+                self._committed = json.load(f)
+
+    def unchanged(self, ticker, report_type, body, request = ()):
+        u"""Returns whether the response is the same as in the last run.
+
+        :param ticker: Morningstar ticker.
+        :param report_type: Type of the report ('kr', 'is', 'bs', 'cf').
+        :param body: Raw body of the response.
+        :param request: Parameters of the request (region, culture,
+        currency).
+        :return True if the response did not change since the last run with
+        the same request parameters.
+        """
+        with self._lock:
+            entry = self._committed.get(_key(ticker, report_type, request))
+        return entry is not None and entry[u'body'] == digest(body)
+
+    def stage(self, ticker, report_type, body, parts, request = ()):
+        u"""Stages the hashes of the given response and of its parts.
+
+        :param ticker: Morningstar ticker.
+        :param report_type: Type of the report ('kr', 'is', 'bs', 'cf').
+        :param body: Raw body of the response.
+        :param parts: Dictionary mapping the names of the parts to their
+        hashes (see digest).
+        :param request: Parameters of the request (region, culture,
+        currency).
+        """
+        entry = {u'ticker': ticker, u'request': tuple(request),
+                 u'body': digest(body), u'parts': parts}
+        with self._lock:
+            self._staged[_key(ticker, report_type, request)] = entry
+
+    def changed(self, ticker, report_type, request = ()):
+        u"""Returns the staged parts which are new or changed.
+
+        :param ticker: Morningstar ticker.
+        :param report_type: Type of the report ('kr', 'is', 'bs', 'cf').
+        :param request: Parameters of the request (region, culture,
+        currency).
+        :return Set of the names of the new or changed parts (None if nothing
+        is staged, i.e. all parts are to be stored).
+        """
+        key = _key(ticker, report_type, request)
+        with self._lock:
+            staged = self._staged.get(key)
+            if staged is None:
+                return None
+            committed = self._committed.get(key)
+        previous = committed[u'parts'] if committed is not None else {}
+        return set(part for part, value in staged[u'parts'].items()
+                   if previous.get(part) != value)
+
+    def commit(self, tickers = None, request = None, save = True):
+        u"""Commits the staged hashes and saves the state.
+
+        :param tickers: Tickers whose staged hashes are committed (all by
+        default).
+        :param request: Parameters of the request (region, culture, currency)
+        whose staged hashes are committed (all by default).
+        :param save: Whether to save the state (otherwise the committed
+        hashes are saved by the next save).
+        """
+        with self._lock:
+            for key in self._staged_keys(tickers, request):
+                entry = self._staged.pop(key)
+                self._committed[key] = {
+                    u'body': entry[u'body'], u'parts': entry[u'parts']}
+                self._dirty = True
+            if save:
+                self._save()
+
+    def save(self):
+        u"""Saves the committed hashes to the JSON file (if they changed
+        since the last save).
+        """
+        with self._lock:
+            self._save()
+
+    def discard(self, tickers = None, request = None):
+        u"""Discards the staged hashes (e.g. after a failed upload).
+
+        :param tickers: Tickers whose staged hashes are discarded (all by
+        default).
+        :param request: Parameters of the request (region, culture, currency)
+        whose staged hashes are discarded (all by default).
+        """
+        with self._lock:
+            for key in self._staged_keys(tickers, request):
+                del self._staged[key]
+
+    def _save(self):
+        u"""Saves the committed hashes (called with the lock held).
+        """
+        if not self._dirty:
+            return
+        temp_path = self._path + u'.%d.tmp' % os.getpid()
+        with open(temp_path, u'w') as f:
+            json.dump(self._committed, f)
+        os.replace(temp_path, self._path)
+        self._dirty = False
+
+    def _staged_keys(self, tickers, request):
+        u"""Returns the staged keys of the given tickers and request
+        parameters (all by default).
+        """
+        if tickers is not None:
+            tickers = set(tickers)
+        if request is not None:
+            request = tuple(request)
+        return [key for key, entry in self._staged.items()
+                if (tickers is None or entry[u'ticker'] in tickers) and
+                (request is None or entry[u'request'] == request)]
+
+
+def digest(*chunks):
+    u"""Returns the hash of the given chunks (bytes or strings).
+
+    :param chunks: Chunks of data.
+    :return Hexadecimal SHA-1 digest.
+    """
+    sha1 = hashlib.sha1()
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = (u'%s' % chunk).encode(u'utf-8')
+        sha1.update(chunk)
+        sha1.update(b'\x00')
+    return sha1.hexdigest()
+
+
+def _key(ticker, report_type, request):
+    u"""Returns the key of the given ticker, report type and request
+    parameters.
+    """
+    return u'|'.join([ticker, report_type] + [u'%s' % value
+                                              for value in request])
@@ -0,0 +1,448 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Loading of the stored data back into the frames of the downloaders.
+
+The DatabaseLoader reads the morningstar_* tables written by the MySQL upload
+(see MySQLBatch) or by SQLiteStorage and rebuilds the exact structures
+returned by KeyRatiosDownloader.download and FinancialsDownloader.download,
+so that the downstream code can run off the database instead of downloading
+the data again.
+"""
+
+import collections
+import contextlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from good_morning.good_morning import KeyRatiosDownloader, _REPORTS
+from good_morning.storage import SQLiteStorage
+from good_morning.tree import StatementTree
+
+# Maximum number of tickers in a single query.
+_CHUNK_SIZE = 500
+
+_Table = collections.namedtuple(u'_Table',
+                                [u'frame_name', u'columns', u'labels'])
+
+
+class DatabaseLoader(object):
+    u"""Loads the stored key ratios and financials of many tickers.
+
+    Works with MySQL connections (the names of the frames and the labels of
+    the line items are read from the table and column comments in the
+    information_schema) and with SQLite databases written by SQLiteStorage
+    (the names and the labels are read from its meta table). The tickers are
+    read in bulk and the filters on the periods, the metrics and the items
+    are evaluated by the database.
+    """
+
+    def __init__(self, conn, table_prefix = u'morningstar_'):
+        u"""Constructs the DatabaseLoader instance.
+
+        :param conn: MySQL connection, sqlite3.Connection or SQLiteStorage.
+        :param table_prefix: Prefix of the tables.
+        """
+        # Lock guarding a connection shared with the writers.
+        self._lock = None
+        if isinstance(conn, SQLiteStorage):
+            # Make the pending writes visible.
+            conn.flush()
+            self._lock = conn.lock
+            conn = conn.connection
+        self._conn = conn
+        self._sqlite = isinstance(conn, sqlite3.Connection)
+        self._table_prefix = table_prefix
+        self._tables = None
+
+    def refresh(self):
+        u"""Forgets the tables and columns read from the database (e.g. after
+        new tables were created).
+        """
+        self._tables = None
+
+    def key_ratios(self, tickers = None, start = None, end = None,
+                   metrics = None):
+        u"""Loads the stored key ratios.
+
+        :param tickers: Morningstar ticker, list of tickers or None for all
+        the stored tickers.
+        :param start: First period (date) to be loaded.
+        :param end: Last period (date) to be loaded.
+        :param metrics: List of line items (labels, e.g. 'Revenue USD Mil', or
+        column names) to be loaded (all by default). Frames without any of the
+        line items are left out.
+        :return List of pandas.DataFrames as returned by
+        KeyRatiosDownloader.download if a single ticker is given (None if
+        nothing is stored), otherwise a dictionary mapping the tickers to
+        such lists.
+        """
+        frames = collections.OrderedDict()
+        for table_name in self._key_ratios_tables():
+            table = self._get_tables()[table_name]
+            columns = [column for column in table.columns
+                       if column not in (u'ticker', u'period') and (
+                           metrics is None or column in metrics or
+                           table.labels.get(column) in metrics)]
+            if not columns:
+                continue
+            conditions, args = [], []
+            if start is not None:
+                conditions.append(u'%s >= ' % self._quote(u'period') +
+                                  self._param())
+                args.append(pd.Timestamp(start).date().isoformat())
+            if end is not None:
+                conditions.append(u'%s <= ' % self._quote(u'period') +
+                                  self._param())
+                args.append(pd.Timestamp(end).date().isoformat())
+            rows = self._select(table_name, [u'ticker', u'period'] + columns,
+                                tickers, conditions, args,
+                                [u'ticker', u'period'])
+            index = pd.Index([table.labels.get(column, column)
+                              for column in columns], name=table.frame_name)
+            for ticker, ticker_rows in _group(rows):
+                frames.setdefault(ticker, []).append(
+                    _key_ratios_frame(index, ticker_rows))
+        return _result(tickers, frames)
+
+    def financials(self, tickers = None, start = None, end = None,
+                   items = None):
+        u"""Loads the stored financials.
+
+        The periods of a ticker are the years for which any of its statements
+        has a value (the statements of a ticker share their periods).
+
+        :param tickers: Morningstar ticker, list of tickers or None for all
+        the stored tickers.
+        :param start: First period (date) to be loaded.
+        :param end: Last period (date) to be loaded.
+        :param items: List of items (titles) of the statements to be loaded
+        (all by default). The parent_index of the loaded items still refers
+        to the index (id) of the parent in the full statement.
+        :return Dictionary as returned by FinancialsDownloader.download if a
+        single ticker is given (None if nothing is stored), otherwise a
+        dictionary mapping the tickers to such dictionaries.
+        """
+        tables = self._get_tables()
+        units = dict(
+            (ticker, (int(fiscal_year_end), currency))
+            for ticker, fiscal_year_end, currency in self._select(
+                self._table_prefix + u'unit',
+                [u'ticker', u'fiscal_year_end', u'currency'], tickers)
+        ) if self._table_prefix + u'unit' in tables else {}
+        first_year = pd.Timestamp(start).year if start is not None else None
+        last_year = pd.Timestamp(end).year if end is not None else None
+        # Ticker -> statement name -> rows.
+        statements = collections.defaultdict(dict)
+        years = {}
+        for _, name in _REPORTS:
+            table_name = self._table_prefix + name
+            if table_name not in tables:
+                continue
+            # Only the requested years are read.
+            year_columns = [
+                column for column in tables[table_name].columns
+                if column.startswith(u'year_') and
+                (first_year is None or int(column[5:]) >= first_year) and
+                (last_year is None or int(column[5:]) <= last_year)]
+            years[name] = [int(column[5:]) for column in year_columns]
+            conditions, args = [], []
+            if items is not None:
+                conditions.append(u'%s IN (%s)' % (
+                    self._quote(u'item'),
+                    u', '.join([self._param()] * len(items))))
+                args.extend(items)
+            rows = self._select(
+                table_name, [u'ticker', u'id', u'parent_id', u'item'] +
+                year_columns, tickers, conditions, args, [u'ticker', u'id'])
+            for ticker, ticker_rows in _group(rows):
+                statements[ticker][name] = ticker_rows
+        results = collections.OrderedDict()
+        for ticker in sorted(statements):
+            if ticker not in units:
+                continue
+            result = _financials(statements[ticker], years, units[ticker],
+                                 start, end)
+            if result is not None:
+                results[ticker] = result
+        return _result(tickers, results)
+
+    def _key_ratios_tables(self):
+        u"""Returns the names of the stored key ratios tables in the order of
+        the frames returned by KeyRatiosDownloader.download.
+        """
+        tables = self._get_tables()
+        names = []
+        for index, (_, frame_name) in enumerate(
+                [item for item in KeyRatiosDownloader._response_structure
+                 if item[1]]):
+            table_name = self._table_prefix + (
+                KeyRatiosDownloader._get_db_name(frame_name))
+            if index == 0:
+                # The first frame has the currency in its name.
+                names.extend(sorted(name for name in tables
+                                    if name.startswith(table_name + u'_')))
+            elif table_name in tables:
+                names.append(table_name)
+        return names
+
+    def _get_tables(self):
+        u"""Returns (and caches) the stored tables.
+
+        :return Dictionary mapping the table names to _Table tuples (frame
+        name, list of the columns, dictionary mapping the columns to their
+        labels).
+        """
+        if self._tables is None:
+            with self._locked():
+                self._tables = self._read_tables()
+        return self._tables
+
+    def _read_tables(self):
+        u"""Reads the stored tables from the database.
+        """
+        if self._sqlite:
+            return self._read_sqlite_tables()
+        return self._read_mysql_tables()
+
+    def _locked(self):
+        u"""Returns a context manager holding the lock of the connection
+        (if it is shared with the writers of a SQLiteStorage).
+        """
+        if self._lock is None:
+            return contextlib.nullcontext()
+        return self._lock
+
+    def _read_mysql_tables(self):
+        u"""Reads the stored tables from the MySQL information_schema.
+        """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(u'SELECT table_name, table_comment\n' +
+                           u'FROM information_schema.tables\n' +
+                           u'WHERE table_schema = DATABASE()')
+            comments = dict(cursor.fetchall())
+            cursor.execute(u'SELECT table_name, column_name, column_comment\n' +
+                           u'FROM information_schema.columns\n' +
+                           u'WHERE table_schema = DATABASE()\n' +
+                           u'ORDER BY table_name, ordinal_position')
+            columns = cursor.fetchall()
+        finally:
+            cursor.close()
+        tables = {}
+        for table_name, column, comment in columns:
+            if not table_name.startswith(self._table_prefix):
+                continue
+            if table_name not in tables:
+                tables[table_name] = _Table(
+                    comments.get(table_name) or
+                    table_name[len(self._table_prefix):], [], {})
+            tables[table_name].columns.append(column)
+            if comment:
+                tables[table_name].labels[column] = comment
+        return tables
+
+    def _read_sqlite_tables(self):
+        u"""Reads the stored tables from the SQLite meta table.
+        """
+        meta_table = self._table_prefix + u'meta'
+        labels = collections.defaultdict(dict)
+        names = [name for name, in self._conn.execute(
+            u"SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if meta_table in names:
+            for table_name, column, label in self._conn.execute(
+                    u'SELECT table_name, column_name, label FROM "%s"' %
+                    meta_table):
+                labels[table_name][column] = label
+        tables = {}
+        for table_name in names:
+            if (not table_name.startswith(self._table_prefix) or
+                    table_name == meta_table):
+                continue
+            table_labels = labels[table_name]
+            tables[table_name] = _Table(
+                table_labels.pop(u'', table_name[len(self._table_prefix):]),
+                [row[1] for row in self._conn.execute(
+                    u'PRAGMA table_info("%s")' % table_name)],
+                table_labels)
+        return tables
+
+    def _select(self, table_name, columns, tickers, conditions = (),
+                args = (), order_by = ()):
+        u"""Selects the given columns of the rows of the given tickers.
+
+        :param table_name: Name of the table.
+        :param columns: List of the columns to be selected.
+        :param tickers: Morningstar ticker, list of tickers or None for all.
+        :param conditions: List of further conditions.
+        :param args: Arguments of the conditions.
+        :param order_by: Columns the rows are ordered by.
+        :return List of the selected rows.
+        """
+        query = u'SELECT %s FROM %s' % (
+            u', '.join([self._quote(column) for column in columns]),
+            self._quote(table_name))
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        chunks = ([None] if tickers is None else
+                  [tickers[i:i + _CHUNK_SIZE]
+                   for i in range(0, len(tickers), _CHUNK_SIZE)])
+        queries = []
+        for chunk in chunks:
+            chunk_conditions = list(conditions)
+            chunk_args = list(args)
+            if chunk is not None:
+                chunk_conditions.insert(0, u'%s IN (%s)' % (
+                    self._quote(u'ticker'),
+                    u', '.join([self._param()] * len(chunk))))
+                chunk_args[:0] = chunk
+            chunk_query = query
+            if chunk_conditions:
+                chunk_query += u' WHERE ' + u' AND '.join(chunk_conditions)
+            if order_by:
+                chunk_query += u' ORDER BY ' + u', '.join(
+                    [self._quote(column) for column in order_by])
+            queries.append((chunk_query, chunk_args))
+        rows = []
+        with self._locked():
+            cursor = self._conn.cursor()
+            try:
+                for chunk_query, chunk_args in queries:
+                    cursor.execute(chunk_query, chunk_args)
+                    rows.extend(cursor.fetchall())
+            finally:
+                cursor.close()
+        return rows
+
+    def _quote(self, name):
+        u"""Returns the quoted name of a table or a column.
+        """
+        return (u'"%s"' if self._sqlite else u'`%s`') % name
+
+    def _param(self):
+        u"""Returns the placeholder of a query parameter.
+        """
+        return u'?' if self._sqlite else u'%s'
+
+
+def _group(rows):
+    u"""Helper method grouping the given rows (ordered by the ticker).
+
+    :param rows: List of rows starting with the ticker.
+    :return Generator of pairs (ticker, list of rows without the ticker).
+    """
+    ticker, group = None, []
+    for row in rows:
+        if row[0] != ticker:
+            if group:
+                yield ticker, group
+            ticker, group = row[0], []
+        group.append(row[1:])
+    if group:
+        yield ticker, group
+
+
+def _result(tickers, results):
+    u"""Helper method returning the result for a single ticker or for many.
+    """
+    if isinstance(tickers, str):
+        return results.get(tickers)
+    return dict(results)
+
+
+def _key_ratios_frame(index, rows):
+    u"""Helper method building a frame of the key ratios.
+
+    :param index: pandas.Index of the line items (named after the frame).
+    :param rows: List of rows (period, values...) ordered by the period.
+    :return pandas.DataFrame as returned by KeyRatiosDownloader.download.
+    """
+    dates = pd.DatetimeIndex([pd.Timestamp(row[0]) for row in rows])
+    columns = pd.PeriodIndex(dates, freq=pd.tseries.offsets.YearEnd(
+        month=dates[0].month))
+    columns.name = u'Period'
+    values = np.array([row[1:] for row in rows], dtype=float).T
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def _financials(statements, years, unit, start, end):
+    u"""Helper method building the financials of a single ticker.
+
+    :param statements: Dictionary mapping the names of the statements to
+    their rows (id, parent_id, item, values...) ordered by the id.
+    :param years: Dictionary mapping the names of the statements to the years
+    of their values.
+    :param unit: Pair (fiscal_year_end, currency).
+    :param start: First period (date) to be loaded.
+    :param end: Last period (date) to be loaded.
+    :return Dictionary as returned by FinancialsDownloader.download (None if
+    there are no values in the given periods).
+    """
+    fiscal_year_end, currency = unit
+    freq = pd.tseries.offsets.YearEnd(month=fiscal_year_end)
+    values = {}
+    present = set()
+    for name, rows in statements.items():
+        values[name] = np.array([row[3:] for row in rows], dtype=float)
+        if values[name].size:
+            present.update(year for year, has_value in zip(
+                years[name], ~np.isnan(values[name]).all(axis=0))
+                if has_value)
+    # The end of the fiscal year of every period must be in [start, end].
+    present = [year for year in present
+               if (start is None or _period_end(year, fiscal_year_end) >=
+                   pd.Timestamp(start).date()) and
+               (end is None or _period_end(year, fiscal_year_end) <=
+                pd.Timestamp(end).date())]
+    if not present:
+        return None
+    period_range = pd.period_range(
+        u'%d-%02d' % (min(present), fiscal_year_end),
+        periods=max(present) - min(present) + 1, freq=freq)
+    result = {}
+    for _, name in _REPORTS:
+        rows = statements.get(name, [])
+        positions = dict((year, i) for i, year in enumerate(years.get(name,
+                                                                      [])))
+        frame_values = np.full((len(rows), len(period_range)), np.nan)
+        for i, period in enumerate(period_range):
+            if period.year in positions:
+                frame_values[:, i] = values[name][:, positions[period.year]]
+        ids = [row[0] for row in rows]
+        index = (pd.RangeIndex(len(ids)) if ids == list(range(len(ids)))
+                 else pd.Index(ids, dtype=np.int64))
+        frame = pd.DataFrame(frame_values, index=index, columns=period_range)
+        frame.insert(0, u'title', [row[2] for row in rows])
+        frame.insert(0, u'parent_index', np.array(
+            [row[1] for row in rows], dtype=np.int64))
+        result[name] = frame
+    result[u'period_range'] = period_range
+    result[u'fiscal_year_end'] = fiscal_year_end
+    result[u'currency'] = currency
+    result[u'trees'] = StatementTree.from_result(result)
+    return result
+
+
+def _period_end(year, fiscal_year_end):
+    u"""Helper method returning the last day of the given fiscal year.
+    """
+    return pd.Period(u'%d-%02d' % (year, fiscal_year_end),
+                     freq=u'M').end_time.date()
@@ -0,0 +1,322 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Instrumentation of the download pipeline.
+
+Downloaders, HTTPSession and MySQLBatch accept a metrics registry and record
+the latency of every stage (fetch, decode, parse, frame, db_write) in
+histograms and the transferred bytes, requests, retries, cache hits and
+schema queries in counters. AdaptiveRateLimiter reports its current rate
+and concurrency in gauges. By default they use NULL_METRICS, which records
+nothing and costs next to nothing.
+
+    metrics = gm.Metrics()
+    for result in gm.download_many(tickers, conn, metrics=metrics):
+        ...
+    metrics.write_prometheus('good_morning.prom')
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets (in seconds).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Histogram of the latency of the stages of the pipeline.
+STAGE_SECONDS = u'good_morning_stage_seconds'
+
+
+class Metrics(object):
+    u"""Thread-safe registry of counters, gauges and histograms.
+
+    Every metric is identified by its name and its labels (keyword
+    arguments), e.g. metrics.increment('good_morning_http_retries_total') or
+    metrics.timer(STAGE_SECONDS, stage='parse', source='financials').
+    """
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        u"""Constructs the Metrics instance.
+
+        :param buckets: Upper bounds of the histogram buckets (in seconds).
+        """
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (name, labels) -> value.
+        self._counters = {}
+        # (name, labels) -> value.
+        self._gauges = {}
+        # (name, labels) -> _Histogram.
+        self._histograms = {}
+
+    def increment(self, name, value = 1, **labels):
+        u"""Increments the given counter.
+
+        :param name: Name of the counter.
+        :param value: Increment.
+        :param labels: Labels of the counter.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        u"""Sets the given gauge to the given value.
+
+        :param name: Name of the gauge.
+        :param value: Current value.
+        :param labels: Labels of the gauge.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        u"""Records the given value in the given histogram.
+
+        :param name: Name of the histogram.
+        :param value: Observed value (e.g. a duration in seconds).
+        :param labels: Labels of the histogram.
+        """
+        self._histogram(name, labels).observe(value)
+
+    def timer(self, name, **labels):
+        u"""Returns a context manager recording its duration in the given
+        histogram.
+
+        :param name: Name of the histogram.
+        :param labels: Labels of the histogram.
+        :return Context manager.
+        """
+        return _Timer(self._histogram(name, labels))
+
+    def counter(self, name, **labels):
+        u"""Returns the current value of the given counter.
+        """
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def gauge(self, name, **labels):
+        u"""Returns the current value of the given gauge (None if it was
+        never set).
+        """
+        with self._lock:
+            return self._gauges.get(_key(name, labels))
+
+    def histogram(self, name, **labels):
+        u"""Returns the pair (count, sum) of the given histogram.
+        """
+        histogram = self._histogram(name, labels)
+        with histogram.lock:
+            return histogram.count, histogram.sum
+
+    def to_prometheus(self):
+        u"""Returns all the metrics in the Prometheus text format.
+
+        :return String in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items(),
+                              key=lambda item: item[0])
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+            histograms = sorted(self._histograms.items(),
+                                key=lambda item: item[0])
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                lines.append(u'# TYPE %s counter' % name)
+                previous = name
+            lines.append(u'%s%s %s' % (name, _labels(labels), _number(value)))
+        for (name, labels), value in gauges:
+            if name != previous:
+                lines.append(u'# TYPE %s gauge' % name)
+                previous = name
+            lines.append(u'%s%s %s' % (name, _labels(labels), _number(value)))
+        for (name, labels), histogram in histograms:
+            if name != previous:
+                lines.append(u'# TYPE %s histogram' % name)
+                previous = name
+            with histogram.lock:
+                counts = list(histogram.counts)
+                count, total = histogram.count, histogram.sum
+            cumulative = 0
+            for bound, bucket in zip(self._buckets, counts):
+                cumulative += bucket
+                lines.append(u'%s_bucket%s %d' % (
+                    name, _labels(labels + ((u'le', _number(bound)),)),
+                    cumulative))
+            lines.append(u'%s_bucket%s %d' % (
+                name, _labels(labels + ((u'le', u'+Inf'),)), count))
+            lines.append(u'%s_sum%s %s' % (name, _labels(labels),
+                                           _number(total)))
+            lines.append(u'%s_count%s %d' % (name, _labels(labels), count))
+        return u'\n'.join(lines) + u'\n'
+
+    def write_prometheus(self, path):
+        u"""Writes all the metrics to the given file in the Prometheus text
+        format (e.g. for the textfile collector of the node exporter). The
+        file is replaced atomically.
+
+        :param path: Path of the file.
+        """
+        temp_path = path + u'.%d.tmp' % os.getpid()
+        with open(temp_path, u'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def log(self, logger = None, level = logging.INFO):
+        u"""Logs a summary of all the metrics, one line per metric.
+
+        :param logger: Logger (the good_morning logger by default).
+        :param level: Logging level.
+        """
+        if logger is None:
+            logger = logging.getLogger(u'good_morning')
+        with self._lock:
+            counters = sorted(self._counters.items(),
+                              key=lambda item: item[0])
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+            histograms = sorted(self._histograms.items(),
+                                key=lambda item: item[0])
+        for (name, labels), value in counters + gauges:
+            logger.log(level, u'%s%s %s', name, _labels(labels),
+                       _number(value))
+        for (name, labels), histogram in histograms:
+            with histogram.lock:
+                count, total = histogram.count, histogram.sum
+            logger.log(level, u'%s%s count=%d sum=%.3fs mean=%.3fs', name,
+                       _labels(labels), count, total,
+                       total / count if count else 0.0)
+
+    def _histogram(self, name, labels):
+        u"""Returns the _Histogram with the given name and labels.
+        """
+        key = _key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    key, _Histogram(self._buckets))
+        return histogram
+
+
+class NullMetrics(object):
+    u"""Metrics registry which records nothing (the default).
+    """
+
+    def increment(self, name, value = 1, **labels):
+        pass
+
+    def set_gauge(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return _NULL_TIMER
+
+
+class _Histogram(object):
+    u"""Counts of the observed values per bucket, their count and sum.
+    """
+
+    __slots__ = (u'buckets', u'counts', u'count', u'sum', u'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+
+class _Timer(object):
+    u"""Context manager recording its duration in a _Histogram.
+    """
+
+    __slots__ = (u'_histogram', u'_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class _NullTimer(object):
+    u"""Context manager doing nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+NULL_METRICS = NullMetrics()
+
+
+def _key(name, labels):
+    u"""Helper method returning the key of a metric. The values of the labels
+    are converted to strings (e.g. status=200 and status=u'error' of the same
+    counter), so the keys are always comparable.
+    """
+    return name, tuple(sorted([(label, u'%s' % value)
+                               for label, value in labels.items()]))
+
+
+def _labels(labels):
+    u"""Helper method formatting the labels of a metric.
+    """
+    if not labels:
+        return u''
+    return u'{%s}' % u','.join(
+        [u'%s="%s"' % (name, (u'%s' % value).replace(u'\\', u'\\\\')
+                      .replace(u'"', u'\\"').replace(u'\n', u'\\n'))
+         for name, value in labels])
+
+
+def _number(value):
+    u"""Helper method formatting a number of a metric.
+    """
+    if isinstance(value, int):
+        return u'%d' % value
+    return repr(float(value))
@@ -0,0 +1,379 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Cross-sectional panel of the fundamentals of a whole ticker universe.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+_STATEMENTS = [u'income_statement', u'balance_sheet', u'cash_flow']
+# Suffixes of the files of a saved panel (raw values and the sidecar index).
+_VALUES_SUFFIX = u'.values'
+_INDEX_SUFFIX = u'.json'
+_FORMAT_VERSION = 1
+
+
+class Panel(object):
+    u"""Accumulates downloaded key ratios and financials of many tickers in a
+    single contiguous float array of shape (ticker, metric, period).
+
+    Metrics are identified by pairs (frame name, label), e.g. ('Key
+    Profitability', 'Return on Equity %') or ('income_statement', 'Revenue'),
+    but can also be looked up by their label alone as long as the label is
+    unique. Line items repeating a title within a financial statement (e.g.
+    'Basic' and 'Diluted' under both the earnings per share and the shares
+    outstanding) are labeled by the titles of their parents, e.g. 'Earnings
+    per share > Basic'. Periods are identified by their (fiscal) year. The array grows as
+    new tickers, metrics and periods are added; missing values are NaN.
+
+    The panel is not thread-safe; fill it from a single thread (e.g. from the
+    results of download_many).
+
+    A panel can be saved to disk (see save) and loaded back as a read-only
+    memory map (see load), so that many processes share the same pages of
+    the OS cache instead of holding their own copies of the data.
+    """
+
+    def __init__(self):
+        u"""Constructs an empty Panel instance.
+        """
+        self._tickers = []
+        self._ticker_index = {}
+        self._metrics = []
+        self._metric_index = {}
+        # Label -> list of metric indexes (for the lookup by label).
+        self._label_index = {}
+        self._first_year = None
+        self._values = np.full((0, 0, 0), np.nan)
+
+    def __len__(self):
+        return len(self._tickers)
+
+    @property
+    def tickers(self):
+        u"""List of tickers (the first axis of values).
+        """
+        return list(self._tickers)
+
+    @property
+    def metrics(self):
+        u"""List of pairs (frame name, label) (the second axis of values).
+        """
+        return list(self._metrics)
+
+    @property
+    def periods(self):
+        u"""List of years (the third axis of values).
+        """
+        if self._first_year is None:
+            return []
+        return list(range(self._first_year,
+                          self._first_year + self._values.shape[2]))
+
+    @property
+    def values(self):
+        u"""The float array of shape (ticker, metric, period) (a view).
+        """
+        return self._values[:len(self._tickers), :len(self._metrics)]
+
+    def add_key_ratios(self, ticker, frames):
+        u"""Adds the key ratios of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param frames: List of pandas.DataFrames returned by
+        KeyRatiosDownloader.download.
+        """
+        for frame in frames:
+            self.add_frame(ticker, frame.index.name, frame.index,
+                           [period.year for period in frame.columns],
+                           frame.values)
+
+    def add_financials(self, ticker, financials):
+        u"""Adds the financials of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param financials: Dictionary returned by FinancialsDownloader.download.
+        """
+        for name in _STATEMENTS:
+            frame = financials[name]
+            self.add_frame(ticker, name, _statement_labels(frame),
+                           [period.year for period in frame.columns[2:]],
+                           frame.iloc[:, 2:].values.astype(float))
+
+    def add_frame(self, ticker, frame_name, labels, years, values):
+        u"""Adds the values of a single frame of the given ticker.
+
+        Previous values of the given metrics of the ticker are replaced. If a
+        label occurs more than once, its later occurrences are numbered, e.g.
+        'Basic', 'Basic (2)', 'Basic (3)'.
+
+        :param ticker: Morningstar ticker.
+        :param frame_name: Name of the frame.
+        :param labels: Labels of the rows of values.
+        :param years: Years of the columns of values.
+        :param values: Float array of shape (labels, years).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not self._values.flags.writeable:
+            # Copy the memory mapped values on the first write.
+            self._values = np.array(self._values)
+        rows = np.array([self._add_metric(frame_name, label)
+                         for label in _unique_labels(labels)],
+                        dtype=np.intp)
+        ticker_row = self._add_ticker(ticker)
+        columns = self._add_years(np.asarray(years, dtype=np.intp))
+        self._values[ticker_row, rows, :] = np.nan
+        self._values[ticker_row, rows[:, None], columns] = values
+
+    def save(self, path):
+        u"""Saves the panel to disk.
+
+        The values are written as a raw C-ordered float64 array to the file
+        path + '.values' and the tickers, metrics and periods to the sidecar
+        index path + '.json'. Both files are replaced atomically.
+
+        :param path: Path of the panel (without the suffix).
+        """
+        values = np.ascontiguousarray(self.values)
+        index = {
+            u'version': _FORMAT_VERSION,
+            u'dtype': values.dtype.str,
+            u'shape': list(values.shape),
+            u'first_year': self._first_year,
+            u'tickers': self._tickers,
+            u'metrics': [list(metric) for metric in self._metrics]}
+        temp_suffix = u'.%d.tmp' % os.getpid()
+        with open(path + _VALUES_SUFFIX + temp_suffix, u'wb') as f:
+            values.tofile(f)
+        with open(path + _INDEX_SUFFIX + temp_suffix, u'w') as f:
+            json.dump(index, f)
+        os.replace(path + _VALUES_SUFFIX + temp_suffix, path + _VALUES_SUFFIX)
+        os.replace(path + _INDEX_SUFFIX + temp_suffix, path + _INDEX_SUFFIX)
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        u"""Loads the panel saved by save.
+
+        :param path: Path of the panel (without the suffix).
+        :param mmap: Whether to map the values into memory (read-only, shared
+        by all processes mapping the same file) instead of reading them. The
+        values are copied once the loaded panel is modified.
+        :return Loaded Panel instance.
+        """
+        with open(path + _INDEX_SUFFIX, u'r') as f:
+            index = json.load(f)
+        if index[u'version'] != _FORMAT_VERSION:
+            raise ValueError(u'Unsupported panel version: %s'
+                             % index[u'version'])
+        dtype = np.dtype(index[u'dtype'])
+        shape = tuple(index[u'shape'])
+        size = int(np.prod(shape)) * dtype.itemsize
+        if os.path.getsize(path + _VALUES_SUFFIX) != size:
+            raise ValueError(u'The values do not match the index: %s' % path)
+        panel = cls()
+        if size == 0:
+            values = np.full(shape, np.nan)
+        elif mmap:
+            values = np.memmap(path + _VALUES_SUFFIX, dtype=dtype, mode=u'r',
+                               shape=shape)
+        else:
+            values = np.fromfile(path + _VALUES_SUFFIX,
+                                 dtype=dtype).reshape(shape)
+        panel._values = values
+        panel._first_year = index[u'first_year']
+        for ticker in index[u'tickers']:
+            panel._ticker_index[ticker] = len(panel._tickers)
+            panel._tickers.append(ticker)
+        for frame_name, label in index[u'metrics']:
+            panel._metric_index[(frame_name, label)] = len(panel._metrics)
+            panel._label_index.setdefault(label, []).append(
+                len(panel._metrics))
+            panel._metrics.append((frame_name, label))
+        return panel
+
+    def metric_index(self, metric):
+        u"""Returns the index of the given metric (the second axis of values).
+
+        :param metric: Pair (frame name, label) or a unique label.
+        :return Index of the metric.
+        """
+        if isinstance(metric, tuple):
+            return self._metric_index[metric]
+        indexes = self._label_index[metric]
+        if len(indexes) > 1:
+            raise KeyError(u'Ambiguous label %s, use (frame name, label): %s'
+                           % (metric, [self._metrics[i] for i in indexes]))
+        return indexes[0]
+
+    def period_index(self, year):
+        u"""Returns the index of the given year (the third axis of values).
+
+        :param year: Year of the period.
+        :return Index of the period.
+        """
+        if (self._first_year is None or
+                not 0 <= year - self._first_year < self._values.shape[2]):
+            raise KeyError(year)
+        return year - self._first_year
+
+    def ticker_index(self, ticker):
+        u"""Returns the index of the given ticker (the first axis of values).
+
+        :param ticker: Morningstar ticker.
+        :return Index of the ticker.
+        """
+        return self._ticker_index[ticker]
+
+    def cross_section(self, metric, year):
+        u"""Returns the values of the given metric of all tickers in the given
+        year, e.g. panel.cross_section('Return on Equity %', 2015).
+
+        :param metric: Pair (frame name, label) or a unique label.
+        :param year: Year of the period.
+        :return pandas.Series indexed by the tickers (a view of values).
+        """
+        return pd.Series(
+            self.values[:, self.metric_index(metric), self.period_index(year)],
+            index=pd.Index(self._tickers, name=u'ticker'), name=year,
+            copy=False)
+
+    def history(self, metric):
+        u"""Returns the values of the given metric of all tickers in all years.
+
+        :param metric: Pair (frame name, label) or a unique label.
+        :return pandas.DataFrame of tickers by years (a view of values).
+        """
+        return pd.DataFrame(
+            self.values[:, self.metric_index(metric), :],
+            index=pd.Index(self._tickers, name=u'ticker'),
+            columns=pd.Index(self.periods, name=u'year'), copy=False)
+
+    def _add_ticker(self, ticker):
+        u"""Returns the index of the given ticker (adds the ticker if needed).
+        """
+        index = self._ticker_index.get(ticker)
+        if index is None:
+            index = len(self._tickers)
+            self._reserve(index + 1, len(self._metrics))
+            self._tickers.append(ticker)
+            self._ticker_index[ticker] = index
+        return index
+
+    def _add_metric(self, frame_name, label):
+        u"""Returns the index of the given metric (adds the metric if needed).
+        """
+        metric = (frame_name, label)
+        index = self._metric_index.get(metric)
+        if index is None:
+            index = len(self._metrics)
+            self._reserve(len(self._tickers), index + 1)
+            self._metrics.append(metric)
+            self._metric_index[metric] = index
+            self._label_index.setdefault(label, []).append(index)
+        return index
+
+    def _add_years(self, years):
+        u"""Returns the indexes of the given years (adds the periods if needed).
+        """
+        if years.size == 0:
+            return years
+        first_year, last_year = int(years.min()), int(years.max())
+        if self._first_year is None:
+            self._first_year = first_year
+        num_periods = self._values.shape[2]
+        if first_year < self._first_year or (
+                last_year >= self._first_year + num_periods):
+            new_first_year = min(first_year, self._first_year)
+            new_num_periods = max(last_year + 1,
+                                  self._first_year + num_periods) - (
+                                      new_first_year)
+            values = np.full(self._values.shape[:2] + (new_num_periods,),
+                             np.nan)
+            offset = self._first_year - new_first_year
+            values[:, :, offset:offset + num_periods] = self._values
+            self._values = values
+            self._first_year = new_first_year
+        return years - self._first_year
+
+    def _reserve(self, num_tickers, num_metrics):
+        u"""Grows the capacity of the array (doubling it) if needed.
+        """
+        capacity = self._values.shape
+        if num_tickers <= capacity[0] and num_metrics <= capacity[1]:
+            return
+        shape = (_grow(capacity[0], num_tickers, 16),
+                 _grow(capacity[1], num_metrics, 64), capacity[2])
+        values = np.full(shape, np.nan)
+        values[:capacity[0], :capacity[1]] = self._values
+        self._values = values
+
+
+def _grow(capacity, size, minimum):
+    u"""Helper method returning the new capacity of an axis of the array.
+
+    :param capacity: Current capacity.
+    :param size: Required size.
+    :param minimum: Minimum capacity of a grown axis.
+    :return New capacity (at least double the current one if it grows).
+    """
+    if size <= capacity:
+        return capacity
+    return max(2 * capacity, size, minimum)
+
+
+def _statement_labels(frame):
+    u"""Helper method returning the labels of the line items of a financial
+    statement. Titles occurring more than once are prefixed by the titles of
+    their parents, e.g. 'Earnings per share > Basic'.
+
+    :param frame: pandas.DataFrame of the financial statement (with the
+    columns parent_index and title).
+    :return List of labels.
+    """
+    titles = list(frame[u'title'])
+    counts = {}
+    for title in titles:
+        counts[title] = counts.get(title, 0) + 1
+    labels = []
+    for row, (parent, title) in enumerate(zip(frame[u'parent_index'],
+                                              titles)):
+        if counts[title] > 1 and parent != row:
+            title = u'%s > %s' % (titles[parent], title)
+        labels.append(title)
+    return labels
+
+
+def _unique_labels(labels):
+    u"""Helper method numbering the later occurrences of repeated labels.
+
+    :param labels: Iterable of labels.
+    :return List of unique labels, e.g. ['x', 'x (2)', 'x (3)'] for
+    ['x', 'x', 'x'].
+    """
+    counts = {}
+    unique = []
+    for label in labels:
+        count = counts.get(label, 0) + 1
+        counts[label] = count
+        unique.append(label if count == 1 else u'%s (%d)' % (label, count))
+    return unique
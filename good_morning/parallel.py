@@ -0,0 +1,264 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Parsing of the responses from financials.morningstar.com in a pool of
+processes.
+
+Parsing (BeautifulSoup, csv, building the frames) is CPU bound and serialized
+on the GIL when it runs in the download threads. A ParsePool moves it to a
+pool of worker processes: the threads only fetch the raw responses and wait
+for the parsed frames. The frames travel back in a compact form (NumPy arrays
+and lists of labels) rather than as pickled pandas.DataFrames.
+"""
+
+import concurrent.futures
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+from good_morning.good_morning import KeyRatiosDownloader, FinancialsDownloader
+from good_morning.good_morning import _REPORTS
+from good_morning.metrics import NULL_METRICS
+from good_morning.tree import StatementTree
+
+
+class ParsePool(object):
+    u"""Pool of processes parsing the responses of the downloaders.
+
+    The methods block until the response is parsed, so they are meant to be
+    called from many download threads at once (see download_many). Their
+    coroutine counterparts (akey_ratios, afinancials) are used by the
+    adownload methods of the downloaders.
+    """
+
+    def __init__(self, processes = None, metrics = None):
+        u"""Constructs the ParsePool instance.
+
+        :param processes: Number of worker processes (by default the number
+        of CPUs).
+        :param metrics: Metrics registry to which the latency of the stages
+        measured in the worker processes is reported.
+        """
+        # The workers are not forked from the current process, which may
+        # already run the download threads and hold open connections.
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context(
+                u'forkserver'
+                if u'forkserver' in multiprocessing.get_all_start_methods()
+                else u'spawn'))
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+
+    def key_ratios(self, body):
+        u"""Parses the given raw csv response with the key ratios.
+
+        :param body: Raw body of the response (bytes).
+        :return: List of pandas.DataFrames containing the key ratios.
+        """
+        packed, observations = self._executor.submit(
+            parse_key_ratios, body).result()
+        self._report(observations)
+        return unpack_key_ratios(packed)
+
+    def financials(self, bodies, parser = u'bs4'):
+        u"""Parses the given raw responses with the financial statements.
+
+        :param bodies: List of raw bodies of the responses, one for every
+        report (income statement, balance sheet, cash flow).
+        :param parser: Parser of the financial statements ('bs4' or 'fast').
+        :return Dictionary containing pandas.DataFrames representing the
+        financials (see FinancialsDownloader.download).
+        """
+        packed, observations = self._executor.submit(
+            parse_financials, bodies, parser).result()
+        self._report(observations)
+        return unpack_financials(packed)
+
+    async def akey_ratios(self, body):
+        u"""Parses the given raw csv response with the key ratios without
+        blocking the running event loop (see key_ratios).
+        """
+        # asyncio is imported only by the async entry points (see
+        # good_morning.aio).
+        import asyncio
+        packed, observations = await asyncio.wrap_future(
+            self._executor.submit(parse_key_ratios, body))
+        self._report(observations)
+        return unpack_key_ratios(packed)
+
+    async def afinancials(self, bodies, parser = u'bs4'):
+        u"""Parses the given raw responses with the financial statements
+        without blocking the running event loop (see financials).
+        """
+        import asyncio
+        packed, observations = await asyncio.wrap_future(
+            self._executor.submit(parse_financials, bodies, parser))
+        self._report(observations)
+        return unpack_financials(packed)
+
+    def close(self):
+        u"""Shuts the worker processes down.
+        """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _report(self, observations):
+        u"""Reports the observations recorded in a worker process.
+
+        :param observations: List of triples (name, labels, value).
+        """
+        for name, labels, value in observations:
+            self._metrics.observe(name, value, **labels)
+
+
+def parse_key_ratios(body):
+    u"""Parses the given raw csv response with the key ratios (in a worker
+    process).
+
+    :param body: Raw body of the response (bytes).
+    :return Pair (compact form of the key ratios, list of the observations
+    of the metrics).
+    """
+    recorder = _Recorder()
+    frames = KeyRatiosDownloader._parse_body(body, recorder)
+    return pack_key_ratios(frames), recorder.observations
+
+
+def parse_financials(bodies, parser = u'bs4'):
+    u"""Parses the given raw responses with the financial statements (in a
+    worker process).
+
+    :param bodies: List of raw bodies of the responses.
+    :param parser: Parser of the financial statements ('bs4' or 'fast').
+    :return Pair (compact form of the financials, list of the observations
+    of the metrics).
+    """
+    recorder = _Recorder()
+    # The trees are built by unpack_financials in the parent process.
+    result = FinancialsDownloader._parse_bodies(bodies, parser, recorder,
+                                                trees=False)
+    return pack_financials(result), recorder.observations
+
+
+def pack_key_ratios(frames):
+    u"""Returns the compact (picklable) form of the given key ratios.
+
+    :param frames: List of pandas.DataFrames containing the key ratios.
+    :return List of tuples (frame name, labels, first period, values).
+    """
+    return [(frame.index.name, frame.index.tolist(), frame.columns[0],
+             np.ascontiguousarray(frame.values)) for frame in frames]
+
+
+def unpack_key_ratios(packed):
+    u"""Returns the key ratios corresponding to the given compact form.
+
+    :param packed: Compact form returned by pack_key_ratios.
+    :return List of pandas.DataFrames containing the key ratios.
+    """
+    frames = []
+    for frame_name, labels, first_period, values in packed:
+        columns = pd.period_range(first_period, periods=values.shape[1])
+        columns.name = u'Period'
+        frames.append(pd.DataFrame(
+            values, index=pd.Index(labels, name=frame_name),
+            columns=columns))
+    return frames
+
+
+def pack_financials(result):
+    u"""Returns the compact (picklable) form of the given financials.
+
+    :param result: Dictionary containing pandas.DataFrames representing the
+    financials.
+    :return Tuple (fiscal year end, currency, list of statements), where
+    every statement is a tuple (first period, number of periods, parent
+    indexes, titles, values). The statements may differ in their periods
+    (e.g. a balance sheet without the TTM column).
+    """
+    statements = []
+    for _, table_name in _REPORTS:
+        frame = result[table_name]
+        periods = frame.columns[2:]
+        statements.append((
+            periods[0], len(periods), frame[u'parent_index'].to_numpy(),
+            frame[u'title'].tolist(),
+            np.ascontiguousarray(frame[periods].to_numpy())))
+    return result[u'fiscal_year_end'], result[u'currency'], statements
+
+
+def unpack_financials(packed):
+    u"""Returns the financials corresponding to the given compact form.
+
+    :param packed: Compact form returned by pack_financials.
+    :return Dictionary containing pandas.DataFrames representing the
+    financials.
+    """
+    fiscal_year_end, currency, statements = packed
+    result = {}
+    for (_, table_name), (first_period, num_periods, parent_index, titles,
+                          values) in zip(_REPORTS, statements):
+        # The period range of the financials is the one of the last
+        # statement (as in FinancialsDownloader._parse_bodies).
+        period_range = pd.period_range(first_period, periods=num_periods)
+        frame = pd.DataFrame(values, columns=period_range)
+        frame.insert(0, u'title', titles)
+        frame.insert(0, u'parent_index', parent_index)
+        result[table_name] = frame
+    result[u'period_range'] = period_range
+    result[u'fiscal_year_end'] = fiscal_year_end
+    result[u'currency'] = currency
+    result[u'trees'] = StatementTree.from_result(result)
+    return result
+
+
+class _Recorder(object):
+    u"""Records the observations of the timers in a worker process, so that
+    they can be reported to the Metrics registry of the parent process.
+    """
+
+    def __init__(self):
+        self.observations = []
+
+    def timer(self, name, **labels):
+        return _RecordingTimer(self.observations, name, labels)
+
+
+class _RecordingTimer(object):
+    u"""Context manager appending its duration to a list of observations.
+    """
+
+    def __init__(self, observations, name, labels):
+        self._observations = observations
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._observations.append((self._name, self._labels,
+                                   time.perf_counter() - self._start))
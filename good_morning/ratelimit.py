@@ -0,0 +1,210 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Rate limiting of requests sent to financials.morningstar.com.
+
+Both RateLimiter and AdaptiveRateLimiter implement the methods acquire() and
+release(success, latency), so either of them can be passed to HTTPSession as
+its scheduler.
+"""
+
+import threading
+import time
+
+from good_morning.metrics import NULL_METRICS
+
+# Gauges of the current state of AdaptiveRateLimiter.
+RATE_GAUGE = u'good_morning_scheduler_rate'
+CONCURRENCY_GAUGE = u'good_morning_scheduler_concurrency'
+IN_FLIGHT_GAUGE = u'good_morning_scheduler_in_flight'
+
+
+class RateLimiter(object):
+    u"""Thread-safe token bucket limiting how often an action may start.
+    """
+
+    def __init__(self, rate = 1.0, burst = 1):
+        u"""Constructs the RateLimiter instance.
+
+        :param rate: Maximum number of acquisitions per second. If rate is None
+        or not positive then the limiter does not throttle at all.
+        :param burst: Maximum number of acquisitions allowed back to back.
+        """
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        u"""Blocks until the caller is allowed to proceed.
+
+        Every caller reserves its token under the lock and then sleeps outside
+        of it, so concurrent callers are spread evenly over time.
+        """
+        if not self._rate or self._rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self._burst),
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, success = True, latency = None):
+        u"""Does nothing, the rate of RateLimiter is fixed.
+
+        :param success: Whether the action succeeded.
+        :param latency: Duration of the action (in seconds).
+        """
+
+
+class AdaptiveRateLimiter(object):
+    u"""Thread-safe token bucket limiting the rate and the concurrency of
+    requests, adjusted by the responses of the server (AIMD).
+
+    Every fast successful response increases the rate additively and the
+    concurrency by about one per window of concurrent requests. Every failure
+    (network errors, timeouts, HTTP 429 and 5xx, empty bodies) decreases both
+    multiplicatively, at most once per cooldown, so that a burst of failures
+    of concurrent requests counts as a single congestion signal. The current
+    rate and concurrency are exposed as the properties rate and concurrency
+    and reported as gauges to the given metrics registry.
+    """
+
+    def __init__(self, rate = 1.0, concurrency = 4, min_rate = 0.1,
+                 max_rate = 20.0, max_concurrency = 32, increase = 0.2,
+                 decrease = 0.5, slow = 5.0, cooldown = 1.0,
+                 metrics = None):
+        u"""Constructs the AdaptiveRateLimiter instance.
+
+        :param rate: Initial number of requests per second (clamped to the
+        range [min_rate, max_rate]).
+        :param concurrency: Initial number of concurrent requests.
+        :param min_rate: Minimum number of requests per second (positive).
+        :param max_rate: Maximum number of requests per second.
+        :param max_concurrency: Maximum number of concurrent requests.
+        :param increase: Increase of the rate after a fast successful
+        response (in requests per second).
+        :param decrease: Factor applied to the rate and the concurrency after
+        a failure.
+        :param slow: Latency (in seconds) above which a successful response
+        does not increase the rate.
+        :param cooldown: Minimum number of seconds between two decreases.
+        :param metrics: Metrics registry to which the current rate,
+        concurrency and number of requests in flight are reported (the
+        decreases are counted in good_morning_scheduler_decreases_total).
+        """
+        if not min_rate > 0 or min_rate > max_rate:
+            raise ValueError(u'Invalid range of the rate: [%s, %s]'
+                             % (min_rate, max_rate))
+        self._rate = min(float(max_rate), max(float(min_rate), float(rate)))
+        self._concurrency = float(concurrency)
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._max_concurrency = max_concurrency
+        self._increase = increase
+        self._decrease = decrease
+        self._slow = slow
+        self._cooldown = cooldown
+        self._in_flight = 0
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._last_decrease = None
+        self._condition = threading.Condition()
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        self._report()
+
+    @property
+    def rate(self):
+        u"""Current number of requests per second.
+        """
+        return self._rate
+
+    @property
+    def concurrency(self):
+        u"""Current maximum number of concurrent requests.
+        """
+        return max(1, int(self._concurrency))
+
+    @property
+    def in_flight(self):
+        u"""Number of requests currently in flight.
+        """
+        return self._in_flight
+
+    def acquire(self):
+        u"""Blocks until the caller is allowed to send a request.
+
+        Every acquire must be followed by exactly one release.
+        """
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            now = time.monotonic()
+            self._tokens = min(1.0,
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            # The request is counted only once nothing else can fail.
+            self._in_flight += 1
+            self._report()
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, success = True, latency = None):
+        u"""Releases the request and adjusts the rate and the concurrency.
+
+        :param success: Whether the request succeeded.
+        :param latency: Duration of the request (in seconds).
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if success:
+                if latency is None or latency <= self._slow:
+                    self._rate = min(self._max_rate,
+                                     self._rate + self._increase)
+                    self._concurrency = min(
+                        float(self._max_concurrency),
+                        self._concurrency + 1.0 / self._concurrency)
+            else:
+                now = time.monotonic()
+                if (self._last_decrease is None or
+                        now - self._last_decrease >= self._cooldown):
+                    self._last_decrease = now
+                    self._rate = max(self._min_rate,
+                                     self._rate * self._decrease)
+                    self._concurrency = max(
+                        1.0, self._concurrency * self._decrease)
+                    self._metrics.increment(
+                        u'good_morning_scheduler_decreases_total')
+            self._report()
+            self._condition.notify_all()
+
+    def _report(self):
+        u"""Reports the current state to the metrics registry (called with
+        the lock held).
+        """
+        self._metrics.set_gauge(RATE_GAUGE, self._rate)
+        self._metrics.set_gauge(CONCURRENCY_GAUGE, self.concurrency)
+        self._metrics.set_gauge(IN_FLIGHT_GAUGE, self._in_flight)
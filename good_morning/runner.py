@@ -0,0 +1,333 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Resumable batch runner downloading the data of a whole ticker universe.
+
+The runner keeps a journal (one JSON object per line) of the completed and the
+failed tickers, so that an interrupted run can be resumed where it stopped.
+Failed tickers are retried with an exponential backoff.
+
+Usage: good-morning tickers.txt --journal run.journal --mysql-db morningstar
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+
+def download_many(tickers, **kwargs):
+    u"""Calls good_morning.batch.download_many, which is imported on the first
+    use (together with pandas), so that the script starts fast.
+    """
+    from good_morning.batch import download_many
+    return download_many(tickers, **kwargs)
+
+
+class Journal(object):
+    u"""Append-only journal of the completed and the failed tickers.
+
+    Every line of the journal is a JSON object with the keys ticker, status
+    ('ok' or 'failed'), error, attempt and time. The last line of every ticker
+    determines its status.
+    """
+
+    def __init__(self, path):
+        u"""Constructs the Journal instance (reads the existing journal).
+
+        :param path: Path of the journal.
+        """
+        self._path = path
+        # Ticker -> last journal entry.
+        self._entries = {}
+        line = u'\n'
+        if os.path.exists(path):
+            with open(path, u'r', encoding=u'utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line truncated by a crash.
+                        continue
+                    self._entries[entry[u'ticker']] = entry
+        self._file = open(path, u'a', encoding=u'utf-8')
+        if not line.endswith(u'\n'):
+            # Terminate the truncated line.
+            self._file.write(u'\n')
+
+    @property
+    def completed(self):
+        u"""Set of the completed tickers.
+        """
+        return set(ticker for ticker, entry in self._entries.items()
+                   if entry[u'status'] == u'ok')
+
+    @property
+    def failed(self):
+        u"""Dictionary mapping the failed tickers to their last errors.
+        """
+        return dict((ticker, entry[u'error'])
+                    for ticker, entry in self._entries.items()
+                    if entry[u'status'] == u'failed')
+
+    def record(self, ticker, error = None, attempt = 0):
+        u"""Records the result of the given ticker (flushed immediately).
+
+        :param ticker: Morningstar ticker.
+        :param error: Exception raised while downloading the ticker (None on
+        success).
+        :param attempt: Number of the attempt (0 for the first one).
+        """
+        entry = {u'ticker': ticker,
+                 u'status': u'ok' if error is None else u'failed',
+                 u'error': None if error is None else u'%r' % error,
+                 u'attempt': attempt,
+                 u'time': time.time()}
+        self._entries[ticker] = entry
+        self._file.write(json.dumps(entry) + u'\n')
+        self._file.flush()
+
+    def close(self):
+        u"""Closes the journal.
+        """
+        self._file.close()
+
+
+class Progress(object):
+    u"""Reports the number of processed tickers, the throughput and the ETA.
+    """
+
+    def __init__(self, total, out = None, interval = 10.0, scheduler = None):
+        u"""Constructs the Progress instance.
+
+        :param total: Total number of tickers to be processed.
+        :param out: Output stream (sys.stderr by default).
+        :param interval: Minimum number of seconds between two reports.
+        :param scheduler: AdaptiveRateLimiter whose current rate and
+        concurrency are reported as well.
+        """
+        self._total = total
+        self._scheduler = scheduler
+        self._out = out if out is not None else sys.stderr
+        self._interval = interval
+        self._start = time.monotonic()
+        self._last_report = self._start
+        self.completed = 0
+        self.failed = 0
+
+    def update(self, ok):
+        u"""Updates the progress with the result of a single ticker.
+
+        :param ok: Whether the ticker was downloaded successfully.
+        """
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self._last_report >= self._interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        u"""Writes the current progress to the output stream.
+        """
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        # Failed tickers (after their last retry) are done as well.
+        done = self.completed + self.failed
+        rate = done / elapsed
+        remaining = max(self._total - done, 0)
+        eta = (u'%s' % datetime.timedelta(seconds=int(remaining / rate))
+               if rate > 0 else u'unknown')
+        line = (u'%d/%d tickers done, %d completed, %d failed, '
+                u'%.2f tickers/s, ETA %s' % (
+                    done, self._total, self.completed, self.failed, rate,
+                    eta))
+        if self._scheduler is not None:
+            line += u', %.2f requests/s, concurrency %d' % (
+                self._scheduler.rate, self._scheduler.concurrency)
+        print(line, file=self._out)
+        self._out.flush()
+
+
+def run(tickers, journal, retries = 3, backoff = 60.0, progress = None,
+        **kwargs):
+    u"""Downloads the tickers not yet completed according to the journal.
+
+    Tickers which fail are retried (at most retries times) with an
+    exponential backoff once all the other tickers are processed.
+
+    :param tickers: Iterable of Morningstar tickers.
+    :param journal: Journal of the run.
+    :param retries: Maximum number of retries of a failed ticker.
+    :param backoff: Number of seconds to wait before the first retry (doubled
+    before every next retry).
+    :param progress: Progress reporting the run (by default a new one).
+    :param kwargs: Additional parameters of download_many.
+    :return Dictionary mapping the tickers which failed to their last errors.
+    """
+    completed = journal.completed
+    # Ordered and without duplicates (a dict keeps the insertion order).
+    pending = list(dict.fromkeys(ticker for ticker in tickers
+                                 if ticker not in completed))
+    if progress is None:
+        progress = Progress(len(pending),
+                            scheduler=kwargs.get(u'scheduler'))
+    errors = {}
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        errors = {}
+        for result in download_many(pending, **kwargs):
+            journal.record(result.ticker, result.error, attempt)
+            if result.error is None:
+                progress.update(True)
+            else:
+                errors[result.ticker] = result.error
+                if attempt == retries:
+                    progress.update(False)
+        pending = [ticker for ticker in pending if ticker in errors]
+    progress.report()
+    return errors
+
+
+def read_tickers(path):
+    u"""Reads the tickers from the given file (one ticker per line, empty lines
+    and lines starting with # are ignored).
+
+    :param path: Path of the file.
+    :return List of tickers.
+    """
+    with open(path, u'r', encoding=u'utf-8') as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith(u'#')]
+
+
+def main(argv = None):
+    u"""Entry point of the good-morning console script.
+
+    :param argv: Command line arguments (sys.argv[1:] by default).
+    :return Exit status (0 if all the tickers were downloaded).
+    """
+    parser = argparse.ArgumentParser(
+        prog=u'good-morning',
+        description=u'Downloads key ratios and financials from '
+                    u'financials.morningstar.com for a list of tickers.')
+    parser.add_argument(u'tickers', help=u'file with one ticker per line')
+    parser.add_argument(u'--journal', help=u'journal of the run (default: '
+                        u'the tickers file with the suffix .journal)')
+    parser.add_argument(u'--restart', action=u'store_true',
+                        help=u'ignore the existing journal')
+    parser.add_argument(u'--retries', type=int, default=3)
+    parser.add_argument(u'--backoff', type=float, default=60.0,
+                        help=u'seconds before the first retry')
+    parser.add_argument(u'--workers', type=int, default=8)
+    parser.add_argument(u'--rate', type=float, default=1.0,
+                        help=u'tickers started per second')
+    parser.add_argument(u'--adaptive', action=u'store_true',
+                        help=u'adjust the request rate and concurrency to '
+                             u'the responses of the server (--rate is the '
+                             u'initial request rate)')
+    parser.add_argument(u'--no-key-ratios', action=u'store_true')
+    parser.add_argument(u'--no-financials', action=u'store_true')
+    parser.add_argument(u'--parser', choices=[u'bs4', u'fast'],
+                        default=u'bs4')
+    parser.add_argument(u'--processes', type=int,
+                        help=u'parse the responses in a pool of processes '
+                             u'(0 uses all CPUs)')
+    parser.add_argument(u'--base-url', help=u'base URL of the requests '
+                        u'(e.g. of good_morning.fake_server)')
+    parser.add_argument(u'--cache', help=u'directory of the response cache')
+    parser.add_argument(u'--state', help=u'incremental refresh state file')
+    storage = parser.add_mutually_exclusive_group()
+    storage.add_argument(u'--parquet', help=u'root of the Parquet dataset')
+    storage.add_argument(u'--sqlite', help=u'SQLite database file')
+    parser.add_argument(u'--mysql-host', default=u'localhost')
+    parser.add_argument(u'--mysql-user', default=os.environ.get(u'USER'))
+    parser.add_argument(u'--mysql-db', help=u'MySQL database (the password '
+                        u'is read from the MYSQL_PWD environment variable)')
+    parser.add_argument(u'--metrics', help=u'Prometheus text file the '
+                        u'metrics of the run are written to')
+    parser.add_argument(u'--batch-size', type=int, default=50)
+    parser.add_argument(u'--bulk', action=u'store_true',
+                        help=u'upload with LOAD DATA LOCAL INFILE')
+    args = parser.parse_args(argv)
+    if args.adaptive and not args.rate > 0:
+        parser.error(u'--adaptive requires a positive --rate')
+
+    kwargs = {u'max_workers': args.workers, u'rate': args.rate,
+              u'key_ratios': not args.no_key_ratios,
+              u'financials': not args.no_financials,
+              u'parser': args.parser, u'batch_size': args.batch_size,
+              u'bulk': args.bulk, u'processes': args.processes}
+    if args.metrics:
+        from good_morning.metrics import Metrics
+        kwargs[u'metrics'] = Metrics()
+    if args.base_url:
+        kwargs[u'base_url'] = args.base_url
+    if args.adaptive:
+        from good_morning.ratelimit import AdaptiveRateLimiter
+        kwargs[u'scheduler'] = AdaptiveRateLimiter(
+            rate=args.rate, max_concurrency=args.workers,
+            metrics=kwargs.get(u'metrics'))
+        kwargs[u'rate'] = None
+    if args.cache:
+        from good_morning.cache import ResponseCache
+        kwargs[u'cache'] = ResponseCache(args.cache)
+    if args.state:
+        from good_morning.incremental import RefreshState
+        kwargs[u'state'] = RefreshState(args.state)
+    if args.parquet:
+        from good_morning.storage import ParquetStorage
+        kwargs[u'storage'] = ParquetStorage(args.parquet)
+    if args.sqlite:
+        from good_morning.storage import SQLiteStorage
+        kwargs[u'storage'] = SQLiteStorage(args.sqlite)
+    if args.mysql_db:
+        import pymysql
+        kwargs[u'conn'] = pymysql.connect(
+            host=args.mysql_host, user=args.mysql_user,
+            passwd=os.environ.get(u'MYSQL_PWD', u''), db=args.mysql_db,
+            local_infile=args.bulk)
+
+    journal_path = args.journal or args.tickers + u'.journal'
+    if args.restart and os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = Journal(journal_path)
+    try:
+        errors = run(read_tickers(args.tickers), journal, args.retries,
+                     args.backoff, **kwargs)
+    finally:
+        journal.close()
+        if args.sqlite:
+            kwargs[u'storage'].close()
+        if args.metrics:
+            kwargs[u'metrics'].write_prometheus(args.metrics)
+            kwargs[u'metrics'].log()
+    for ticker, error in sorted(errors.items()):
+        print(u'%s ... failed %r' % (ticker, error), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
@@ -0,0 +1,461 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Storage backends for the data downloaded from financials.morningstar.com.
+
+Every storage backend implements the methods write_key_ratios(ticker, frames),
+write_financials(ticker, financials) and flush(). They can be passed to both
+KeyRatiosDownloader and FinancialsDownloader (the storage parameter) and to
+download_many.
+"""
+
+import contextlib
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from good_morning.good_morning import KeyRatiosDownloader
+from good_morning.good_morning import FinancialsDownloader
+
+_STATEMENTS = [u'income_statement', u'balance_sheet', u'cash_flow']
+
+
+class ParquetStorage(object):
+    u"""Stores the downloaded data in a partitioned Parquet dataset.
+
+    The dataset is partitioned by the (cleaned) name of the frame and by the
+    ticker, e.g. root/frame=key_financials_usd/ticker=AAPL/data.parquet. Key
+    ratios are stored with one row per period and one float64 column per line
+    item. Financial statements (income_statement, balance_sheet, cash_flow)
+    are stored in the long format with the columns id, parent_id, item,
+    period and value. The fiscal_year_end and the currency are stored in the
+    frame unit. Periods are stored as dates (the end of the period). Writing
+    the data of a ticker replaces its previous data.
+
+    Requires pyarrow.
+    """
+
+    def __init__(self, root, compression = u'snappy'):
+        u"""Constructs the ParquetStorage instance.
+
+        :param root: Root directory of the dataset.
+        :param compression: Compression codec of the Parquet files.
+        """
+        _import_pyarrow()
+        self._root = root
+        self._compression = compression
+
+    def write_key_ratios(self, ticker, frames):
+        u"""Writes the key ratios of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param frames: List of pandas.DataFrames returned by
+        KeyRatiosDownloader.download.
+        """
+        pa, _, _ = _import_pyarrow()
+        for frame in frames:
+            arrays = [_period_dates(frame.columns)]
+            arrays.extend([pa.array(row, type=pa.float64())
+                           for row in frame.values])
+            table = pa.Table.from_arrays(
+                arrays, names=[u'period'] + [u'%s' % label
+                                              for label in frame.index])
+            table = table.replace_schema_metadata(
+                {u'frame_name': frame.index.name})
+            self._write(KeyRatiosDownloader._get_db_name(frame.index.name),
+                        ticker, table)
+
+    def write_financials(self, ticker, financials):
+        u"""Writes the financials of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param financials: Dictionary returned by FinancialsDownloader.download.
+        """
+        pa, _, _ = _import_pyarrow()
+        for name in _STATEMENTS:
+            frame = financials[name]
+            periods = frame.columns[2:]
+            values = frame.iloc[:, 2:].values.astype(float)
+            num_items, num_periods = values.shape
+            dates = _period_dates(periods)
+            table = pa.table({
+                u'id': pa.array(np.repeat(frame.index.values, num_periods),
+                                type=pa.int32()),
+                u'parent_id': pa.array(
+                    np.repeat(frame[u'parent_index'].values, num_periods),
+                    type=pa.int32()),
+                u'item': pa.array(np.repeat(
+                    frame[u'title'].values.astype(object), num_periods),
+                    type=pa.string()),
+                u'period': dates.take(pa.array(
+                    np.tile(np.arange(num_periods), num_items))),
+                u'value': pa.array(values.ravel(), type=pa.float64())})
+            self._write(name, ticker, table)
+        self._write(u'unit', ticker, pa.table({
+            u'fiscal_year_end': pa.array(
+                [int(financials[u'fiscal_year_end'])], type=pa.int32()),
+            u'currency': pa.array([financials[u'currency']],
+                                  type=pa.string())}))
+
+    def flush(self):
+        u"""Does nothing, the data is written immediately.
+        """
+
+    def read(self, frame_name, columns = None, tickers = None, start = None,
+             end = None):
+        u"""Reads the stored data of the given frame for many tickers.
+
+        Only the requested columns are read and the filters on the tickers and
+        the periods are pushed down to the Parquet scan.
+
+        :param frame_name: Name of the frame (e.g. 'Key Financials USD',
+        'key_financials_usd' or 'income_statement').
+        :param columns: List of columns to be read (all by default).
+        :param tickers: List of Morningstar tickers (all by default).
+        :param start: First period (date) to be read (ignored by the frames
+        without periods, e.g. the unit).
+        :param end: Last period (date) to be read.
+        :return pandas.DataFrame with the columns ticker, period (if the frame
+        has periods) and the requested columns.
+        """
+        pa, ds, _ = _import_pyarrow()
+        directory = os.path.join(
+            self._root,
+            u'frame=' + KeyRatiosDownloader._get_db_name(frame_name))
+        partitioning = ds.partitioning(
+            pa.schema([(u'ticker', pa.string())]), flavor=u'hive')
+        if tickers is None:
+            # Only the Parquet files (not the temporary files of the writes).
+            sources = sorted(glob.glob(os.path.join(
+                glob.escape(directory), u'ticker=*', u'*.parquet')))
+        else:
+            sources = [path for path in
+                       [self._path(directory, ticker) for ticker in tickers]
+                       if os.path.exists(path)]
+        if not sources:
+            return pd.DataFrame()
+        dataset = ds.dataset(sources, format=u'parquet',
+                             partitioning=partitioning,
+                             partition_base_dir=directory)
+        # Tickers may differ in their line items.
+        schema = pa.unify_schemas(
+            [fragment.physical_schema for fragment in
+             dataset.get_fragments()] + [partitioning.schema])
+        dataset = ds.dataset(sources, schema=schema, format=u'parquet',
+                             partitioning=partitioning,
+                             partition_base_dir=directory)
+        has_period = u'period' in schema.names
+        if columns is not None:
+            columns = [u'ticker'] + ([u'period'] if has_period else []) + [
+                column for column in columns
+                if column not in (u'ticker', u'period')]
+        condition = None
+        # Frames without periods (e.g. the unit) are not filtered by them.
+        if start is not None and has_period:
+            condition = ds.field(u'period') >= pd.Timestamp(start).date()
+        if end is not None and has_period:
+            condition = _and(condition,
+                             ds.field(u'period') <= pd.Timestamp(end).date())
+        return dataset.to_table(columns=columns,
+                                filter=condition).to_pandas()
+
+    def _write(self, name, ticker, table):
+        u"""Writes the given pyarrow.Table to the partition of the ticker.
+
+        :param name: Name of the frame partition.
+        :param ticker: Morningstar ticker.
+        :param table: pyarrow.Table to be written.
+        """
+        _, _, pq = _import_pyarrow()
+        path = self._path(os.path.join(self._root, u'frame=' + name), ticker)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Unique temporary file (per thread and process), which is never read
+        # as a part of the dataset.
+        fd, temp_path = tempfile.mkstemp(prefix=u'.', suffix=u'.tmp',
+                                         dir=directory)
+        os.close(fd)
+        try:
+            pq.write_table(table, temp_path, compression=self._compression)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _path(directory, ticker):
+        u"""Returns the path of the Parquet file of the given ticker.
+        """
+        return os.path.join(
+            directory, u'ticker=' + urllib.parse.quote(ticker, safe=u''),
+            u'data.parquet')
+
+
+class SQLiteStorage(object):
+    u"""Stores the downloaded data in an embedded SQLite database.
+
+    The database has the same morningstar_* tables as the MySQL database
+    (see KeyRatiosDownloader and FinancialsDownloader): one table per frame of
+    the key ratios (with one row per ticker and period), one table per
+    financial statement (with one row per ticker and line item and one column
+    per year) and the unit table. Key ratio tables are indexed by (ticker,
+    period) and by period, financial statements by (ticker, id). The names of
+    the frames and the labels of the columns (kept in the table and column
+    comments in MySQL) are stored in the meta table (table_name, column_name,
+    label), where the empty column_name holds the name of the frame.
+
+    The database runs in the WAL mode and all the writes between two calls of
+    flush are committed in a single transaction (download_many flushes the
+    storage backend once per batch). The writes of every ticker run in a
+    savepoint, so a failed ticker leaves no rows behind. The storage backend
+    can be shared by many threads.
+    """
+
+    def __init__(self, path, table_prefix = u'morningstar_'):
+        u"""Constructs the SQLiteStorage instance.
+
+        :param path: Path of the SQLite database (created if it does not
+        exist).
+        :param table_prefix: Prefix of the tables.
+        """
+        self._table_prefix = table_prefix
+        self._lock = threading.Lock()
+        # Transactions are started and committed explicitly.
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute(u'PRAGMA journal_mode=WAL')
+        # Durable at the checkpoints, which is enough with the WAL.
+        self._conn.execute(u'PRAGMA synchronous=NORMAL')
+        self._meta_table = table_prefix + u'meta'
+        self._conn.execute(
+            u'CREATE TABLE IF NOT EXISTS "%s" (\n' % self._meta_table +
+            u'  table_name TEXT NOT NULL,\n' +
+            u'  column_name TEXT NOT NULL,\n' +
+            u'  label TEXT NOT NULL,\n' +
+            u'  PRIMARY KEY (table_name, column_name))')
+        # Table name -> set of its columns.
+        self._columns = {}
+        self._in_transaction = False
+
+    @property
+    def connection(self):
+        u"""The sqlite3.Connection of the database (e.g. for queries).
+
+        The connection is shared with the writers, so while other threads
+        may write to the storage it must only be used with the lock held.
+        """
+        return self._conn
+
+    @property
+    def lock(self):
+        u"""The lock guarding the connection (not reentrant, so flush must
+        not be called with the lock held).
+        """
+        return self._lock
+
+    def write_key_ratios(self, ticker, frames):
+        u"""Writes the key ratios of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param frames: List of pandas.DataFrames returned by
+        KeyRatiosDownloader.download.
+        """
+        with self._ticker_savepoint():
+            for frame in frames:
+                table_name = self._table_prefix + (
+                    KeyRatiosDownloader._get_db_name(frame.index.name))
+                columns, rows = KeyRatiosDownloader._get_db_replace_values(
+                    ticker, frame)
+                labels = list(zip(columns[2:], frame.index.values))
+                self._ensure_table(
+                    table_name, [u'ticker TEXT NOT NULL',
+                                 u'period DATE NOT NULL'],
+                    u'ticker, period', frame.index.name, labels,
+                    [u'period'])
+                self._replace(table_name, columns, rows)
+
+    def write_financials(self, ticker, financials):
+        u"""Writes the financials of the given Morningstar ticker.
+
+        :param ticker: Morningstar ticker.
+        :param financials: Dictionary returned by FinancialsDownloader.download.
+        """
+        with self._ticker_savepoint():
+            for name in _STATEMENTS:
+                table_name = self._table_prefix + name
+                frame = financials[name]
+                columns, rows = FinancialsDownloader._get_db_replace_values(
+                    ticker, frame, table_name)
+                labels = [(column, u'Year %d' % period.year) for column, period
+                          in zip(columns[4:], frame.columns[2:])]
+                self._ensure_table(
+                    table_name, [u'ticker TEXT NOT NULL',
+                                 u'id INTEGER NOT NULL',
+                                 u'parent_id INTEGER NOT NULL',
+                                 u'item TEXT NOT NULL'],
+                    u'ticker, id', name, labels)
+                self._replace(table_name, columns, rows)
+            table_name = self._table_prefix + u'unit'
+            self._ensure_table(
+                table_name, [u'ticker TEXT NOT NULL',
+                             u'fiscal_year_end INTEGER NOT NULL',
+                             u'currency TEXT NOT NULL'],
+                u'ticker', u'unit', [])
+            self._replace(table_name,
+                          [u'ticker', u'fiscal_year_end', u'currency'],
+                          [[ticker, int(financials[u'fiscal_year_end']),
+                            financials[u'currency']]])
+
+    def flush(self):
+        u"""Commits all the writes since the last flush in a single
+        transaction.
+        """
+        with self._lock:
+            if self._in_transaction:
+                self._in_transaction = False
+                self._conn.execute(u'COMMIT')
+
+    def close(self):
+        u"""Commits the pending writes and closes the database.
+        """
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextlib.contextmanager
+    def _ticker_savepoint(self):
+        u"""Context manager running the writes of a ticker in a savepoint of
+        the current transaction (started if none is running). The writes are
+        rolled back if the context exits with an exception.
+        """
+        with self._lock:
+            if not self._in_transaction:
+                self._conn.execute(u'BEGIN')
+                self._in_transaction = True
+            self._conn.execute(u'SAVEPOINT ticker')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute(u'ROLLBACK TO ticker')
+                self._conn.execute(u'RELEASE ticker')
+                # The rolled back tables and columns are read again.
+                self._columns = {}
+                raise
+            self._conn.execute(u'RELEASE ticker')
+
+    def _ensure_table(self, table_name, key_columns, primary_key, frame_name,
+                      labels, indexes = ()):
+        u"""Creates the given table (or adds its missing value columns) and
+        records its frame name and the labels of its columns in the meta
+        table.
+
+        :param table_name: Name of the table.
+        :param key_columns: Definitions of the key columns.
+        :param primary_key: Primary key of the table.
+        :param frame_name: Name of the frame stored in the table.
+        :param labels: List of pairs (name of a value column, label).
+        :param indexes: Columns indexed separately.
+        """
+        existing = self._columns.get(table_name)
+        if existing is None:
+            existing = set(row[1] for row in self._conn.execute(
+                u'PRAGMA table_info("%s")' % table_name))
+            if not existing:
+                self._conn.execute(
+                    u'CREATE TABLE "%s" (\n' % table_name +
+                    u''.join([u'  %s,\n' % column
+                              for column in key_columns]) +
+                    u'  PRIMARY KEY (%s))' % primary_key)
+                for column in indexes:
+                    self._conn.execute(
+                        u'CREATE INDEX "ix_%s_%s" ON "%s" ("%s")' % (
+                            table_name, column, table_name, column))
+                existing = set(column.split()[0] for column in key_columns)
+                self._conn.execute(
+                    u'INSERT OR REPLACE INTO "%s" VALUES (?, ?, ?)' %
+                    self._meta_table, (table_name, u'', frame_name))
+            self._columns[table_name] = existing
+        missing = [(column, label) for column, label in labels
+                   if column not in existing]
+        for column, _ in missing:
+            self._conn.execute(u'ALTER TABLE "%s" ADD COLUMN "%s" REAL' % (
+                table_name, column))
+            existing.add(column)
+        if missing:
+            self._conn.executemany(
+                u'INSERT OR REPLACE INTO "%s" VALUES (?, ?, ?)' %
+                self._meta_table,
+                [(table_name, column, label) for column, label in missing])
+
+    def _replace(self, table_name, columns, rows):
+        u"""Inserts (or replaces) the given rows.
+
+        :param table_name: Name of the table.
+        :param columns: List of the column names.
+        :param rows: List of rows (None represents NULL).
+        """
+        self._conn.executemany(
+            u'INSERT OR REPLACE INTO "%s" (%s) VALUES (%s)' % (
+                table_name, u', '.join([u'"%s"' % column
+                                        for column in columns]),
+                u', '.join([u'?'] * len(columns))), rows)
+
+
+def _period_dates(periods):
+    u"""Helper method converting pandas.Periods into a pyarrow date array.
+
+    :param periods: pandas.PeriodIndex (or list of pandas.Periods).
+    :return pyarrow.Array of dates (the end of every period).
+    """
+    pa, _, _ = _import_pyarrow()
+    dates = pd.PeriodIndex(periods).to_timestamp(how=u'end').normalize()
+    return pa.array(dates.date, type=pa.date32())
+
+
+def _and(condition, other):
+    u"""Helper method combining two (optional) dataset filters.
+    """
+    return other if condition is None else condition & other
+
+
+def _import_pyarrow():
+    u"""Helper method importing pyarrow on first use.
+
+    :return Tuple of modules (pyarrow, pyarrow.dataset, pyarrow.parquet).
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(u'ParquetStorage requires pyarrow '
+                          u'(pip install pyarrow).')
+    return pyarrow, pyarrow.dataset, pyarrow.parquet
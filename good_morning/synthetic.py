@@ -0,0 +1,248 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Synthetic responses mimicking financials.morningstar.com.
+
+The generated responses have exactly the structure of the real responses
+(the key ratios csv of exportKR2CSV.html and the financial statements json of
+ReportProcess4HtmlAjax.html) and are deterministic for a given seed. They are
+used by the benchmarks, the tests and the fake server.
+"""
+
+import json
+import random
+
+# Tables of the key ratios csv: (table name, name of the first column, labels).
+# A table without labels is followed by sub-tables without a header row.
+_KEY_RATIOS_TABLES = [
+    (u'Financials', u'', [
+        u'Revenue {cur} Mil', u'Gross Margin %', u'Operating Income {cur} Mil',
+        u'Operating Margin %', u'Net Income {cur} Mil',
+        u'Earnings Per Share {cur}', u'Dividends {cur}', u'Payout Ratio %',
+        u'Shares Mil', u'Book Value Per Share * {cur}',
+        u'Operating Cash Flow {cur} Mil', u'Cap Spending {cur} Mil',
+        u'Free Cash Flow {cur} Mil', u'Free Cash Flow Per Share * {cur}',
+        u'Working Capital {cur} Mil']),
+    (u'Key Ratios -> Profitability', u'Margins % of Sales', [
+        u'Revenue', u'COGS', u'Gross Margin', u'SG&A', u'R&D', u'Other',
+        u'Operating Margin', u'Net Int Inc & Other', u'EBT Margin']),
+    (None, u'Profitability', [
+        u'Tax Rate %', u'Net Margin %', u'Asset Turnover (Average)',
+        u'Return on Assets %', u'Financial Leverage (Average)',
+        u'Return on Equity %', u'Return on Invested Capital %',
+        u'Interest Coverage']),
+    (u'Key Ratios -> Growth', u'', []),
+    (u'Revenue %', None, [
+        u'Year over Year', u'3-Year Average', u'5-Year Average',
+        u'10-Year Average']),
+    (u'Operating Income %', None, [
+        u'Year over Year', u'3-Year Average', u'5-Year Average',
+        u'10-Year Average']),
+    (u'Net Income %', None, [
+        u'Year over Year', u'3-Year Average', u'5-Year Average',
+        u'10-Year Average']),
+    (u'EPS %', None, [
+        u'Year over Year', u'3-Year Average', u'5-Year Average',
+        u'10-Year Average']),
+    (u'Key Ratios -> Cash Flow', u'Cash Flow Ratios', [
+        u'Operating Cash Flow Growth % YOY', u'Free Cash Flow Growth % YOY',
+        u'Cap Ex as a % of Sales', u'Free Cash Flow/Sales %',
+        u'Free Cash Flow/Net Income']),
+    (u'Key Ratios -> Financial Health', u'Balance Sheet Items (in %)', [
+        u'Cash & Short-Term Investments', u'Accounts Receivable',
+        u'Inventory', u'Other Current Assets', u'Total Current Assets',
+        u'Net PP&E', u'Intangibles', u'Other Long-Term Assets',
+        u'Total Assets', u'Accounts Payable', u'Short-Term Debt',
+        u'Taxes Payable', u'Accrued Liabilities',
+        u'Other Short-Term Liabilities', u'Total Current Liabilities',
+        u'Long-Term Debt', u'Other Long-Term Liabilities',
+        u'Total Liabilities', u"Total Stockholders' Equity",
+        u'Total Liabilities & Equity']),
+    (None, u'Liquidity/Financial Health', [
+        u'Current Ratio', u'Quick Ratio', u'Financial Leverage',
+        u'Debt/Equity']),
+    (u'Key Ratios -> Efficiency Ratios', u'Efficiency', [
+        u'Days Sales Outstanding', u'Days Inventory', u'Payables Period',
+        u'Cash Conversion Cycle', u'Receivables Turnover',
+        u'Inventory Turnover', u'Fixed Assets Turnover', u'Asset Turnover']),
+]
+
+
+def key_ratios_csv(ticker = u'SYN', num_periods = 10, first_year = 2005,
+                   fiscal_year_end = 9, currency = u'USD', seed = 0):
+    u"""Returns a synthetic key ratios response (exportKR2CSV.html).
+
+    :param ticker: Ticker mentioned in the title of the response.
+    :param num_periods: Number of yearly periods (followed by TTM).
+    :param first_year: Year of the first period.
+    :param fiscal_year_end: Fiscal year end month.
+    :param currency: Currency of the values.
+    :param seed: Seed of the random values.
+    :return Body of the response (bytes).
+    """
+    rnd = random.Random(u'%s|%s' % (ticker, seed))
+    periods = u','.join(
+        [u'%d-%02d' % (first_year + i, fiscal_year_end)
+         for i in range(num_periods)] + [u'TTM'])
+    lines = [u'Growth Profitability and Financial Ratios for %s' % ticker]
+    for table_name, header, labels in _KEY_RATIOS_TABLES:
+        if table_name is not None:
+            lines.append(table_name)
+        if header is not None:
+            lines.append(u'%s,%s' % (_csv_cell(header), periods))
+        for label in labels:
+            values = [_csv_number(rnd, large=u'Mil' in label)
+                      for _ in range(num_periods + 1)]
+            lines.append(u','.join(
+                [_csv_cell(label.format(cur=currency))] + values))
+        if table_name is None or labels:
+            lines.append(u'')
+    return (u'\n'.join(lines) + u'\n').encode(u'utf-8')
+
+
+def financials_json(num_items = 50, num_periods = 5, first_year = 2011,
+                    fiscal_year_end = 9, currency = u'USD', group_size = 5,
+                    seed = 0):
+    u"""Returns a synthetic financial statement response
+    (ReportProcess4HtmlAjax.html).
+
+    Every group_size-th line item is a group containing the following
+    group_size - 1 line items. Some line items are hidden and some values are
+    missing, as in the real responses.
+
+    :param num_items: Number of line items.
+    :param num_periods: Number of yearly periods (followed by TTM).
+    :param first_year: Year of the first period.
+    :param fiscal_year_end: Fiscal year end month.
+    :param currency: Currency of the values.
+    :param group_size: Size of the groups of line items (0 for no groups).
+    :param seed: Seed of the random values.
+    :return Body of the response (bytes).
+    """
+    rnd = random.Random(seed)
+    labels = []
+    data = []
+    item = 0
+    group = 0
+    while item < num_items:
+        if group_size and item % group_size == 0 and item + 1 < num_items:
+            group += 1
+            children = min(group_size - 1, num_items - item - 1)
+            labels.append(
+                u'<div id="label_g%d" class="rf_crow"><div class="lbl" '
+                u'title="Group %d">Group %d</div></div>'
+                u'<div class="r_content" id="g_%d">' % (
+                    group, group, group, group))
+            data.append(u'<div class="r_content" id="g_%d_d">' % group)
+            for _ in range(children):
+                item += 1
+                _financials_item(rnd, item, num_periods, labels, data)
+            labels.append(u'<div id="label_g%d_padding" class="rf_crow">'
+                          u'</div></div>' % group)
+            data.append(u'</div>')
+            item += 1
+        else:
+            item += 1
+            _financials_item(rnd, item, num_periods, labels, data)
+    years = u''.join(
+        [u'<div id="Y_%d" class="year">%d-%02d</div>' % (
+            i + 1, first_year + i, fiscal_year_end)
+         for i in range(num_periods)] +
+        [u'<div id="Y_%d" class="year">TTM</div>' % (num_periods + 1)])
+    html = (
+        u'<div class="r_bodywrap"><div class="left">'
+        u'<div class="r_xcmenu rf_table_left">' + u''.join(labels) +
+        u'<div id="unitsAndFiscalYear" style="display:none;" '
+        u'fyenumber="%d" currency="%s" rounding="3"></div>' % (
+            fiscal_year_end, currency) +
+        u'</div></div><div class="main"><div class="rf_table">'
+        u'<div id="Year" class="rf_crow">' + years + u'</div>' +
+        u''.join(data) + u'</div></div></div>')
+    return json.dumps({u'componentData': None, u'result': html}).encode(
+        u'utf-8')
+
+
+class SyntheticTransport(object):
+    u"""Transport answering every request with a synthetic response.
+
+    Can be passed as the transport to both KeyRatiosDownloader and
+    FinancialsDownloader.
+    """
+
+    def __init__(self, num_items = 50, num_periods = 5, seed = 0):
+        u"""Constructs the SyntheticTransport instance.
+
+        :param num_items: Number of line items of the financial statements.
+        :param num_periods: Number of yearly periods of the financial
+        statements.
+        :param seed: Seed of the random values.
+        """
+        self._num_items = num_items
+        self._num_periods = num_periods
+        self._seed = seed
+
+    def get(self, url):
+        u"""Returns the synthetic response to the given URL.
+
+        :param url: URL of financials.morningstar.com.
+        :return Body of the response (bytes).
+        """
+        if u'exportKR2CSV' in url:
+            return key_ratios_csv(seed=self._seed)
+        return financials_json(self._num_items, self._num_periods,
+                               seed=self._seed)
+
+
+def _financials_item(rnd, item, num_periods, labels, data):
+    u"""Helper method appending a single line item of a financial statement.
+    """
+    hidden = rnd.random() < 0.05
+    style = u' style="display:none;"' if hidden else u''
+    labels.append(
+        u'<div id="label_i%d" class="rf_crow"%s><div class="lbl" '
+        u'title="Item %d">Item %d</div></div>' % (item, style, item, item))
+    if rnd.random() < 0.05:
+        # Line item without data.
+        return
+    cells = []
+    for i in range(num_periods + 1):
+        value = (u'—' if rnd.random() < 0.1 else
+                 u'%d' % rnd.randint(-10 ** 9, 10 ** 11))
+        cells.append(u'<div id="Y_%d" class="pos" rawvalue="%s">%s</div>' % (
+            i + 1, value, value))
+    data.append(u'<div id="data_i%d" class="rf_crow"%s>%s</div>' % (
+        item, style, u''.join(cells)))
+
+
+def _csv_number(rnd, large = False):
+    u"""Helper method returning a random csv cell of the key ratios.
+    """
+    if rnd.random() < 0.1:
+        return u''
+    if large:
+        return _csv_cell(u'{:,}'.format(rnd.randint(-10 ** 4, 10 ** 6)))
+    return u'%.2f' % rnd.uniform(-50.0, 200.0)
+
+
+def _csv_cell(value):
+    u"""Helper method quoting a csv cell if needed.
+    """
+    if u',' in value or u'"' in value:
+        return u'"%s"' % value.replace(u'"', u'""')
+    return value
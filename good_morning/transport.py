@@ -0,0 +1,236 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""HTTP transport used to download data from financials.morningstar.com.
+"""
+
+import gzip
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.parse
+import zlib
+
+from good_morning.metrics import NULL_METRICS
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+
+
+class HTTPSession(object):
+    u"""Pooled keep-alive HTTP session.
+
+    Connections are kept open and reused by subsequent requests to the same
+    host. Responses are requested compressed (gzip or deflate) and failed
+    requests (network errors, timeouts, HTTP 429 and 5xx) are retried with an
+    exponential backoff. The session can be shared by many threads and by
+    both KeyRatiosDownloader and FinancialsDownloader.
+
+    If the scheduler (e.g. good_morning.AdaptiveRateLimiter) is specified then
+    every request waits for the scheduler and reports its outcome back to it.
+    """
+
+    def __init__(self, timeout = 30.0, retries = 3, backoff = 0.5,
+                 max_connections = 10, scheduler = None, metrics = None):
+        u"""Constructs the HTTPSession instance.
+
+        :param timeout: Timeout of the socket operations (in seconds).
+        :param retries: Maximum number of retries of a failed request.
+        :param backoff: Delay before the first retry (in seconds); the delay
+        doubles with every further retry.
+        :param max_connections: Maximum number of idle connections kept open
+        per host.
+        :param scheduler: Scheduler of the requests, i.e. an object with the
+        methods acquire() and release(success, latency).
+        :param metrics: Metrics registry counting the requests (by status),
+        the retries and the transferred (compressed) bytes.
+        """
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_connections = max_connections
+        self._scheduler = scheduler
+        self._metrics = metrics if metrics is not None else NULL_METRICS
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> list of idle connections.
+        self._pool = {}
+
+    def get(self, url):
+        u"""Downloads and returns the (decompressed) body of the given URL.
+
+        :param url: URL to be downloaded.
+        :return Body of the response (bytes).
+        """
+        error = None
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                self._metrics.increment(u'good_morning_http_retries_total')
+                time.sleep(self._backoff * 2 ** (attempt - 1))
+            acquired = False
+            success = False
+            try:
+                if self._scheduler is not None:
+                    self._scheduler.acquire()
+                    acquired = True
+                start = time.monotonic()
+                try:
+                    status, reason, headers, body, final_url = self._get(url)
+                except (OSError, http.client.HTTPException) as e:
+                    self._metrics.increment(
+                        u'good_morning_http_requests_total', status=u'error')
+                    error = e
+                    continue
+                self._metrics.increment(u'good_morning_http_requests_total',
+                                        status=status)
+                self._metrics.increment(u'good_morning_http_bytes_total',
+                                        len(body))
+                if status == 429 or status >= 500:
+                    error = urllib.error.HTTPError(
+                        final_url, status, reason, headers, None)
+                    continue
+                if status < 400:
+                    body = _decode(body, headers.get(u'Content-Encoding'))
+                # The server refuses some requests with an empty body.
+                success = status >= 400 or len(body) > 0
+            finally:
+                if acquired:
+                    self._scheduler.release(success,
+                                            time.monotonic() - start)
+            if status >= 400:
+                raise urllib.error.HTTPError(
+                    final_url, status, reason, headers, None)
+            return body
+        raise error
+
+    def close(self):
+        u"""Closes all the idle connections.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for connections in pool.values():
+            for conn in connections:
+                conn.close()
+
+    def _get(self, url):
+        u"""Sends a single GET request, following redirects.
+
+        :param url: URL to be downloaded.
+        :return Tuple (status, reason, headers, body, final_url).
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            status, reason, headers, body = self._request(url)
+            location = headers.get(u'Location')
+            if status not in _REDIRECT_CODES or not location:
+                break
+            url = urllib.parse.urljoin(url, location)
+        return status, reason, headers, body, url
+
+    def _request(self, url):
+        u"""Sends a single GET request over a pooled connection.
+
+        A request failing on a reused connection (which might have been
+        closed by the server in the meantime) is repeated once over a new
+        connection.
+
+        :param url: URL to be downloaded.
+        :return Tuple (status, reason, headers, body).
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == u'https' else 80))
+        path = parts.path or u'/'
+        if parts.query:
+            path += u'?' + parts.query
+        request_headers = {u'Accept-Encoding': u'gzip, deflate',
+                           u'Connection': u'keep-alive'}
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request(u'GET', path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, response.reason, response.headers, body
+
+    def _acquire(self, key):
+        u"""Returns a pair (connection, reused) for the given host.
+        """
+        with self._lock:
+            connections = self._pool.get(key)
+            if connections:
+                return connections.pop(), True
+        scheme, host, port = key
+        if scheme == u'https':
+            return http.client.HTTPSConnection(
+                host, port, timeout=self._timeout), False
+        return http.client.HTTPConnection(
+            host, port, timeout=self._timeout), False
+
+    def _release(self, key, conn):
+        u"""Returns the given connection back to the pool.
+        """
+        with self._lock:
+            connections = self._pool.setdefault(key, [])
+            if len(connections) < self._max_connections:
+                connections.append(conn)
+                return
+        conn.close()
+
+
+def _decode(body, content_encoding):
+    u"""Helper method for decompressing the body of a response.
+
+    :param body: Body of the response.
+    :param content_encoding: Value of the Content-Encoding header.
+    :return Decompressed body.
+    """
+    encoding = (content_encoding or u'').strip().lower()
+    if encoding == u'gzip':
+        return gzip.decompress(body)
+    if encoding == u'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header.
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def default_session():
+    u"""Returns the HTTPSession shared by all downloaders by default.
+    """
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = HTTPSession()
+        return _default_session
+
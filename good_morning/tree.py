@@ -0,0 +1,285 @@
+# Copyright (c) 2015 Peter Cerno
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""Hierarchy of the line items of the financial statements.
+
+The line items of a statement form a forest: every row of the frames returned
+by FinancialsDownloader.download refers to its parent by the parent_index (a
+top-level row refers to itself). A StatementTree stores the forest in flat
+NumPy arrays (the parents, the depths and the children in the compressed
+sparse row layout), so that roll-ups over whole statements are a handful of
+vectorized operations per level of the tree instead of Python recursion.
+"""
+
+import functools
+
+import numpy as np
+
+# Names of the financial statements (see good_morning._REPORTS).
+_STATEMENTS = [u'income_statement', u'balance_sheet', u'cash_flow']
+
+
+class StatementTree(object):
+    u"""Tree index of the line items of a financial statement.
+
+    The statements of different tickers mostly share the same structure, so
+    the trees are cached by structure (see from_frame) and the same instance
+    (including its lookup table of the paths) is shared by all the tickers
+    with the same statement.
+    """
+
+    def __init__(self, parents, titles):
+        u"""Constructs the StatementTree instance.
+
+        :param parents: Positions of the parents of the rows (-1 for the
+        top-level rows).
+        :param titles: Titles of the rows.
+        """
+        parents = np.array(parents, dtype=np.int64)
+        size = len(parents)
+        if len(titles) != size:
+            raise ValueError(u'Expected %d titles, got %d' % (
+                size, len(titles)))
+        if ((parents < -1) | (parents >= size) |
+                (parents == np.arange(size))).any():
+            raise ValueError(u'Invalid parents: %r' % parents.tolist())
+        self._parents = parents
+        self._titles = tuple(titles)
+        # Depths by following all the parents one level at a time.
+        depths = np.zeros(size, dtype=np.int64)
+        ancestors = parents.copy()
+        while (ancestors >= 0).any():
+            if depths.max(initial=0) > size:
+                raise ValueError(u'The parents contain a cycle')
+            has_ancestor = ancestors >= 0
+            depths[has_ancestor] += 1
+            ancestors[has_ancestor] = parents[ancestors[has_ancestor]]
+        self._depths = depths
+        # Children in the CSR layout: the children of the row i are
+        # children[offsets[i]:offsets[i + 1]] (in the order of the rows).
+        children = np.flatnonzero(parents >= 0)
+        children = children[np.argsort(parents[children], kind=u'stable')]
+        self._children = children
+        self._offsets = np.concatenate(([0], np.cumsum(
+            np.bincount(parents[children], minlength=size)))).astype(np.int64)
+        # Rows of every level (below the top-level) for the roll-ups, from
+        # the deepest level.
+        self._levels = [np.flatnonzero(depths == depth)
+                        for depth in range(int(depths.max(initial=0)), 0, -1)]
+        self._paths = None
+        for array in (self._parents, self._depths, self._children,
+                      self._offsets):
+            array.flags.writeable = False
+
+    @staticmethod
+    def from_frame(frame):
+        u"""Returns the (cached) tree of the given statement.
+
+        :param frame: pandas.DataFrame with a statement as returned by
+        FinancialsDownloader.download. Rows whose parent is not in the frame
+        (e.g. when only some items were loaded) become top-level rows.
+        :return StatementTree of the statement.
+        """
+        positions = frame.index.get_indexer(frame[u'parent_index'].to_numpy())
+        positions[positions == np.arange(len(positions))] = -1
+        return StatementTree._cached(tuple(positions.tolist()),
+                                     tuple(frame[u'title'].tolist()))
+
+    @staticmethod
+    def from_result(result):
+        u"""Returns the trees of the statements of the given financials.
+
+        :param result: Dictionary as returned by FinancialsDownloader.download.
+        :return Dictionary mapping the names of the statements to their
+        StatementTrees.
+        """
+        return dict((name, StatementTree.from_frame(result[name]))
+                    for name in _STATEMENTS if name in result)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _cached(parents, titles):
+        u"""Returns the StatementTree with the given structure (cached).
+        """
+        return StatementTree(parents, titles)
+
+    def __len__(self):
+        return len(self._parents)
+
+    def __repr__(self):
+        return u'StatementTree(%d rows, %d roots)' % (
+            len(self), len(self.roots))
+
+    @property
+    def parents(self):
+        u"""Positions of the parents of the rows (-1 for the top-level rows).
+        """
+        return self._parents
+
+    @property
+    def depths(self):
+        u"""Depths of the rows (0 for the top-level rows).
+        """
+        return self._depths
+
+    @property
+    def titles(self):
+        u"""Titles of the rows.
+        """
+        return self._titles
+
+    @property
+    def offsets(self):
+        u"""Offsets of the children of the rows in children (CSR layout).
+        """
+        return self._offsets
+
+    @property
+    def children(self):
+        u"""Positions of the children of all the rows (CSR layout).
+        """
+        return self._children
+
+    @property
+    def roots(self):
+        u"""Positions of the top-level rows.
+        """
+        return np.flatnonzero(self._parents < 0)
+
+    @property
+    def leaves(self):
+        u"""Mask of the rows without children.
+        """
+        return np.diff(self._offsets) == 0
+
+    def children_of(self, row):
+        u"""Returns the positions of the children of the given row.
+
+        :param row: Position of the row.
+        :return Array of the positions of its children.
+        """
+        return self._children[self._offsets[row]:self._offsets[row + 1]]
+
+    def path(self, row):
+        u"""Returns the path of the given row.
+
+        :param row: Position of the row.
+        :return Tuple of the titles from the top-level row down to the row.
+        """
+        path = []
+        while row >= 0:
+            path.append(self._titles[row])
+            row = self._parents[row]
+        return tuple(reversed(path))
+
+    def find(self, path):
+        u"""Returns the position of the row with the given path.
+
+        :param path: Tuple (or list) of the titles from the top-level row
+        down to the row; a single title finds a top-level row.
+        :return Position of the row (-1 if there is no such row). If more rows
+        share the path, the first one is returned.
+        """
+        if self._paths is None:
+            paths = {}
+            # Parents come before their children in the order of the depths.
+            row_paths = [None] * len(self)
+            for row in np.argsort(self._depths, kind=u'stable').tolist():
+                parent = self._parents[row]
+                row_paths[row] = (() if parent < 0 else row_paths[parent]) + (
+                    self._titles[row],)
+                paths.setdefault(row_paths[row], row)
+            self._paths = paths
+        if isinstance(path, str):
+            path = (path,)
+        return self._paths.get(tuple(path), -1)
+
+    def children_sums(self, values):
+        u"""Returns the sums of the values of the children of every row.
+
+        :param values: Array of shape (rows, ...), e.g. the values of the
+        periods of a statement. Missing values (NaN) are skipped.
+        :return Array of the same shape with the sums (NaN for the rows
+        without children or without any values of their children).
+        """
+        values = self._check(values)
+        return self._rollup(values, self._children, self._parents[
+            self._children])
+
+    def subtree_sums(self, values, leaves_only = False):
+        u"""Returns the sums of the values of the subtrees of every row.
+
+        :param values: Array of shape (rows, ...), e.g. the values of the
+        periods of a statement. Missing values (NaN) are skipped.
+        :param leaves_only: Whether only the values of the leaves are summed
+        (the rows with children often hold totals of their children).
+        :return Array of the same shape with the sums (NaN for the subtrees
+        without any values).
+        """
+        values = self._check(values)
+        if leaves_only:
+            values = values.copy()
+            values[~self.leaves] = np.nan
+        sums = np.where(np.isnan(values), 0.0, values)
+        counts = (~np.isnan(values)).astype(np.int64)
+        # Every level adds its (complete) subtrees to the level above.
+        for rows in self._levels:
+            np.add.at(sums, self._parents[rows], sums[rows])
+            np.add.at(counts, self._parents[rows], counts[rows])
+        sums[counts == 0] = np.nan
+        return sums
+
+    def check(self, values, rtol = 1e-3, atol = 0.5):
+        u"""Checks whether the values of the rows are the sums of the values
+        of their children.
+
+        :param values: Array of shape (rows, ...), e.g. the values of the
+        periods of a statement.
+        :param rtol: Tolerated difference relative to the value of the row.
+        :param atol: Tolerated absolute difference.
+        :return Mask of the same shape, True where a row and (some of) its
+        children have values and the value of the row differs from the sum of
+        its children.
+        """
+        values = self._check(values)
+        sums = self.children_sums(values)
+        with np.errstate(invalid=u'ignore'):
+            return (~np.isnan(values) & ~np.isnan(sums) &
+                    (np.abs(values - sums) > atol + rtol * np.abs(values)))
+
+    def _check(self, values):
+        u"""Returns the given values as a float array with a row per line
+        item.
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) != len(self):
+            raise ValueError(u'Expected %d rows, got %d' % (
+                len(self), len(values)))
+        return values
+
+    def _rollup(self, values, rows, parents):
+        u"""Returns the sums of the values of the given rows per parent.
+        """
+        sums = np.zeros(values.shape)
+        counts = np.zeros(values.shape, dtype=np.int64)
+        np.add.at(sums, parents, np.where(np.isnan(values[rows]), 0.0,
+                                          values[rows]))
+        np.add.at(counts, parents, ~np.isnan(values[rows]))
+        sums[counts == 0] = np.nan
+        return sums
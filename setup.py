@@ -43,12 +43,16 @@ setup(
     # download_url=extract_metaitem('download_url'),
     platforms=['Any'],
     packages=['good_morning'],
+    python_requires='>=3.9',
     install_requires=['numpy', 'pandas', 'pymysql',
                       'python-dateutil','beautifulsoup4',
                       'mock;python_version<"3.3"',
                       "futures; python_version < '3.0'",
                       "futures>=3.0.5; python_version == '2.6' or python_version=='2.7'"
                       ],
+    extras_require={'parquet': ['pyarrow']},
+    entry_points={
+        'console_scripts': ['good-morning = good_morning.runner:main']},
     keywords='stocks good_morning financial data historical',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
@@ -58,6 +62,10 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
         'Office/Business :: Financial',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5'
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12'
     ],
 )
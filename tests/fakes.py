@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import re
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+class FixtureTransport(object):
+    def __init__(self, body=None):
+        # By default the key ratios and the income statement of AAPL.
+        self.body = body
+
+    def get(self, url):
+        if self.body is not None:
+            return self.body
+        return read_fixture('key_ratios_aapl.csv' if 'exportKR2CSV' in url
+                            else 'financials_aapl_is.json')
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self._result = []
+
+    def execute(self, query, args=None):
+        self.conn.statements.append((query, args))
+        self._result = []
+        if 'information_schema' in query:
+            self.conn.schema_queries += 1
+            self._result = [
+                (table, column)
+                for table, columns in self.conn.tables.items()
+                for column in columns if not args or table == args[0]]
+        elif query.startswith('CREATE TABLE'):
+            match = re.match(r'CREATE TABLE (IF NOT EXISTS )?`(\w+)`', query)
+            table = match.group(2)
+            if table in self.conn.tables:
+                if match.group(1):
+                    return
+                raise Exception(1050, "Table '%s' already exists" % table)
+            self.conn.tables[table] = re.findall(
+                r'^  `(\w+)`', query, re.M)
+        elif query.startswith('ALTER TABLE'):
+            table = re.match(r'ALTER TABLE `(\w+)`', query).group(1)
+            self.conn.tables[table] += re.findall(
+                r'ADD COLUMN `(\w+)`', query)
+
+        elif query.startswith('LOAD DATA'):
+            if self.conn.local_infile_error:
+                raise Exception(1148, 'The used command is not allowed')
+            with open(args[0], encoding='utf-8') as f:
+                self.conn.loaded.append((query, f.read()))
+
+    def executemany(self, query, rows):
+        self.conn.statements.append((query, list(rows)))
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+        self.schema_queries = 0
+        self.tables = {}
+        self.loaded = []
+        self.local_infile_error = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def executemany_calls(self):
+        return [(query, rows) for query, rows in self.statements
+                if query.startswith('REPLACE')]
+
+    def alter_statements(self):
+        return [query for query, _ in self.statements
+                if query.startswith('ALTER')]
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import time
+from unittest import TestCase, mock
+
+from good_morning import batch
+from good_morning.ratelimit import RateLimiter
+
+
+class FakeKeyRatiosDownloader(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _download(self, ticker, region=None, culture=None, currency=None,
+                  pool=None):
+        if ticker == 'BAD':
+            raise ValueError('bad ticker')
+        return [ticker]
+
+
+class FakeFinancialsDownloader(FakeKeyRatiosDownloader):
+    def _download(self, ticker, region=None, culture=None, currency=None,
+                  pool=None):
+        return {'ticker': ticker}
+
+
+class FakeStorage(object):
+    def __init__(self):
+        self.key_ratios = []
+        self.financials = []
+        self.flushes = 0
+
+    def write_key_ratios(self, ticker, frames):
+        self.key_ratios.append(ticker)
+
+    def write_financials(self, ticker, financials):
+        self.financials.append(ticker)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestDownloadMany(TestCase):
+    def test_download_many(self):
+        with mock.patch.object(batch, 'KeyRatiosDownloader',
+                               FakeKeyRatiosDownloader), \
+                mock.patch.object(batch, 'FinancialsDownloader',
+                                  FakeFinancialsDownloader):
+            tickers = ['T%d' % i for i in range(20)] + ['BAD']
+            results = {r.ticker: r for r in batch.download_many(
+                tickers, max_workers=4, rate=None)}
+        self.assertEqual(set(tickers), set(results))
+        self.assertEqual(['T3'], results['T3'].key_ratios)
+        self.assertEqual({'ticker': 'T3'}, results['T3'].financials)
+        self.assertIsNone(results['T3'].error)
+        self.assertIsInstance(results['BAD'].error, ValueError)
+
+    def test_download_many_storage(self):
+        storage = FakeStorage()
+        with mock.patch.object(batch, 'KeyRatiosDownloader',
+                               FakeKeyRatiosDownloader), \
+                mock.patch.object(batch, 'FinancialsDownloader',
+                                  FakeFinancialsDownloader):
+            tickers = ['T%d' % i for i in range(5)] + ['BAD']
+            results = list(batch.download_many(
+                tickers, max_workers=2, rate=None, batch_size=2,
+                storage=storage))
+        self.assertEqual(len(tickers), len(results))
+        self.assertEqual(set(tickers) - {'BAD'}, set(storage.key_ratios))
+        self.assertEqual(set(tickers) - {'BAD'}, set(storage.financials))
+        self.assertEqual(3, storage.flushes)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=50.0)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
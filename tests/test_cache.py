@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+from unittest import TestCase
+
+from good_morning.cache import ResponseCache
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = ResponseCache(self.directory)
+        key = cache.key('AAPL', 'kr', 'usa', 'en-US', 'USD')
+        self.assertIsNone(cache.get(key))
+        cache.put(key, b'a,b,c\n' * 100)
+        self.assertEqual(b'a,b,c\n' * 100, cache.get(key))
+        # Entries survive a new cache instance.
+        self.assertEqual(b'a,b,c\n' * 100,
+                         ResponseCache(self.directory).get(key))
+
+    def test_base_url(self):
+        cache = ResponseCache(self.directory)
+        cache.put(cache.key('AAPL', 'kr', 'usa', 'en-US', 'USD',
+                            'http://127.0.0.1:8080'), b'fake')
+        self.assertIsNone(cache.get(cache.key(
+            'AAPL', 'kr', 'usa', 'en-US', 'USD',
+            'http://financials.morningstar.com')))
+
+    def test_corrupt(self):
+        cache = ResponseCache(self.directory)
+        # A truncated header and a valid header followed by garbage.
+        for key, content in [('a', b'abc'),
+                             ('b', struct.pack('>d', 4e9) + b'garbage')]:
+            cache.put(key, b'body')
+            path = os.path.join(self.directory, cache._file_name(key))
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.assertIsNone(cache.get(key))
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(0, cache.size)
+
+    def test_ttl(self):
+        cache = ResponseCache(self.directory)
+        cache.put('a', b'body', ttl=-1)
+        cache.put('b', b'body')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(b'body', cache.get('b'))
+
+    def test_eviction(self):
+        cache = ResponseCache(self.directory, max_size=1)
+        cache.put('a', b'body a')
+        cache.put('b', b'body b')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(b'body b', cache.get('b'))
+
+    def test_lru(self):
+        cache = ResponseCache(self.directory)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, key.encode() * 10)
+            time.sleep(0.01)
+        entry_size = cache.size // 3
+        cache.get('a')
+        cache._max_size = 3 * entry_size
+        cache.put('d', b'd' * 10)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('d'))
+
+    def test_shared_directory(self):
+        # Two instances stand for two processes sharing the directory.
+        first = ResponseCache(self.directory)
+        second = ResponseCache(self.directory, max_size=1, rescan=0)
+        first.put('a', b'body a')
+        self.assertEqual(b'body a', second.get('a'))
+        first.put('b', b'body b')
+        first.clear()
+        self.assertIsNone(second.get('b'))
+        first.put('c', b'body c')
+        # The second instance evicts the entries of the first one as well.
+        second.put('d', b'body d')
+        self.assertIsNone(first.get('c'))
+        self.assertEqual(b'body d', first.get('d'))
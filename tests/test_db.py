@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+from unittest import TestCase
+
+from good_morning import good_morning as gm
+from tests.fakes import FakeConnection, FixtureTransport
+
+
+class TestMySQLUpload(TestCase):
+    def test_key_ratios(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        frames = kr.download('XNAS:AAPL"', conn)
+        calls = conn.executemany_calls()
+        self.assertEqual(11, len(calls))
+        self.assertEqual(1, conn.commits)
+        query, rows = calls[0]
+        self.assertIn('`morningstar_key_financials_usd`', query)
+        self.assertIn('(%s, %s, %s', query)
+        self.assertEqual(11, len(rows))
+        self.assertEqual(['XNAS:AAPL"', '2005-09-30', 45734.0], rows[0][:3])
+        # Dividends are missing in some periods.
+        self.assertIn(None, [row[8] for row in rows])
+        self.assertEqual(len(frames[0].index) + 2, len(rows[0]))
+
+    def test_financials(self):
+        conn = FakeConnection()
+        fd = gm.FinancialsDownloader(transport=FixtureTransport())
+        fd.download('AAPL', conn)
+        calls = conn.executemany_calls()
+        self.assertEqual(4, len(calls))
+        self.assertEqual(1, conn.commits)
+        query, rows = calls[0]
+        self.assertIn('`morningstar_income_statement`', query)
+        self.assertIn('`year_2011`', query)
+        self.assertEqual(['AAPL', 0, 0, 'Revenue', 108249e6], rows[0][:5])
+        self.assertEqual([None] * 6, rows[10][4:])
+        self.assertEqual([['AAPL', 9, 'USD']], calls[3][1])
+
+    def test_batch(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        batch = gm.MySQLBatch(conn)
+        for ticker in ['A', 'B', 'C']:
+            kr._add_frames_to_batch(ticker, kr.download(ticker), batch)
+        self.assertEqual(0, len(conn.executemany_calls()))
+        batch.commit()
+        calls = conn.executemany_calls()
+        self.assertEqual(11, len(calls))
+        self.assertEqual(33, len(calls[0][1]))
+        self.assertEqual(1, conn.commits)
+        self.assertEqual(0, len(batch))
+
+    def test_schema_cache(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        fd = gm.FinancialsDownloader(transport=FixtureTransport())
+        for ticker in ['A', 'B', 'C']:
+            kr.download(ticker, conn)
+            fd.download(ticker, conn)
+        # One query loading the whole schema plus one per created table.
+        self.assertEqual(1 + 11 + 4, conn.schema_queries)
+        self.assertEqual(6, conn.commits)
+        # The financials contain years not covered by CREATE TABLE.
+        self.assertEqual(3, len(conn.alter_statements()))
+        self.assertIn('ADD COLUMN `year_2011` DECIMAL(20,5) DEFAULT NULL',
+                      conn.alter_statements()[0])
+
+    def test_table_created_by_another_process(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        fd = gm.FinancialsDownloader(transport=FixtureTransport())
+        # The schema is cached before the table exists.
+        fd.download('A', conn)
+        conn.tables['morningstar_key_financials_usd'] = ['ticker', 'period']
+        kr.download('A', conn)
+        self.assertIn(
+            'ADD COLUMN `revenue_usd_mil`',
+            [query for query in conn.alter_statements()
+             if 'morningstar_key_financials_usd' in query][0])
+
+    def test_column_drift(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        frames = kr.download('A', conn)
+        conn.statements = []
+        frames[0].rename(index={'Shares Mil': 'Shares Diluted Mil'},
+                         inplace=True)
+        kr._upload_frames_to_db('A', frames, conn)
+        alters = conn.alter_statements()
+        self.assertEqual(1, len(alters))
+        self.assertIn('ADD COLUMN `shares_diluted_mil` DECIMAL(20,5) '
+                      'DEFAULT NULL COMMENT "Shares Diluted Mil"', alters[0])
+
+    def test_bulk(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        batch = gm.MySQLBatch(conn, bulk=True)
+        kr._add_frames_to_batch('A\tB', kr.download('A'), batch)
+        batch.commit()
+        self.assertEqual(0, len(conn.executemany_calls()))
+        self.assertEqual(11, len(conn.loaded))
+        query, content = conn.loaded[0]
+        self.assertIn('REPLACE INTO TABLE `morningstar_key_financials_usd`',
+                      query)
+        lines = content.splitlines()
+        self.assertEqual(11, len(lines))
+        self.assertTrue(lines[0].startswith('A\\tB\t2005-09-30\t45734.0\t'))
+        self.assertIn('\\N', content)
+
+    def test_bulk_fallback(self):
+        conn = FakeConnection()
+        conn.local_infile_error = True
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport())
+        batch = gm.MySQLBatch(conn, bulk=True)
+        kr._add_frames_to_batch('A', kr.download('A'), batch)
+        batch.commit()
+        self.assertEqual(11, len(conn.executemany_calls()))
+        self.assertEqual(1, conn.commits)
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import asyncio
+import os
+import shutil
+import tempfile
+import urllib.error
+from unittest import TestCase
+
+from good_morning import batch
+from good_morning import good_morning as gm
+from good_morning.aio import AsyncHTTPSession
+from good_morning.fake_server import FakeMorningstarServer
+from good_morning.transport import HTTPSession
+from tests.fakes import FakeConnection
+
+
+class TestFakeServer(TestCase):
+    def test_download(self):
+        with FakeMorningstarServer(tickers=['AAPL'], num_items=30) as server:
+            session = HTTPSession()
+            kr = gm.KeyRatiosDownloader(transport=session,
+                                        base_url=server.url)
+            fd = gm.FinancialsDownloader(transport=session,
+                                         base_url=server.url + '/')
+            frames = kr.download('AAPL')
+            self.assertEqual('Key Financials USD', frames[0].index.name)
+            # Synthetic companies are deterministic.
+            self.assertTrue(frames[0].equals(kr.download('AAPL')[0]))
+            result = fd.download('AAPL')
+            self.assertFalse(result['income_statement'].equals(
+                result['balance_sheet']))
+            with self.assertRaises(ValueError):
+                kr.download('MSFT')
+            self.assertEqual(6, server.requests)
+            session.close()
+
+    def test_adownload(self):
+        async def download(kr, fd, tickers):
+            results = await asyncio.gather(*[
+                asyncio.gather(kr.adownload(ticker), fd.adownload(ticker))
+                for ticker in tickers])
+            await kr._async_transport.close()
+            return results
+
+        tickers = ['T%d' % i for i in range(10)]
+        with FakeMorningstarServer(latency=0.02) as server:
+            session = AsyncHTTPSession()
+            kr = gm.KeyRatiosDownloader(
+                base_url=server.url, async_transport=session)
+            fd = gm.FinancialsDownloader(
+                parser='fast', base_url=server.url, async_transport=session)
+            results = asyncio.run(download(kr, fd, tickers))
+            self.assertEqual(10 * 4, server.requests)
+            http = HTTPSession()
+            kr = gm.KeyRatiosDownloader(transport=http, base_url=server.url)
+            fd = gm.FinancialsDownloader(transport=http, parser='fast',
+                                         base_url=server.url)
+            for ticker, (frames, result) in zip(tickers, results):
+                for expected, frame in zip(kr.download(ticker), frames):
+                    self.assertTrue(expected.equals(frame))
+                self.assertTrue(fd.download(ticker)['balance_sheet'].equals(
+                    result['balance_sheet']))
+            http.close()
+
+    def test_fixtures(self):
+        directory = tempfile.mkdtemp()
+        try:
+            fixtures = os.path.join(directory, 'fixtures')
+            os.mkdir(fixtures)
+            for path, body in [(os.path.join(fixtures, 'AAPL.kr.csv'), b'a'),
+                               (os.path.join(directory, 'secret.kr.csv'),
+                                b'secret')]:
+                with open(path, 'wb') as f:
+                    f.write(body)
+            with FakeMorningstarServer(fixtures=fixtures) as server:
+                self.assertEqual((200, b'a'), server.response(
+                    '/ajax/exportKR2CSV.html?t=AAPL'))
+                for ticker in ['../secret', '..%2Fsecret',
+                               os.path.join(directory, 'secret')]:
+                    status, body = server.response(
+                        '/ajax/exportKR2CSV.html?t=' + ticker)
+                    self.assertEqual(200, status)
+                    self.assertNotEqual(b'secret', body)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_errors_and_rate_limit(self):
+        with FakeMorningstarServer(error_rate=0.3, rate_limit=50.0,
+                                   seed=1) as server:
+            session = HTTPSession(retries=20, backoff=0.01)
+            kr = gm.KeyRatiosDownloader(transport=session,
+                                        base_url=server.url)
+            for ticker in ['T%d' % i for i in range(10)]:
+                self.assertEqual(11, len(kr.download(ticker)))
+            self.assertGreater(server.errors, 0)
+            session = HTTPSession(retries=0)
+            server.error_rate = 1.0
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                session.get(server.url + '/ajax/exportKR2CSV.html?t=A')
+            self.assertEqual(503, context.exception.code)
+
+    def test_pipeline(self):
+        with FakeMorningstarServer(latency=0.01) as server:
+            conn = FakeConnection()
+            tickers = ['T%d' % i for i in range(12)]
+            results = list(batch.download_many(
+                tickers, conn, max_workers=4, rate=None, batch_size=5,
+                base_url=server.url))
+        self.assertEqual([None] * 12, [result.error for result in results])
+        self.assertEqual(12 * 4, server.requests)
+        self.assertEqual(3, conn.commits)
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def imported(code):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '; import sys; print(" ".join(name '
+         'for name in ["pandas", "numpy", "bs4", "asyncio"] '
+         'if name in sys.modules))'], env=env, universal_newlines=True)
+    return output.split()
+
+
+class TestLazyImports(TestCase):
+    def test_package(self):
+        self.assertEqual([], imported('import good_morning'))
+        self.assertEqual([], imported(
+            'from good_morning import HTTPSession, ResponseCache'))
+        self.assertEqual([], imported('import good_morning.runner'))
+
+    def test_first_use(self):
+        self.assertEqual(['pandas', 'numpy'], imported(
+            'import good_morning; good_morning.KeyRatiosDownloader; '
+            'good_morning.download_many'))
+        self.assertEqual(['asyncio'], imported(
+            'import good_morning; good_morning.AsyncHTTPSession'))
+        self.assertIn('bs4', imported(
+            'import good_morning; from tests.fakes import read_fixture; '
+            'import json; good_morning.FinancialsDownloader()._parse(json.'
+            'loads(read_fixture("financials_aapl_is.json"))["result"])'))
+
+    def test_exports(self):
+        import good_morning
+        for name in good_morning.__all__:
+            self.assertIs(getattr(good_morning, name),
+                          getattr(__import__(good_morning._EXPORTS[name],
+                                             fromlist=[name]), name))
+        self.assertIn('Panel', dir(good_morning))
+        with self.assertRaises(AttributeError):
+            good_morning.Missing
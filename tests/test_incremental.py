@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from good_morning import batch
+from good_morning import good_morning as gm
+from good_morning.incremental import RefreshState
+from tests.fakes import FakeConnection, FixtureTransport
+
+
+class ChangingTransport(FixtureTransport):
+    def __init__(self):
+        super(ChangingTransport, self).__init__()
+        self.replacements = []
+
+    def get(self, url):
+        body = super(ChangingTransport, self).get(url)
+        for old, new in self.replacements:
+            body = body.replace(old, new)
+        return body
+
+
+class TestRefreshState(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+        self.transport = ChangingTransport()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key_ratios(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=self.transport,
+                                    state=RefreshState(self.path))
+        self.assertIsNotNone(kr.download('AAPL', conn))
+        self.assertEqual(11, len(conn.executemany_calls()[0][1]))
+        # Unchanged response (also after reloading the state).
+        kr = gm.KeyRatiosDownloader(transport=self.transport,
+                                    state=RefreshState(self.path))
+        self.assertIsNone(kr.download('AAPL', conn))
+        self.assertEqual(11, len(conn.executemany_calls()))
+        # A single changed period of a single frame.
+        self.transport.replacements = [(b'"45,734"', b'"45,735"')]
+        frames = kr.download('AAPL', conn)
+        self.assertEqual(45735.0, frames[0].iloc[0, 0])
+        calls = conn.executemany_calls()[11:]
+        self.assertEqual(1, len(calls))
+        self.assertIn('morningstar_key_financials_usd', calls[0][0])
+        self.assertEqual(1, len(calls[0][1]))
+        self.assertEqual('2005-09-30', calls[0][1][0][1])
+
+    def test_financials(self):
+        conn = FakeConnection()
+        state = RefreshState(self.path)
+        fd = gm.FinancialsDownloader(transport=self.transport, state=state)
+        self.assertIsNotNone(fd.download('AAPL', conn))
+        self.assertEqual(4, len(conn.executemany_calls()))
+        self.assertIsNone(fd.download('AAPL', conn))
+        self.transport.replacements = [(b'108249000000', b'108249000001')]
+        result = fd.download('AAPL', conn)
+        calls = conn.executemany_calls()[4:]
+        # The same row changed in all three statements (the same fixture).
+        self.assertEqual(3, len(calls))
+        for _, rows in calls:
+            self.assertEqual(1, len(rows))
+        self.assertIn(108249000001.0,
+                      result['income_statement'].iloc[:, 2:].values)
+
+    def test_request_parameters(self):
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=self.transport,
+                                    state=RefreshState(self.path))
+        self.assertIsNotNone(kr.download('AAPL', conn))
+        self.assertIsNone(kr.download('AAPL', conn))
+        # Another currency is not compared with the previous one.
+        self.assertIsNotNone(kr.download('AAPL', conn, currency='EUR'))
+        self.assertEqual(22, len(conn.executemany_calls()))
+        self.assertIsNone(kr.download('AAPL', conn, currency='EUR'))
+        self.assertIsNone(kr.download('AAPL', conn))
+
+    def test_concurrent_requests(self):
+        state = RefreshState(self.path)
+        usd, eur = ('GBR', 'en_US', 'USD'), ('GBR', 'en_US', 'EUR')
+        state.stage('AAPL', 'kr', b'usd', {'2015': 'a'}, usd)
+        state.stage('AAPL', 'kr', b'eur', {'2015': 'b'}, eur)
+        state.commit(['AAPL'], usd)
+        # The staged EUR entry was neither overwritten nor committed.
+        self.assertEqual({'2015'}, state.changed('AAPL', 'kr', eur))
+        self.assertIsNone(state.changed('AAPL', 'kr', usd))
+        self.assertTrue(state.unchanged('AAPL', 'kr', b'usd', usd))
+        self.assertFalse(state.unchanged('AAPL', 'kr', b'eur', eur))
+
+    def test_failed_upload(self):
+        conn = FakeConnection()
+        conn.commit = mock.Mock(side_effect=Exception('lost connection'))
+        kr = gm.KeyRatiosDownloader(transport=self.transport,
+                                    state=RefreshState(self.path))
+        with self.assertRaises(Exception):
+            kr.download('AAPL', conn)
+        # Nothing was committed, so the next run uploads everything again.
+        kr = gm.KeyRatiosDownloader(transport=self.transport,
+                                    state=RefreshState(self.path))
+        self.assertIsNotNone(kr.download('AAPL', FakeConnection()))
+
+    def test_download_many(self):
+        state = RefreshState(self.path)
+        tickers = ['A', 'B', 'C']
+
+        def run():
+            conn = FakeConnection()
+            results = list(batch.download_many(
+                tickers, conn, max_workers=2, rate=None,
+                transport=self.transport, state=state))
+            self.assertTrue(all(result.error is None for result in results))
+            return results, conn
+
+        results, conn = run()
+        self.assertEqual(15, len(conn.executemany_calls()))
+        results, conn = run()
+        self.assertEqual(0, len(conn.executemany_calls()))
+        for result in results:
+            self.assertIsNone(result.key_ratios)
+            self.assertIsNone(result.financials)
+
+    def test_download_many_saves(self):
+        state = RefreshState(self.path)
+        tickers = ['T%d' % i for i in range(5)]
+        with mock.patch('good_morning.incremental.json.dump',
+                        wraps=json.dump) as dump:
+            results = list(batch.download_many(
+                tickers, max_workers=2, rate=None, batch_size=2,
+                transport=self.transport, state=state))
+        self.assertTrue(all(result.error is None for result in results))
+        # Saved once per batch of two tickers and at the end.
+        self.assertEqual(3, dump.call_count)
+        with open(self.path) as f:
+            self.assertEqual(5 * 4, len(json.load(f)))
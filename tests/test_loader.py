@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from pandas.testing import assert_frame_equal, assert_index_equal
+
+from good_morning import good_morning as gm
+from good_morning.loader import DatabaseLoader
+from good_morning.storage import SQLiteStorage
+from tests.fakes import FixtureTransport, read_fixture
+
+
+class MySQLConnection(object):
+    """Runs the MySQL statements of MySQLBatch and of the DatabaseLoader on an
+    in-memory SQLite database, keeping the table and column comments for the
+    information_schema queries.
+    """
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        # Table name -> comment.
+        self.table_comments = {}
+        # Table name -> list of pairs (column name, comment).
+        self.columns = {}
+        self.queries = []
+
+    def cursor(self):
+        return MySQLCursor(self)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+class MySQLCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, args=()):
+        connection = self.connection
+        connection.queries.append(query)
+        self.rows = []
+        if 'information_schema.tables' in query:
+            self.rows = list(connection.table_comments.items())
+        elif 'information_schema.columns' in query:
+            if 'column_comment' in query:
+                self.rows = [(table, column, comment)
+                             for table in sorted(connection.columns)
+                             for column, comment in connection.columns[table]]
+            else:
+                self.rows = [(table, column)
+                             for table, columns in connection.columns.items()
+                             for column, _ in columns
+                             if not args or table == args[0]]
+        elif query.startswith('CREATE TABLE'):
+            table = re.match(r'CREATE TABLE IF NOT EXISTS `(\w+)`',
+                             query).group(1)
+            comment = re.search(r'\nCOMMENT = "([^"]*)"', query)
+            connection.table_comments[table] = (
+                comment.group(1) if comment else '')
+            connection.columns[table] = [
+                (column, _comment(definition)) for column, definition in
+                re.findall(r'^  `(\w+)` (.*(?:\n    .*)?)', query, re.M)]
+            primary_key = re.search(r'PRIMARY KEY USING BTREE \(([^)]*)\)',
+                                    query).group(1)
+            connection.conn.execute(
+                'CREATE TABLE "%s" (%s, PRIMARY KEY (%s))' % (
+                    table, ', '.join('"%s"' % column for column, _ in
+                                     connection.columns[table]),
+                    primary_key.replace('`', '"')))
+        elif query.startswith('ALTER TABLE'):
+            table = re.match(r'ALTER TABLE `(\w+)`', query).group(1)
+            for column, definition in re.findall(
+                    r'ADD COLUMN `(\w+)` (.*)', query):
+                connection.columns[table].append(
+                    (column, _comment(definition)))
+                connection.conn.execute(
+                    'ALTER TABLE "%s" ADD COLUMN "%s"' % (table, column))
+        else:
+            self.rows = connection.conn.execute(
+                _sqlite(query), args).fetchall()
+
+    def executemany(self, query, rows):
+        self.connection.queries.append(query)
+        self.connection.conn.executemany(_sqlite(query), rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def _comment(definition):
+    comment = re.search(r'COMMENT\s+"([^"]*)"', definition)
+    return comment.group(1) if comment else ''
+
+
+def _sqlite(query):
+    assert '"' not in query and '?' not in query
+    return query.replace('`', '"').replace('%s', '?')
+
+
+class TestDatabaseLoader(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(
+            os.path.join(self.directory, 'morningstar.db'))
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')),
+            storage=self.storage)
+        self.frames = kr.download('AAPL')
+        kr.download('MSFT')
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')),
+            storage=self.storage)
+        self.result = fd.download('AAPL')
+        # The same data uploaded to MySQL by MySQLBatch.
+        self.mysql = MySQLConnection()
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')))
+        kr.download('AAPL', self.mysql)
+        kr.download('MSFT', self.mysql)
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')))
+        fd.download('AAPL', self.mysql)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def loaders(self):
+        yield DatabaseLoader(self.storage)
+        yield DatabaseLoader(self.mysql)
+
+    def test_key_ratios(self):
+        for loader in self.loaders():
+            frames = loader.key_ratios('AAPL')
+            self.assertEqual(len(self.frames), len(frames))
+            for expected, frame in zip(self.frames, frames):
+                assert_frame_equal(expected, frame)
+            self.assertEqual(['AAPL', 'MSFT'],
+                             sorted(loader.key_ratios(['AAPL', 'MSFT'])))
+            self.assertEqual(['AAPL', 'MSFT'], sorted(loader.key_ratios()))
+            self.assertIsNone(loader.key_ratios('IBM'))
+
+    def test_key_ratios_filters(self):
+        for loader in self.loaders():
+            frames = loader.key_ratios(
+                ['AAPL'], start='2010-01-01', end='2013-12-31',
+                metrics=['Revenue USD Mil', 'gross_margin_percent'])['AAPL']
+            self.assertEqual(1, len(frames))
+            assert_frame_equal(
+                self.frames[0].loc[['Revenue USD Mil', 'Gross Margin %'],
+                                   '2010-09':'2013-09'],
+                frames[0])
+
+    def test_financials(self):
+        for loader in self.loaders():
+            result = loader.financials('AAPL')
+            for name in ['income_statement', 'balance_sheet', 'cash_flow']:
+                assert_frame_equal(self.result[name], result[name])
+            assert_index_equal(self.result['period_range'],
+                               result['period_range'])
+            self.assertEqual(self.result['fiscal_year_end'],
+                             result['fiscal_year_end'])
+            self.assertEqual(self.result['currency'], result['currency'])
+            self.assertEqual(self.result['trees'], result['trees'])
+            self.assertIsNone(loader.financials('MSFT'))
+
+    def test_financials_filters(self):
+        statement = self.result['income_statement']
+        items = list(statement['title'].iloc[:2])
+        for loader in self.loaders():
+            result = loader.financials(['AAPL'], start='2012-01-01',
+                                       end='2013-12-31', items=items)['AAPL']
+            periods = self.result['period_range'][
+                (self.result['period_range'].year >= 2012) &
+                (self.result['period_range'].year <= 2013)]
+            assert_index_equal(periods, result['period_range'])
+            assert_frame_equal(
+                statement.loc[statement['title'].isin(items),
+                              ['parent_index', 'title'] + list(periods)],
+                result['income_statement'], check_index_type=False)
+
+    def test_mysql_queries(self):
+        connection = self.mysql
+        connection.queries = []
+        loader = DatabaseLoader(connection)
+        loader.key_ratios(['AAPL', 'MSFT'], start='2010-01-01',
+                          metrics=['Revenue USD Mil'])
+        self.assertIn(
+            'SELECT `ticker`, `period`, `revenue_usd_mil` FROM '
+            '`morningstar_key_financials_usd` WHERE `ticker` IN (%s, %s) '
+            'AND `period` >= %s ORDER BY `ticker`, `period`',
+            connection.queries)
+        # The tables are read from the information_schema only once.
+        loader.financials('AAPL')
+        self.assertEqual(2, len([query for query in connection.queries
+                                 if 'information_schema' in query]))
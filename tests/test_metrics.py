@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from good_morning import good_morning as gm
+from good_morning.metrics import Metrics, STAGE_SECONDS
+from tests.fakes import FakeConnection, FixtureTransport
+
+
+class TestMetrics(TestCase):
+    def test_prometheus(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.increment('requests_total', status=200)
+        metrics.increment('requests_total', 2, status=200)
+        metrics.set_gauge('rate', 2)
+        metrics.set_gauge('rate', 2.5)
+        metrics.observe('stage_seconds', 0.05, stage='fetch')
+        metrics.observe('stage_seconds', 0.5, stage='fetch')
+        self.assertEqual(3, metrics.counter('requests_total', status=200))
+        self.assertEqual(0, metrics.counter('requests_total', status=503))
+        self.assertEqual(2.5, metrics.gauge('rate'))
+        self.assertIsNone(metrics.gauge('concurrency'))
+        self.assertEqual((2, 0.55), metrics.histogram('stage_seconds',
+                                                      stage='fetch'))
+        self.assertEqual(
+            '# TYPE requests_total counter\n'
+            'requests_total{status="200"} 3\n'
+            '# TYPE rate gauge\n'
+            'rate 2.5\n'
+            '# TYPE stage_seconds histogram\n'
+            'stage_seconds_bucket{stage="fetch",le="0.1"} 1\n'
+            'stage_seconds_bucket{stage="fetch",le="1.0"} 2\n'
+            'stage_seconds_bucket{stage="fetch",le="+Inf"} 2\n'
+            'stage_seconds_sum{stage="fetch"} 0.55\n'
+            'stage_seconds_count{stage="fetch"} 2\n',
+            metrics.to_prometheus())
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'good_morning.prom')
+            metrics.write_prometheus(path)
+            with open(path) as f:
+                self.assertEqual(metrics.to_prometheus(), f.read())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_mixed_labels(self):
+        metrics = Metrics()
+        metrics.increment('requests_total', status=200)
+        metrics.increment('requests_total', status='error')
+        metrics.increment('requests_total', status='200')
+        self.assertEqual(2, metrics.counter('requests_total', status=200))
+        self.assertEqual(1, metrics.counter('requests_total', status='error'))
+        self.assertEqual(
+            '# TYPE requests_total counter\n'
+            'requests_total{status="200"} 2\n'
+            'requests_total{status="error"} 1\n',
+            metrics.to_prometheus())
+        metrics.log()
+
+    def test_downloaders(self):
+        metrics = Metrics()
+        conn = FakeConnection()
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport(),
+                                    metrics=metrics)
+        kr.download('AAPL', conn)
+        fd = gm.FinancialsDownloader(transport=FixtureTransport(),
+                                     metrics=metrics)
+        fd.download('AAPL')
+        for stage in ('fetch', 'decode', 'parse', 'frame'):
+            self.assertEqual(1, metrics.histogram(
+                STAGE_SECONDS, stage=stage, source='key_ratios')[0])
+            self.assertEqual(3, metrics.histogram(
+                STAGE_SECONDS, stage=stage, source='financials')[0])
+        self.assertEqual(1, metrics.histogram(
+            STAGE_SECONDS, stage='db_write', source='mysql')[0])
+        self.assertLess(0, metrics.counter(
+            'good_morning_response_bytes_total', source='key_ratios'))
+        self.assertEqual(conn.schema_queries, metrics.counter(
+            'good_morning_db_schema_queries_total'))
+        self.assertEqual(
+            sum(len(rows) for _, rows in conn.executemany_calls()),
+            metrics.counter('good_morning_db_rows_total'))
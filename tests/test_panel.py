@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from good_morning import good_morning as gm
+from good_morning.panel import Panel
+from tests.fakes import FixtureTransport, read_fixture
+
+
+class TestPanel(TestCase):
+    def setUp(self):
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')))
+        self.frames = kr.download('AAPL')
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')))
+        self.financials = fd.download('AAPL')
+
+    def test_add_key_ratios(self):
+        panel = Panel()
+        panel.add_key_ratios('AAPL', self.frames)
+        self.assertEqual(['AAPL'], panel.tickers)
+        self.assertEqual(sum(len(frame) for frame in self.frames),
+                         len(panel.metrics))
+        self.assertEqual(list(range(2005, 2016)), panel.periods)
+        self.assertEqual(45734.0, panel.values[
+            0, panel.metric_index('Revenue USD Mil'), panel.period_index(2005)])
+        index = panel.metric_index(('Key Financials USD', 'Revenue USD Mil'))
+        np.testing.assert_array_equal(
+            self.frames[0].loc['Revenue USD Mil'].values,
+            panel.values[0, index])
+
+    def test_cross_section(self):
+        panel = Panel()
+        for i in range(40):
+            frames = [frame * (i + 1) for frame in self.frames]
+            panel.add_key_ratios('T%d' % i, frames)
+        self.assertEqual(40, len(panel))
+        revenue = panel.cross_section('Revenue USD Mil', 2010)
+        self.assertEqual(['T%d' % i for i in range(40)], list(revenue.index))
+        expected = self.frames[0].loc['Revenue USD Mil'].iloc[5]
+        self.assertEqual(expected * 40, revenue['T39'])
+        self.assertEqual((40, 11), panel.history('Revenue USD Mil').shape)
+        with self.assertRaises(KeyError):
+            panel.cross_section('Revenue USD Mil', 1999)
+
+    def test_replace_and_grow_periods(self):
+        panel = Panel()
+        panel.add_frame('A', 'f', ['x', 'y'], [2010, 2011],
+                        [[1.0, 2.0], [3.0, 4.0]])
+        panel.add_frame('B', 'f', ['x'], [2008], [[5.0]])
+        panel.add_frame('A', 'f', ['x', 'x'], [2012], [[6.0], [7.0]])
+        self.assertEqual([2008, 2009, 2010, 2011, 2012], panel.periods)
+        np.testing.assert_array_equal(
+            [np.nan, np.nan, np.nan, np.nan, 6.0], panel.history('x').loc['A'])
+        self.assertEqual(7.0, panel.cross_section('x (2)', 2012)['A'])
+        np.testing.assert_array_equal(
+            [np.nan, np.nan, 3.0, 4.0, np.nan], panel.history('y').loc['A'])
+        self.assertEqual(5.0, panel.cross_section('x', 2008)['B'])
+
+    def test_add_financials(self):
+        panel = Panel()
+        panel.add_key_ratios('AAPL', self.frames)
+        panel.add_financials('AAPL', self.financials)
+        statement = self.financials['income_statement']
+        title = statement['title'].iloc[0]
+        index = panel.metric_index(('income_statement', title))
+        year = statement.columns[2].year
+        self.assertEqual(statement.iloc[0, 2],
+                         panel.values[0, index, panel.period_index(year)])
+        with self.assertRaises(KeyError):
+            # The same title in all three statements.
+            panel.metric_index(title)
+
+    def test_repeated_titles(self):
+        financials = dict(self.financials)
+        statement = self.financials['income_statement'].copy()
+        # Research and development and Sales, General & administrative are
+        # children of Operating expenses, Cost of revenue is a root.
+        statement.loc[[1, 4, 5], 'title'] = 'Basic'
+        financials['income_statement'] = statement
+        panel = Panel()
+        panel.add_financials('AAPL', financials)
+        self.assertEqual(
+            sum(len(financials[name]) for name in
+                ['income_statement', 'balance_sheet', 'cash_flow']),
+            len(panel.metrics))
+        year = statement.columns[2].year
+        for label, row in [('Basic', 1), ('Operating expenses > Basic', 4),
+                           ('Operating expenses > Basic (2)', 5)]:
+            self.assertEqual(statement.iloc[row, 2], panel.values[
+                0, panel.metric_index(('income_statement', label)),
+                panel.period_index(year)])
+
+
+class TestPanelStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'panel')
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')))
+        self.panel = Panel()
+        for ticker in ['AAPL', 'MSFT', 'IBM']:
+            self.panel.add_key_ratios(ticker, kr.download(ticker))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        self.panel.save(self.path)
+        for mmap in [True, False]:
+            panel = Panel.load(self.path, mmap=mmap)
+            self.assertEqual(self.panel.tickers, panel.tickers)
+            self.assertEqual(self.panel.metrics, panel.metrics)
+            self.assertEqual(self.panel.periods, panel.periods)
+            np.testing.assert_array_equal(self.panel.values, panel.values)
+            self.assertEqual(
+                self.panel.cross_section('Revenue USD Mil', 2010)['MSFT'],
+                panel.cross_section('Revenue USD Mil', 2010)['MSFT'])
+        self.assertIsInstance(Panel.load(self.path)._values, np.memmap)
+
+    def test_modify_loaded(self):
+        self.panel.save(self.path)
+        panel = Panel.load(self.path)
+        panel.add_frame('AAPL', 'Key Financials USD', ['Revenue USD Mil'],
+                        [2010], [[1.0]])
+        self.assertEqual(1.0, panel.cross_section('Revenue USD Mil',
+                                                  2010)['AAPL'])
+        # The saved panel is not modified.
+        self.assertNotEqual(1.0, Panel.load(self.path).cross_section(
+            'Revenue USD Mil', 2010)['AAPL'])
+
+    def test_empty(self):
+        Panel().save(self.path)
+        self.assertEqual(0, len(Panel.load(self.path)))
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import pickle
+from unittest import TestCase
+
+import pandas as pd
+
+from good_morning import batch
+from good_morning import good_morning as gm
+from good_morning import parallel
+from good_morning import synthetic
+from good_morning.metrics import Metrics, STAGE_SECONDS
+from tests.fakes import FixtureTransport, read_fixture
+
+
+class TestParallel(TestCase):
+    def setUp(self):
+        self.kr_body = read_fixture('key_ratios_aapl.csv')
+        self.fin_bodies = [read_fixture('financials_aapl_is.json')] * 3
+        # Statements with different periods (6, 5 and 6 columns).
+        self.uneven_bodies = [
+            synthetic.financials_json(num_periods=5),
+            synthetic.financials_json(num_periods=4),
+            synthetic.financials_json(num_periods=5)]
+
+    def assertFramesEqual(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for expected_frame, frame in zip(expected, actual):
+            pd.testing.assert_frame_equal(expected_frame, frame)
+
+    def assertFinancialsEqual(self, expected, actual):
+        self.assertEqual(sorted(expected), sorted(actual))
+        for _, table_name in gm._REPORTS:
+            pd.testing.assert_frame_equal(expected[table_name],
+                                          actual[table_name])
+        pd.testing.assert_index_equal(expected['period_range'],
+                                      actual['period_range'])
+        self.assertEqual(expected['fiscal_year_end'],
+                         actual['fiscal_year_end'])
+        self.assertEqual(expected['currency'], actual['currency'])
+
+    def test_pack(self):
+        frames = gm.KeyRatiosDownloader._parse_body(self.kr_body)
+        packed = pickle.loads(pickle.dumps(parallel.pack_key_ratios(frames)))
+        self.assertFramesEqual(frames, parallel.unpack_key_ratios(packed))
+        result = gm.FinancialsDownloader._parse_bodies(self.fin_bodies)
+        packed = pickle.loads(pickle.dumps(parallel.pack_financials(result)))
+        self.assertFinancialsEqual(result,
+                                   parallel.unpack_financials(packed))
+        # The worker processes leave the trees to unpack_financials.
+        self.assertNotIn('trees', gm.FinancialsDownloader._parse_bodies(
+            self.fin_bodies, trees=False))
+        self.assertEqual(result['trees'],
+                         parallel.unpack_financials(packed)['trees'])
+        result = gm.FinancialsDownloader._parse_bodies(self.uneven_bodies)
+        self.assertEqual(5, result['balance_sheet'].shape[1] - 2)
+        packed = pickle.loads(pickle.dumps(parallel.pack_financials(result)))
+        self.assertFinancialsEqual(result,
+                                   parallel.unpack_financials(packed))
+
+    def test_pool(self):
+        metrics = Metrics()
+        with parallel.ParsePool(2, metrics) as pool:
+            self.assertFramesEqual(
+                gm.KeyRatiosDownloader._parse_body(self.kr_body),
+                pool.key_ratios(self.kr_body))
+            self.assertFinancialsEqual(
+                gm.FinancialsDownloader._parse_bodies(self.fin_bodies,
+                                                      u'fast'),
+                pool.financials(self.fin_bodies, u'fast'))
+            self.assertFinancialsEqual(
+                gm.FinancialsDownloader._parse_bodies(self.uneven_bodies),
+                pool.financials(self.uneven_bodies))
+            with self.assertRaises(ValueError):
+                pool.key_ratios(b'')
+        self.assertEqual(6, metrics.histogram(
+            STAGE_SECONDS, stage='parse', source='financials')[0])
+
+    def test_download_many(self):
+        tickers = ['AAPL', 'MSFT', 'GOOG']
+        expected = {result.ticker: result for result in batch.download_many(
+            tickers, rate=None, transport=FixtureTransport())}
+        results = list(batch.download_many(
+            tickers, rate=None, transport=FixtureTransport(), processes=2))
+        self.assertEqual(sorted(tickers),
+                         sorted(result.ticker for result in results))
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertFramesEqual(expected[result.ticker].key_ratios,
+                                   result.key_ratios)
+            self.assertFinancialsEqual(expected[result.ticker].financials,
+                                       result.financials)
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from good_morning import good_morning as gm
+from tests.fakes import FixtureTransport, read_fixture
+
+
+class TestKeyRatiosParse(TestCase):
+    def setUp(self):
+        self.body = read_fixture('key_ratios_aapl.csv')
+
+    def test_parse_tables(self):
+        tables = gm.KeyRatiosDownloader._parse_tables(self.body.splitlines())
+        self.assertEqual(
+            [name for name, _ in gm.KeyRatiosDownloader._response_structure],
+            [name for name, _ in tables])
+        self.assertEqual(['', '2005-09'], tables[0][1][0][:2])
+        self.assertEqual('45,734', tables[0][1][1][1])
+
+    def test_download(self):
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport(self.body))
+        frames = kr.download('AAPL')
+        self.assertEqual(11, len(frames))
+        self.assertEqual('Key Financials USD', frames[0].index.name)
+        self.assertEqual('Revenue USD Mil', frames[0].index[0])
+        self.assertEqual(45734.0, frames[0].iloc[0, 0])
+        self.assertEqual(11, len(frames[0].columns))
+        self.assertEqual('Period', frames[0].columns.name)
+        self.assertEqual(2005, frames[0].columns[0].year)
+        self.assertEqual(9, frames[0].columns[0].month)
+        for frame in frames:
+            self.assertEqual('float64', str(frame.dtypes.unique()[0]))
+        self.assertTrue(frames[0].iloc[6].isnull().any())
+
+    def test_download_invalid(self):
+        kr = gm.KeyRatiosDownloader(transport=FixtureTransport(b''))
+        with self.assertRaises(ValueError):
+            kr.download('nothing')
+
+
+class TestFinancialsParse(TestCase):
+    def setUp(self):
+        self.html = json.loads(
+            read_fixture('financials_aapl_is.json').decode('utf-8'))['result']
+
+    def _parse(self, fd):
+        return fd._parse(self.html)
+
+    def test_parse(self):
+        statement = self._parse(gm.FinancialsDownloader())
+        frame = statement.frame
+        self.assertEqual(11, len(frame))
+        self.assertEqual(['parent_index', 'title'],
+                         list(frame.columns[:2]))
+        self.assertEqual(6, len(statement.period_range))
+        self.assertEqual(9, statement.fiscal_year_end)
+        self.assertEqual('USD', statement.currency)
+        self.assertEqual([0, 1, 2, 3, 3, 3, 3, 7, 8, 9, 10],
+                         list(frame['parent_index']))
+        self.assertEqual('Revenue', frame['title'][0])
+        self.assertEqual(108249e6, frame.iloc[0, 2])
+        self.assertTrue(frame.iloc[8, 2:5].isnull().all())
+        self.assertTrue(frame.iloc[10, 2:].isnull().all())
+
+    def test_duplicate_ids(self):
+        # Data rows are matched to the next label with the same id.
+        statement = gm.FinancialsDownloader._build_statement(
+            '2014-09', 2, 9, 'USD',
+            [('i1', 0, 'A'), ('i2', 1, 'B'), ('i1', 2, 'C'), ('i3', 3, 'D')],
+            [('i1', [1.0, 2.0]), ('i1', [3.0, 4.0]), ('i3', [5.0])])
+        values = statement.frame.iloc[:, 2:].values.tolist()
+        self.assertEqual([1.0, 2.0], values[0])
+        self.assertTrue(statement.frame.iloc[1, 2:].isnull().all())
+        self.assertEqual([3.0, 4.0], values[2])
+        self.assertEqual(5.0, values[3][0])
+
+    def test_parse_concurrent(self):
+        fd = gm.FinancialsDownloader()
+        expected = self._parse(fd).frame
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statements = list(executor.map(
+                lambda _: self._parse(fd), range(32)))
+        for statement in statements:
+            self.assertTrue(expected.equals(statement.frame))
+
+    def test_fast_parser(self):
+        expected = self._parse(gm.FinancialsDownloader())
+        statement = self._parse(gm.FinancialsDownloader(parser='fast'))
+        self.assertTrue(expected.frame.equals(statement.frame))
+        self.assertEqual(list(expected.frame['title']),
+                         list(statement.frame['title']))
+        self.assertTrue(
+            expected.period_range.equals(statement.period_range))
+        self.assertEqual(expected.fiscal_year_end, statement.fiscal_year_end)
+        self.assertEqual(expected.currency, statement.currency)
+
+    def test_unknown_parser(self):
+        with self.assertRaises(ValueError):
+            gm.FinancialsDownloader(parser='xml')
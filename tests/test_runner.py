@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from good_morning import runner
+from good_morning.batch import DownloadResult
+
+
+class FakeDownloads(object):
+    def __init__(self, failures):
+        # Ticker -> number of failures before the first success.
+        self.failures = dict(failures)
+        self.calls = []
+
+    def __call__(self, tickers, **kwargs):
+        self.calls.append(list(tickers))
+        for ticker in tickers:
+            if self.failures.get(ticker, 0) > 0:
+                self.failures[ticker] -= 1
+                yield DownloadResult(ticker, None, None, IOError('timeout'))
+            else:
+                yield DownloadResult(ticker, [], {}, None)
+
+
+class TestRunner(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.directory, 'run.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, downloads, tickers, retries=2):
+        journal = runner.Journal(self.journal_path)
+        progress = runner.Progress(len(tickers), out=io.StringIO())
+        with mock.patch.object(runner, 'download_many', downloads), \
+                mock.patch.object(runner.time, 'sleep') as sleep:
+            errors = runner.run(tickers, journal, retries=retries,
+                                backoff=1.0, progress=progress)
+        journal.close()
+        return errors, sleep, progress
+
+    def test_retries(self):
+        downloads = FakeDownloads({'B': 1, 'C': 5})
+        errors, sleep, progress = self._run(downloads, ['A', 'B', 'C'])
+        self.assertEqual(['C'], list(errors))
+        self.assertEqual([['A', 'B', 'C'], ['B', 'C'], ['C']],
+                         downloads.calls)
+        self.assertEqual([mock.call(1.0), mock.call(2.0)],
+                         sleep.call_args_list)
+        self.assertEqual((2, 1), (progress.completed, progress.failed))
+        self.assertIn('3/3 tickers done, 2 completed, 1 failed',
+                      progress._out.getvalue())
+        self.assertIn('ETA 0:00:00', progress._out.getvalue())
+
+    def test_duplicates(self):
+        downloads = FakeDownloads({})
+        self._run(downloads, ['A', 'B', 'A', 'C', 'B'])
+        self.assertEqual([['A', 'B', 'C']], downloads.calls)
+
+    def test_resume(self):
+        self._run(FakeDownloads({'C': 5}), ['A', 'B', 'C'], retries=0)
+        # Truncated line written by a crash.
+        with open(self.journal_path, 'a') as f:
+            f.write('{"ticker": "D", "sta')
+        downloads = FakeDownloads({})
+        errors, _, _ = self._run(downloads, ['A', 'B', 'C', 'D'])
+        self.assertEqual({}, errors)
+        self.assertEqual([['C', 'D']], downloads.calls)
+        journal = runner.Journal(self.journal_path)
+        self.assertEqual({'A', 'B', 'C', 'D'}, journal.completed)
+        self.assertEqual({}, journal.failed)
+        journal.close()
+
+    def test_main(self):
+        tickers_path = os.path.join(self.directory, 'tickers.txt')
+        with open(tickers_path, 'w') as f:
+            f.write('# S&P 500\nAAPL\n\nMSFT\n')
+        downloads = FakeDownloads({'MSFT': 1})
+        with mock.patch.object(runner, 'download_many', downloads), \
+                mock.patch.object(runner.time, 'sleep'), \
+                mock.patch.object(runner.sys, 'stderr', io.StringIO()):
+            self.assertEqual(0, runner.main(
+                [tickers_path, '--rate', '0', '--workers', '2']))
+        self.assertEqual([['AAPL', 'MSFT'], ['MSFT']], downloads.calls)
+        self.assertTrue(os.path.exists(tickers_path + '.journal'))
+        with mock.patch.object(runner.sys, 'stderr', io.StringIO()), \
+                self.assertRaises(SystemExit):
+            runner.main([tickers_path, '--adaptive', '--rate', '0'])
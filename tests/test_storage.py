@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+from good_morning import batch
+from good_morning import good_morning as gm
+from good_morning.storage import SQLiteStorage
+from tests.fakes import FixtureTransport, read_fixture
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+if pyarrow is not None:
+    from good_morning.storage import ParquetStorage
+
+
+@skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestParquetStorage(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = ParquetStorage(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key_ratios(self):
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')),
+            storage=self.storage)
+        frames = kr.download('AAPL')
+        kr.download('MSFT')
+        frame = self.storage.read('Key Financials USD')
+        self.assertEqual(2 * len(frames[0].columns), len(frame))
+        self.assertEqual({'AAPL', 'MSFT'}, set(frame['ticker']))
+        frame = self.storage.read(
+            'key_financials_usd', columns=['Revenue USD Mil'],
+            tickers=['AAPL'], start='2010-01-01', end='2013-12-31')
+        self.assertEqual(['ticker', 'period', 'Revenue USD Mil'],
+                         list(frame.columns))
+        self.assertEqual(4, len(frame))
+        self.assertEqual(
+            list(frames[0].loc['Revenue USD Mil', '2010-09':'2013-09']),
+            list(frame['Revenue USD Mil']))
+
+    def test_financials(self):
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')),
+            storage=self.storage)
+        result = fd.download('AAPL')
+        frame = self.storage.read('income_statement')
+        statement = result['income_statement']
+        self.assertEqual(statement.shape[0] * (statement.shape[1] - 2),
+                         len(frame))
+        first = frame[frame['id'] == statement.index[0]]
+        self.assertEqual(statement['title'].iloc[0], first['item'].iloc[0])
+        self.assertEqual(
+            [value for value in statement.iloc[0, 2:]
+             if value == value],
+            [value for value in first['value'] if value == value])
+        unit = self.storage.read('unit', tickers=['AAPL'])
+        self.assertEqual(result['fiscal_year_end'],
+                         unit['fiscal_year_end'].iloc[0])
+        self.assertEqual('USD', unit['currency'].iloc[0])
+        # The unit has no periods, so the range does not apply to it.
+        unit = self.storage.read('unit', tickers=['AAPL'],
+                                 start='2010-01-01', end='2013-12-31')
+        self.assertEqual(['AAPL'], list(unit['ticker']))
+
+    def test_missing_ticker(self):
+        self.assertEqual(0, len(self.storage.read('income_statement',
+                                                  tickers=['AAPL'])))
+
+    def test_temporary_files(self):
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')),
+            storage=self.storage)
+        kr.download('AAPL')
+        directory = os.path.join(self.directory, 'frame=key_financials_usd',
+                                 'ticker=AAPL')
+        self.assertEqual(['data.parquet'], os.listdir(directory))
+        # Debris of a crashed write is not read as a part of the dataset.
+        for name in ['data.parquet.123.tmp', '.tmpabc.tmp']:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'garbage')
+        self.assertEqual({'AAPL'}, set(
+            self.storage.read('key_financials_usd')['ticker']))
+
+
+class TestSQLiteStorage(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'morningstar.db')
+        self.storage = SQLiteStorage(self.path)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def query(self, sql, *args):
+        return self.storage.connection.execute(sql, args).fetchall()
+
+    def test_key_ratios(self):
+        kr = gm.KeyRatiosDownloader(
+            transport=FixtureTransport(read_fixture('key_ratios_aapl.csv')),
+            storage=self.storage)
+        frames = kr.download('AAPL')
+        self.assertEqual('wal', self.query('PRAGMA journal_mode')[0][0])
+        self.assertEqual(
+            [(frames[0].loc['Revenue USD Mil'].iloc[5],)],
+            self.query('SELECT revenue_usd_mil FROM '
+                       'morningstar_key_financials_usd '
+                       'WHERE ticker = ? AND period = ?',
+                       'AAPL', '2010-09-30'))
+        self.assertEqual(
+            [('Key Financials USD',)],
+            self.query('SELECT label FROM morningstar_meta WHERE table_name '
+                       '= ? AND column_name = ?',
+                       'morningstar_key_financials_usd', ''))
+        self.assertEqual(
+            [('Revenue USD Mil',)],
+            self.query('SELECT label FROM morningstar_meta WHERE table_name '
+                       '= ? AND column_name = ?',
+                       'morningstar_key_financials_usd', 'revenue_usd_mil'))
+        self.assertIn(
+            ('ix_morningstar_key_financials_usd_period',),
+            self.query("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        # Writing a ticker again replaces its rows.
+        kr.download('AAPL')
+        self.assertEqual(
+            [(len(frames[0].columns),)],
+            self.query('SELECT COUNT(*) FROM morningstar_key_financials_usd'))
+
+    def test_financials(self):
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')),
+            storage=self.storage)
+        result = fd.download('AAPL')
+        statement = result['income_statement']
+        rows = self.query('SELECT id, parent_id, item FROM '
+                          'morningstar_income_statement ORDER BY id')
+        self.assertEqual(len(statement), len(rows))
+        self.assertEqual((statement.index[0],
+                          statement['parent_index'].iloc[0],
+                          statement['title'].iloc[0]), rows[0])
+        self.assertEqual(
+            [(result['fiscal_year_end'], 'USD')],
+            self.query('SELECT fiscal_year_end, currency FROM '
+                       'morningstar_unit WHERE ticker = ?', 'AAPL'))
+
+    def test_failed_ticker(self):
+        fd = gm.FinancialsDownloader(
+            transport=FixtureTransport(read_fixture('financials_aapl_is.json')),
+            storage=self.storage)
+        result = fd.download('AAPL')
+        # The cash flow is missing, the other statements are rolled back.
+        partial = dict(result)
+        del partial['cash_flow']
+        with self.assertRaises(KeyError):
+            self.storage.write_financials('MSFT', partial)
+        self.storage.write_financials('GOOG', result)
+        self.storage.flush()
+        self.assertEqual(
+            [('AAPL',), ('GOOG',)],
+            self.query('SELECT DISTINCT ticker FROM '
+                       'morningstar_income_statement ORDER BY ticker'))
+
+    def test_download_many(self):
+        transport = FixtureTransport(read_fixture('key_ratios_aapl.csv'))
+        tickers = ['T%d' % i for i in range(7)]
+        results = list(batch.download_many(
+            tickers, rate=None, financials=False, transport=transport,
+            storage=self.storage, batch_size=3))
+        self.assertEqual([None] * 7, [result.error for result in results])
+        # The batches are committed and visible to other connections.
+        other = SQLiteStorage(self.path)
+        self.assertEqual(
+            [(7,)], other.connection.execute(
+                'SELECT COUNT(DISTINCT ticker) FROM '
+                'morningstar_key_financials_usd').fetchall())
+        other.close()
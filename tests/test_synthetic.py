@@ -0,0 +1,39 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import json
+from unittest import TestCase
+
+from good_morning import good_morning as gm
+from good_morning import synthetic
+
+
+class TestSynthetic(TestCase):
+    def test_key_ratios(self):
+        kr = gm.KeyRatiosDownloader(
+            transport=synthetic.SyntheticTransport())
+        frames = kr.download('SYN')
+        self.assertEqual(
+            len([name for _, name in gm.KeyRatiosDownloader._response_structure
+                 if name]), len(frames))
+        self.assertEqual('Key Financials USD', frames[0].index.name)
+        self.assertEqual(11, len(frames[0].columns))
+        self.assertTrue(frames[0].isnull().values.any())
+        self.assertEqual(synthetic.key_ratios_csv(seed=1),
+                         synthetic.key_ratios_csv(seed=1))
+        self.assertNotEqual(synthetic.key_ratios_csv(seed=1),
+                            synthetic.key_ratios_csv(seed=2))
+
+    def test_financials(self):
+        html = json.loads(synthetic.financials_json(
+            num_items=120, seed=3).decode('utf-8'))['result']
+        bs4 = gm.FinancialsDownloader(parser='bs4')._parse(html)
+        fast = gm.FinancialsDownloader(parser='fast')._parse(html)
+        self.assertTrue(bs4.frame.equals(fast.frame))
+        self.assertEqual(6, len(bs4.period_range))
+        self.assertEqual(9, bs4.fiscal_year_end)
+        # Groups are parents of their line items, some rows are hidden.
+        self.assertEqual('Group 2', bs4.frame['title'].iloc[5])
+        self.assertEqual(5, bs4.frame['parent_index'].iloc[6])
+        self.assertLess(len(bs4.frame), 120)
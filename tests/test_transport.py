@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import asyncio
+import gzip
+import http.server
+import threading
+import urllib.error
+from unittest import TestCase, mock
+
+from good_morning import ratelimit
+from good_morning.aio import AsyncHTTPSession
+from good_morning.metrics import Metrics
+from good_morning.ratelimit import AdaptiveRateLimiter
+from good_morning.transport import HTTPSession
+
+
+class RecordingScheduler(object):
+    def __init__(self):
+        self.acquired = 0
+        self.outcomes = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def release(self, success=True, latency=None):
+        self.outcomes.append(success)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    connections = set()
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        if self.path == '/flaky' and Handler.failures < 2:
+            Handler.failures += 1
+            return self._send(503, b'')
+        if self.path == '/missing':
+            return self._send(404, b'')
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in [b'a' * 10, b'b' * 300, b'c']:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        body = b'x' * 1000
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            return self._send(200, gzip.compress(body), 'gzip')
+        return self._send(200, body)
+
+    def _send(self, status, body, encoding=None):
+        self.send_response(status)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class TestHTTPSession(ServerTestCase):
+    def test_keep_alive_gzip(self):
+        Handler.connections = set()
+        session = HTTPSession()
+        for _ in range(5):
+            self.assertEqual(b'x' * 1000, session.get(self.url + '/data'))
+        self.assertEqual(1, len(Handler.connections))
+        session.close()
+
+    def test_retries(self):
+        Handler.failures = 0
+        session = HTTPSession(backoff=0.01)
+        self.assertEqual(b'x' * 1000, session.get(self.url + '/flaky'))
+        Handler.failures = 0
+        session = HTTPSession(retries=1, backoff=0.01)
+        with self.assertRaises(urllib.error.HTTPError):
+            session.get(self.url + '/flaky')
+
+    def test_client_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            HTTPSession().get(self.url + '/missing')
+        self.assertEqual(404, context.exception.code)
+
+    def test_scheduler(self):
+        Handler.failures = 0
+        scheduler = RecordingScheduler()
+        session = HTTPSession(backoff=0.01, scheduler=scheduler)
+        session.get(self.url + '/flaky')
+        with self.assertRaises(urllib.error.HTTPError):
+            session.get(self.url + '/missing')
+        self.assertEqual(4, scheduler.acquired)
+        self.assertEqual([False, False, True, True], scheduler.outcomes)
+
+    def test_failed_acquire(self):
+        scheduler = RecordingScheduler()
+        scheduler.acquire = mock.Mock(side_effect=RuntimeError)
+        with self.assertRaises(RuntimeError):
+            HTTPSession(scheduler=scheduler).get(self.url + '/data')
+        self.assertEqual([], scheduler.outcomes)
+
+    def test_metrics(self):
+        Handler.failures = 0
+        metrics = Metrics()
+        session = HTTPSession(backoff=0.01, metrics=metrics)
+        session.get(self.url + '/flaky')
+        self.assertEqual(2, metrics.counter('good_morning_http_retries_total'))
+        self.assertEqual(1, metrics.counter('good_morning_http_requests_total',
+                                            status=200))
+        self.assertEqual(2, metrics.counter('good_morning_http_requests_total',
+                                            status=503))
+        self.assertLess(0, metrics.counter('good_morning_http_bytes_total'))
+
+
+class TestAsyncHTTPSession(ServerTestCase):
+    def test_keep_alive_gzip_chunked(self):
+        async def download(session):
+            bodies = await asyncio.gather(
+                *[session.get(self.url + '/data') for _ in range(5)])
+            bodies.append(await session.get(self.url + '/chunked'))
+            bodies.append(await session.get(self.url + '/data'))
+            await session.close()
+            return bodies
+
+        Handler.connections = set()
+        bodies = asyncio.run(download(AsyncHTTPSession()))
+        self.assertEqual([b'x' * 1000] * 5, bodies[:5])
+        self.assertEqual(b'a' * 10 + b'b' * 300 + b'c', bodies[5])
+        self.assertEqual(b'x' * 1000, bodies[6])
+        # The sequential requests reused the pooled connections.
+        self.assertEqual(5, len(Handler.connections))
+
+    def test_retries_and_errors(self):
+        Handler.failures = 0
+        metrics = Metrics()
+        session = AsyncHTTPSession(backoff=0.01, metrics=metrics)
+        self.assertEqual(b'x' * 1000,
+                         asyncio.run(session.get(self.url + '/flaky')))
+        self.assertEqual(2, metrics.counter('good_morning_http_retries_total'))
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            asyncio.run(AsyncHTTPSession().get(self.url + '/missing'))
+        self.assertEqual(404, context.exception.code)
+
+    def test_scheduler(self):
+        async def download(session):
+            await session.get(self.url + '/flaky')
+            with self.assertRaises(urllib.error.HTTPError):
+                await session.get(self.url + '/missing')
+            await session.close()
+
+        Handler.failures = 0
+        scheduler = RecordingScheduler()
+        asyncio.run(download(AsyncHTTPSession(backoff=0.01,
+                                              scheduler=scheduler)))
+        self.assertEqual(4, scheduler.acquired)
+        self.assertEqual([False, False, True, True], scheduler.outcomes)
+
+    def test_adaptive_rate_limiter(self):
+        async def download(session):
+            bodies = await asyncio.gather(
+                *[session.get(self.url + '/data') for _ in range(10)])
+            await session.close()
+            return bodies
+
+        limiter = AdaptiveRateLimiter(rate=1000.0, concurrency=2)
+        bodies = asyncio.run(download(AsyncHTTPSession(scheduler=limiter)))
+        self.assertEqual([b'x' * 1000] * 10, bodies)
+        self.assertEqual(0, limiter.in_flight)
+
+
+class TestAdaptiveRateLimiter(TestCase):
+    def test_aimd(self):
+        metrics = Metrics()
+        limiter = AdaptiveRateLimiter(rate=100.0, concurrency=2,
+                                      max_rate=1000.0, increase=1.0,
+                                      metrics=metrics)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(True, 0.01)
+        self.assertEqual(120.0, limiter.rate)
+        self.assertGreater(limiter.concurrency, 2)
+        # Slow responses do not increase the rate.
+        limiter.acquire()
+        limiter.release(True, 10.0)
+        self.assertEqual(120.0, limiter.rate)
+        # A burst of failures is a single decrease.
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(False)
+        self.assertEqual(60.0, limiter.rate)
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(60.0, metrics.gauge(ratelimit.RATE_GAUGE))
+        self.assertEqual(limiter.concurrency,
+                         metrics.gauge(ratelimit.CONCURRENCY_GAUGE))
+        self.assertEqual(0, metrics.gauge(ratelimit.IN_FLIGHT_GAUGE))
+        self.assertEqual(1, metrics.counter(
+            'good_morning_scheduler_decreases_total'))
+
+    def test_initial_rate(self):
+        limiter = AdaptiveRateLimiter(rate=0, concurrency=1, min_rate=1000.0,
+                                      max_rate=2000.0)
+        self.assertEqual(1000.0, limiter.rate)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(True, 0.01)
+        self.assertEqual(0, limiter.in_flight)
+        with self.assertRaises(ValueError):
+            AdaptiveRateLimiter(min_rate=0)
+
+    def test_concurrency(self):
+        limiter = AdaptiveRateLimiter(rate=1000.0, concurrency=2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        threading.Thread(target=acquire, daemon=True).start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(True, 0.01)
+        self.assertTrue(acquired.wait(1.0))
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+from unittest import TestCase
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from good_morning import good_morning as gm
+from good_morning.tree import StatementTree
+from tests.fakes import FixtureTransport, read_fixture
+
+
+class TestStatementTree(TestCase):
+    def setUp(self):
+        # 0: Assets (1: Current (2: Cash, 3: Receivables), 4: Other),
+        # 5: Liabilities (6: Debt)
+        self.tree = StatementTree(
+            [-1, 0, 1, 1, 0, -1, 5],
+            ['Assets', 'Current', 'Cash', 'Receivables', 'Other',
+             'Liabilities', 'Debt'])
+        self.values = np.array([[10.0, 20.0], [7.0, 14.0], [3.0, np.nan],
+                                [4.0, 5.0], [3.0, 6.0], [5.0, np.nan],
+                                [5.0, np.nan]])
+
+    def test_structure(self):
+        tree = self.tree
+        assert_array_equal([0, 1, 2, 2, 1, 0, 1], tree.depths)
+        assert_array_equal([0, 5], tree.roots)
+        assert_array_equal([0, 2, 4, 4, 4, 4, 5, 5], tree.offsets)
+        assert_array_equal([1, 4, 2, 3, 6], tree.children)
+        assert_array_equal([2, 3], tree.children_of(1))
+        assert_array_equal([False, False, True, True, True, False, True],
+                           tree.leaves)
+
+    def test_paths(self):
+        self.assertEqual(('Assets', 'Current', 'Receivables'),
+                         self.tree.path(3))
+        self.assertEqual(3, self.tree.find(['Assets', 'Current',
+                                            'Receivables']))
+        self.assertEqual(5, self.tree.find('Liabilities'))
+        self.assertEqual(-1, self.tree.find(('Current',)))
+
+    def test_sums(self):
+        assert_array_equal(
+            [[10.0, 20.0], [7.0, 5.0], [np.nan, np.nan], [np.nan, np.nan],
+             [np.nan, np.nan], [5.0, np.nan], [np.nan, np.nan]],
+            self.tree.children_sums(self.values))
+        assert_array_equal(
+            [[27.0, 45.0], [14.0, 19.0], [3.0, np.nan], [4.0, 5.0],
+             [3.0, 6.0], [10.0, np.nan], [5.0, np.nan]],
+            self.tree.subtree_sums(self.values))
+        assert_array_equal(
+            [[10.0, 11.0], [7.0, 5.0], [3.0, np.nan], [4.0, 5.0],
+             [3.0, 6.0], [5.0, np.nan], [5.0, np.nan]],
+            self.tree.subtree_sums(self.values, leaves_only=True))
+
+    def test_check(self):
+        mismatches = self.tree.check(self.values)
+        # Only the second period of 'Current' (14 != 5).
+        self.assertEqual([(1, 1)], list(zip(*np.nonzero(mismatches))))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            StatementTree([-1, 1], ['A', 'B'])
+        with self.assertRaises(ValueError):
+            StatementTree([1, 2, 1], ['A', 'B', 'C'])
+        with self.assertRaises(ValueError):
+            self.tree.subtree_sums(np.zeros((3, 2)))
+
+    def test_download(self):
+        fd = gm.FinancialsDownloader(transport=FixtureTransport(
+            read_fixture('financials_aapl_is.json')))
+        result = fd.download('AAPL')
+        statement = result['income_statement']
+        tree = result['trees']['income_statement']
+        self.assertEqual(len(statement), len(tree))
+        row = tree.find(('Operating expenses', 'Research and development'))
+        self.assertEqual('Research and development',
+                         statement['title'].iloc[row])
+        # The trees are shared by the statements with the same structure.
+        self.assertIs(tree, StatementTree.from_frame(statement.copy()))
+        self.assertIs(tree, fd.download('MSFT')['trees']['income_statement'])